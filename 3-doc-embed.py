@@ -15,33 +15,30 @@ from langchain_chroma import Chroma
 
 from langchain_openai import OpenAIEmbeddings
 
+from embedding_cache import CachedEmbeddings
+from embedding_pipeline import EmbeddingPipeline
+from ingest import find_files, iter_split_documents, index_documents
+from dedup import ChunkDeduplicator
+from sentence_compressor import index_sentences
+
 
 _ = load_dotenv(find_dotenv()) 
 openai.api_key  = os.environ['OPENAI_API_KEY']
 
 persist_directory = 'docs/chroma/'
 
-loaders = [
+pdf_files = [
     # Duplicate documents on purpose - messy data
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture01.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture01.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture02.pdf"),
-    PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture03.pdf")
+    "docs/cs229_lectures/MachineLearning-Lecture01.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture01.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture02.pdf",
+    "docs/cs229_lectures/MachineLearning-Lecture03.pdf"
 ]
-docs = []
-for loader in loaders:
-    docs.extend(loader.load())
-
-# Split
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size = 1500,
-    chunk_overlap = 150
-)
 
-splits = text_splitter.split_documents(docs)
+# Para ingerir um diretório inteiro:
+# pdf_files = find_files("docs/cs229_lectures")
 
-embedding = OpenAIEmbeddings()
+embedding = CachedEmbeddings(EmbeddingPipeline(OpenAIEmbeddings()))
 
 
 
@@ -59,15 +56,36 @@ def check_similarity():
     print(np.dot(embedding1, embedding3))
     print(np.dot(embedding2, embedding3))
 
-def store_docs():
+def with_sentences(batch):
+    # Frases dos chunks já no cache de embeddings: o EmbeddingSentenceCompressor
+    # do 4-doc-retrieval.py não paga a API por elas na hora da busca
+    index_sentences(embedding, batch)
+    return batch
 
-    vectordb = Chroma.from_documents(
-        documents=splits,
-        embedding=embedding,
-        persist_directory=persist_directory
+def store_docs(sentences=False):
+    # sentences=True embeda também cada frase dos chunks (mais ou menos o dobro do custo
+    # da indexação); só vale se a compressão for usada em quase todas as consultas.
+    # Sem isso, o compressor embeda as frases que aparecerem, uma vez, pelo mesmo cache
+
+    vectordb = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding
     )
 
-    vectordb.persist()
+    # Load + split em paralelo (um processo por arquivo); os lotes de chunks
+    # vão direto para o embedding/Chroma, sem materializar docs e splits
+    batches = iter_split_documents(pdf_files, chunk_size=1500, chunk_overlap=150)
+
+    # Duplicatas (como a Lecture01 repetida) são descartadas antes do embedding
+    dedup = ChunkDeduplicator(threshold=0.9)
+    batches = (dedup.filter(batch) for batch in batches)
+    if sentences:
+        batches = (with_sentences(batch) for batch in batches)
+    index_documents(vectordb, batches)
+    dedup.apply_late_merges(vectordb)
+    dedup.print_stats()
+
+    embedding.print_stats()
 
 
 def search():
@@ -98,6 +116,8 @@ def search():
     #print(docs[4].page_content)
 
 
-# check_similarity()
-# store_docs()
-search()
+# Necessário para o ProcessPoolExecutor do ingest.py
+if __name__ == "__main__":
+    # check_similarity()
+    # store_docs()
+    search()
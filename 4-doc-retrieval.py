@@ -24,13 +24,19 @@ from langchain.retrievers.document_compressors import LLMChainExtractor
 from langchain_community.retrievers import SVMRetriever
 from langchain_community.retrievers import TFIDFRetriever
 
+from embedding_cache import CachedEmbeddings
+from sentence_compressor import EmbeddingSentenceCompressor
+from query_constructor import FastQueryConstructor
+from mmr import as_retriever
+
 
 _ = load_dotenv(find_dotenv()) 
 openai.api_key  = os.environ['OPENAI_API_KEY']
 
 persist_directory = 'docs/chroma/'
 
-embedding = OpenAIEmbeddings()
+# Mesmo cache da indexação (3-doc-embed.py): vetores dos chunks e das frases já vistas
+embedding = CachedEmbeddings(OpenAIEmbeddings())
 
 def pretty_print_docs(docs):
     print(f"\n{'-' * 100}\n".join([f"Document {i+1}:\n\n" + d.page_content for i, d in enumerate(docs)]))
@@ -54,7 +60,9 @@ def mmr_search():
     smalldb = Chroma.from_texts(texts, embedding=embedding)
     question = "Tell me about all-white mushrooms with large fruiting bodies"
     print(smalldb.similarity_search(question, k=2))
-    print(smalldb.max_marginal_relevance_search(question,k=2, fetch_k=3))
+    #print(smalldb.max_marginal_relevance_search(question,k=2, fetch_k=3))
+    mmr_retriever = as_retriever(smalldb, search_type="mmr_matrix", search_kwargs={"k": 2, "fetch_k": 3})
+    print(mmr_retriever.invoke(question))
 
 def filter_search():
 
@@ -101,17 +109,32 @@ def filter_search():
         verbose=True
     )
 
+    # "third lecture", "lecture 3", "page 5"... viram filtro por regras, sem o LLM;
+    # o resto vai para o LLM uma vez e fica em cache pela pergunta normalizada
+    retriever.query_constructor = FastQueryConstructor(
+        retriever.query_constructor,
+        metadata_field_info,
+        document_content_description,
+        translator=retriever.structured_query_translator,
+        aliases={"source": ["aula"], "page": ["página"]}
+    )
+
     question = "what did they say about regression in the third lecture?"
 
     docs = retriever.invoke(question)
 
     for d in docs:
         print(d.metadata)
+    retriever.query_constructor.print_stats()
 
 def compression_search():
 
-    llm = OpenAI(temperature=0, model="gpt-3.5-turbo-instruct")
-    compressor = LLMChainExtractor.from_llm(llm)
+    #llm = OpenAI(temperature=0, model="gpt-3.5-turbo-instruct")
+    #compressor = LLMChainExtractor.from_llm(llm)
+
+    # Frases mais próximas da pergunta, escolhidas por embeddings: sem uma chamada
+    # ao LLM por documento
+    compressor = EmbeddingSentenceCompressor(embedding=embedding, max_sentences=3, max_tokens=400)
 
     vectordb = Chroma(
         persist_directory=persist_directory,
@@ -126,12 +149,15 @@ def compression_search():
     question = "what did they say about matlab?"
     compressed_docs = compression_retriever.invoke(question)
     pretty_print_docs(compressed_docs)
+    compressor.print_stats()
 
 
 def combined_search():
 
-    llm = OpenAI(temperature=0, model="gpt-3.5-turbo-instruct")
-    compressor = LLMChainExtractor.from_llm(llm)
+    #llm = OpenAI(temperature=0, model="gpt-3.5-turbo-instruct")
+    #compressor = LLMChainExtractor.from_llm(llm)
+
+    compressor = EmbeddingSentenceCompressor(embedding=embedding, max_sentences=3, max_tokens=400)
 
     vectordb = Chroma(
         persist_directory=persist_directory,
@@ -140,12 +166,14 @@ def combined_search():
 
     compression_retriever = ContextualCompressionRetriever(
         base_compressor=compressor,
-        base_retriever=vectordb.as_retriever(search_type = "mmr")
+        #base_retriever=vectordb.as_retriever(search_type = "mmr")
+        base_retriever=as_retriever(vectordb, search_type = "mmr_matrix")
     )
 
     question = "what did they say about matlab?"
     compressed_docs = compression_retriever.invoke(question)
     pretty_print_docs(compressed_docs)
+    compressor.print_stats()
 
 def other_search():
     loader = PyPDFLoader("docs/cs229_lectures/MachineLearning-Lecture01.pdf")
@@ -30,6 +30,11 @@ from langchain_community.retrievers import TFIDFRetriever
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
 
+from conversation_memory import ConversationWindow, SummaryWindowMemory
+from answer_cache import AnswerCache, CachedQAChain, file_version
+from context_packer import ContextPacker, PackedRetriever
+from map_chain import ConcurrentMapReduce, ConcurrentMapRerank, print_map_timings
+
 
 _ = load_dotenv(find_dotenv()) 
 openai.api_key  = os.environ['OPENAI_API_KEY']
@@ -82,26 +87,50 @@ def query_stuff():
     #print(result["result"])
 
 
+    # Os chunks vão para o prompt sem a sobreposição do splitter e dentro de um
+    # orçamento de tokens (os menos relevantes são cortados)
+    packer = ContextPacker(max_tokens=800, model=llm_name)
+
     qa_chain = RetrievalQA.from_chain_type(
         llm,
-        retriever=vectordb.as_retriever(),
+        retriever=PackedRetriever(retriever=vectordb.as_retriever(), packer=packer),
         return_source_documents=True,
         chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
     )
 
+    # Perguntas repetidas (ou quase) não passam de novo pelo retriever nem pelo LLM;
+    # o escopo muda quando a base do Chroma é reindexada
+    answer_cache = AnswerCache(embedding)
+    scope = "stuff:" + file_version(os.path.join(persist_directory, "chroma.sqlite3"))
+    qa_chain = CachedQAChain(qa_chain, answer_cache, scope=scope)
+
     question = "Is probability a class topic?"
 
     result = qa_chain({"query": question})
 
     print(result["result"])
+
+    result = qa_chain({"query": "is probability a class topic"})
+
+    print(result["result"], f"(cache: {result['cache_hit']})")
+    answer_cache.print_stats()
+    packer.print_stats()
     #pretty_print_docs(result["source_documents"])
 
 def query_map_reduce():
 
-    qa_chain = RetrievalQA.from_chain_type(
+    #qa_chain = RetrievalQA.from_chain_type(
+    #    llm,
+    #    retriever=vectordb.as_retriever(),
+    #    chain_type="map_reduce"
+    #)
+
+    # Uma chamada por documento, até 4 ao mesmo tempo (o RetrievalQA faz em série);
+    # com min_outputs o reduce começa sem esperar as mais lentas
+    qa_chain = ConcurrentMapReduce(
         llm,
         retriever=vectordb.as_retriever(),
-        chain_type="map_reduce"
+        max_concurrency=4
     )
 
     question = "Is probability a class topic?"
@@ -109,6 +138,7 @@ def query_map_reduce():
     result = qa_chain({"query": question})
 
     print(result["result"])
+    print_map_timings(result)
     #pretty_print_docs(result["source_documents"])
 
 def query_refine():
@@ -128,10 +158,18 @@ def query_refine():
 
 def query_map_rerank():
 
-    qa_chain = RetrievalQA.from_chain_type(
+    #qa_chain = RetrievalQA.from_chain_type(
+    #    llm,
+    #    retriever=vectordb.as_retriever(),
+    #    chain_type="map_rerank"
+    #)
+
+    # Para na primeira resposta com nota >= threshold, sem esperar os outros documentos
+    qa_chain = ConcurrentMapRerank(
         llm,
         retriever=vectordb.as_retriever(),
-        chain_type="map_rerank"
+        max_concurrency=4,
+        threshold=80
     )
 
     question = "Is probability a class topic?"
@@ -139,6 +177,7 @@ def query_map_rerank():
     result = qa_chain({"query": question})
 
     print(result["result"])
+    print_map_timings(result)
     #pretty_print_docs(result["source_documents"])
 
 def chat():
@@ -147,22 +186,30 @@ def chat():
 
     
     retriever=vectordb.as_retriever()
+
+    # No lugar do ConversationBufferMemory (que cresce sem limite): últimas trocas na
+    # íntegra, as antigas resumidas, e o histórico enviado fica em ~max_tokens
+    window_memory = SummaryWindowMemory(window=ConversationWindow(llm, max_turns=4, max_tokens=1000))
+
     qa = ConversationalRetrievalChain.from_llm(
         llm,
         retriever=retriever,
-        memory=memory
+        memory=window_memory
     )
 
     question = "Is probability a class topic?"
 
-    result = qa({"query": question})
+    result = qa({"question": question})
 
-    print(result["result"])
+    print(result["answer"])
 
     question = "why are those prerequesites needed?"
 
     result = qa({"question": question})
 
+    print(result["answer"])
+    window_memory.window.print_stats()
+
 
 # query_stuff()
 # query_map_reduce()
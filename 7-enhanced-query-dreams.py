@@ -1,77 +1,59 @@
+import argparse
 import os
-import openai
 import sys
-import json
-import numpy as np
+import time
 
 from dotenv import load_dotenv, find_dotenv
 
-from colorama import Fore, Style
+from colorama import Fore, Style, init
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy import sparse
-import joblib
-import pickle
+from lazy import Lazy
 
-from gliner import GLiNER
+# Startup leve: aqui só entram dotenv, colorama e módulos locais sem dependências.
+# LangChain, Chroma, scikit-learn, scipy, OpenAI e o GLiNER são importados/carregados
+# no primeiro uso (ou em segundo plano com --prewarm), então sair pelo menu é imediato.
+#
+#   python 7-enhanced-query-dreams.py --prewarm            # carrega a base enquanto o menu espera
+#   python 7-enhanced-query-dreams.py --prewarm-ner        # idem, e também o modelo do GLiNER
+#   python 7-enhanced-query-dreams.py --profile-imports    # tempo de import do startup e da primeira busca
+#   python 7-enhanced-query-dreams.py --batch consultas.txt --mode hybrid   # uma consulta por linha, em lote
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+_ = load_dotenv(find_dotenv())
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.document_loaders.generic import GenericLoader,  FileSystemBlobLoader
-from langchain_community.document_loaders.parsers import OpenAIWhisperParser
-from langchain_community.document_loaders.blob_loaders.youtube_audio import YoutubeAudioLoader
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.document_loaders import NotionDirectoryLoader
-from langchain_community.document_loaders import JSONLoader
+init(autoreset=True)
 
-from langchain_core.documents import Document
+# Módulos carregados só na primeira busca (usados também pelo --profile-imports)
+lazy_modules = ["langchain_openai", "dream_search", "entity_cache", "gliner"]
 
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 
-_ = load_dotenv(find_dotenv())
-openai.api_key  = os.environ['OPENAI_API_KEY']
+def create_engine():
+    from langchain_openai import OpenAIEmbeddings
+    from embedding_cache import CachedEmbeddings
+    from embedding_pipeline import EmbeddingPipeline
+    from dream_search import DreamSearchEngine
 
-embedding = OpenAIEmbeddings()
+    embedding = CachedEmbeddings(EmbeddingPipeline(OpenAIEmbeddings()))
+    return DreamSearchEngine(embedding)
 
-gliner = GLiNER.from_pretrained("urchade/gliner_base")
 
-def extract_entities(text):
+def create_entity_cache():
+    from entity_cache import EntityCache
+    from dream_indexer import entities_file
 
-    dream_labels = [
-        "Person",             # Pessoas reais ou imaginárias
-        "Animal",             # Animais comuns ou fantásticos
-        "Creature",           # Seres fantásticos ou híbridos
-        "Location",           # Locais reais ou simbólicos
-        "Object",             # Objetos com destaque simbólico
-        "Symbol",             # Símbolos abstratos (ex: cruz, espelho, túnel)
-        "Emotion",            # Emoções mencionadas ou sentidas (ex: medo, êxtase)
-        "Action",             # Ações relevantes (ex: fugir, cair, voar)
-        "Color",              # Cores citadas ou marcantes (ex: vermelho, dourado)
-        "BodyPart",           # Partes do corpo (ex: olhos, mãos, dentes)
-        "Weather",            # Clima (ex: chuva, neblina)
-        "Time",               # Marcação temporal (ex: noite, manhã, infância)
-        "SupernaturalEntity",# Entidades divinas, místicas ou espíritos
-        "VoiceOrSound",       # Vozes, gritos, ruídos
-        "Feeling",            # Sensações físicas ou espirituais
-        "Event",              # Situações como casamento, morte, fuga
-        "FamilyRelation",     # Irmão, pai, filho, etc
-        "Vehicle",            # Carros, trens, barcos
-        "Clothing",           # Roupas com destaque simbólico
-        "Food",               # Alimentos com carga afetiva ou simbólica
-    ]
-
-    labels = ["Pessoa", "Local", "Animal", "Conceito", "Data", "Cor"]
-    return gliner.predict_entities(text, dream_labels, threshold=0.5)
+    return EntityCache(entities_file)
 
-from colorama import Fore, Style, init
-init(autoreset=True)
 
-def pretty_print_dream(dream, score=None):
-    from colorama import Fore, Style
+engine = Lazy(create_engine, "engine")
+
+# Entidades vêm do cache (preenchido em lote por "python dream_indexer.py --entities");
+# o GLiNER só é carregado se algum chunk exibido ainda não tiver sido processado
+entity_cache = Lazy(create_entity_cache, "entity_cache")
+ner_model = Lazy(lambda: entity_cache.get().model, "gliner")
+
+def extract_entities(text):
+    return entity_cache.get().get(text)
 
+def pretty_print_dream(dream, score=None, entities=None):
     title = dream.metadata.get("title", "Sem título")
     date = dream.metadata.get("date", "Sem data")
     
@@ -79,7 +61,8 @@ def pretty_print_dream(dream, score=None):
     print(Fore.YELLOW + "🌙  Título: " + Fore.CYAN + f"{title}")
     print(Fore.YELLOW + "📖  Conteúdo:\n" + Fore.WHITE + f"{dream.page_content.strip()}")
 
-    entities = extract_entities(dream.page_content.strip())
+    if entities is None:
+        entities = extract_entities(dream.page_content)
 
     print(Fore.YELLOW + "📖  Entidades:")
     for entity in entities:
@@ -90,227 +73,150 @@ def pretty_print_dream(dream, score=None):
 
     print(Fore.MAGENTA + "🔮" + "═" * 60)
 
-persist_directory = 'vectordb/dreams/'
-tfidf_vectorizer_file = persist_directory+'tfidf_vectorizer.pkl'
-tfidf_matrix_file = persist_directory+'tfidf_matrix.npz'
-chunks_file = persist_directory + 'documents.pkl'
-
-def load_json_metadata(record: dict, metadata: dict) -> dict:
-    metadata["id"] = record.get("id")
-    metadata["title"] = record.get("title")
-    metadata["date"] = record.get("date")
-
-    return metadata
-
-def load_json():
-
-    if os.path.exists(chunks_file):
-        with open(chunks_file, 'rb') as f:
-            all_chunks = pickle.load(f)
-            return all_chunks
-
-    loader = JSONLoader(
-        file_path='docs/json/dreams.json',
-        jq_schema='.[]',
-        content_key='text',
-        metadata_func=load_json_metadata
-    )
-
-    docs = loader.load()
-
-    #print(len(docs))
-    #print(docs[0].page_content[0:200])
-    #print(docs[0].metadata)
-
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=300,
-        chunk_overlap=20,
-        separators=["\n\n", "\\n\\n", "\n", "\\n", ".", " ", ""]
-    )
-
-    all_chunks = []
-
-    for doc in docs:
-        chunks = splitter.split_text(doc.page_content)
-        for chunk in chunks:
-            all_chunks.append(Document(
-                page_content=chunk,
-                metadata=doc.metadata
-            ))
-
-    with open(chunks_file, 'wb') as f:
-        pickle.dump(all_chunks, f)
-
-    return all_chunks
-
-def build_semantic_index(all_chunks):
-
-    if not all_chunks:
-        all_chunks = load_json()
-        
-    vectordb = Chroma.from_documents(
-        documents=all_chunks,
-        embedding=embedding,
-        persist_directory=persist_directory
-    )
-
-    vectordb.persist()
-
-    print("Base vetorial salva com sucesso.")
-
-def build_tfidf_index(all_chunks):
-    
-    if not all_chunks:
-        all_chunks = load_json()
-
-    texts = [doc.page_content for doc in all_chunks]
-    vectorizer = TfidfVectorizer()
-    tfidf_matrix = vectorizer.fit_transform(texts)
-
-    # 1. Salva o modelo
-    joblib.dump(vectorizer, tfidf_vectorizer_file)
-
-    # 2. Salva a matriz esparsa
-    sparse.save_npz(tfidf_matrix_file, tfidf_matrix)
-
-def semantic_search(query, top_k=5):
-
-    if not os.path.exists(persist_directory):
-        build_semantic_index()
-    else:
-        print("Base já existe. Pulando criação.")
-        
-    vectordb = Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embedding
-    )
-
-    question = query
-    results = vectordb.similarity_search_with_score(question, k=top_k)
-
-    return results
-
-    # print ("================================================")
-    # print ("=== RESULTADOS DIVERGENTES =====================")
-    # print ("================================================")
-    # 
-    # results = vectordb.max_marginal_relevance_search(question,k=3, fetch_k=10)
-    # 
-    # for result in results:
-    #     pretty_print_dream(result)
-
-
-def tdidf_search(query, top_k=5):
-
-    all_chunks = load_json()
-
-    if not os.path.exists(tfidf_vectorizer_file) or not os.path.exists(tfidf_matrix_file):
-        build_tfidf_index(all_chunks)
-    else:
-        print("Base tdidf já existe. Pulando criação.")
-
-    tfidf_vectorizer = joblib.load(tfidf_vectorizer_file)
-    tfidf_matrix = sparse.load_npz(tfidf_matrix_file)
-
-    query_tfidf = tfidf_vectorizer.transform([query])
-    tfidf_scores = cosine_similarity(query_tfidf, tfidf_matrix)[0]
-
-    top_indices = np.argsort(tfidf_scores)[::-1][:top_k]
-
-    return [(all_chunks[i], tfidf_scores[i]) for i in top_indices]
-
-def hybrid_search(query, alpha=0.5, top_k=5):
-    """
-    alpha = peso do resultado semântico (0.0 a 1.0)
-    """
-
-    all_chunks = load_json()
-
-    if not os.path.exists(persist_directory):
-        build_semantic_index(all_chunks)
-    else:
-        print("Base semântica já existe. Pulando criação.")
-
-
-
-    if not os.path.exists(tfidf_vectorizer_file) or not os.path.exists(tfidf_matrix_file):
-        build_tfidf_index(all_chunks)
-    else:
-        print("Base tdidf já existe. Pulando criação.")
-
-    tfidf_vectorizer = joblib.load(tfidf_vectorizer_file)
-    tfidf_matrix = sparse.load_npz(tfidf_matrix_file)
-
-    vectordb = Chroma(
-        persist_directory=persist_directory,
-        embedding_function=embedding
-    )
-
-    # --- Parte 1: TF-IDF ---
-    query_tfidf = tfidf_vectorizer.transform([query])
-    tfidf_scores = cosine_similarity(query_tfidf, tfidf_matrix)[0]
-
-    # --- Parte 2: Embeddings semânticos ---
-    semantic_results = vectordb.similarity_search_with_score(query, k=len(all_chunks))
-    semantic_scores = np.zeros(len(all_chunks))
-
-    # Indexar por conteúdo (assumindo que o conteúdo é igual ao de TF-IDF)
-    content_to_index = {doc.page_content: i for i, doc in enumerate(all_chunks)}
-    for doc, score in semantic_results:
-        idx = content_to_index.get(doc.page_content)
-        if idx is not None:
-            semantic_scores[idx] = 1 - score  # 1 - distância para virar "similaridade"
-
-    # --- Combinar scores ---
-    final_scores = alpha * semantic_scores + (1 - alpha) * tfidf_scores
-    top_indices = np.argsort(final_scores)[::-1][:top_k]
-
-    return [(all_chunks[i], final_scores[i]) for i in top_indices]
 
+# Os índices são mantidos pelo dream_indexer.py: na primeira execução a base é
+# criada do zero; depois, "python dream_indexer.py" aplica só o delta do dreams.json.
+# O DreamSearchEngine carrega tudo uma vez e atende todas as buscas do menu.
+
+def print_results(results):
+    # Uma única consulta ao cache (e no máximo uma passada em lote no modelo) por busca
+    entities = entity_cache.get().get_many([doc.page_content for doc, _ in results])
+    for (result, score), result_entities in zip(results, entities):
+        pretty_print_dream(result, score, result_entities)
+
+def read_entity_filter():
+    from entity_index import parse_entity_filter
+
+    text = input("Filtro de entidades (ex: Location=mar, Emotion=medo|pavor) [Enter = nenhum]: ")
+    try:
+        return parse_entity_filter(text)
+    except ValueError as e:
+        print(f"{Fore.RED}{e}{Style.RESET_ALL}")
+        return {}
+
+def print_facets():
+    search = engine.get()
+    if search.entities is None:
+        print(f"{Fore.RED}Índice de entidades ausente: rode python dream_indexer.py --entities{Style.RESET_ALL}")
+        return
+    print("Rótulos: " + ", ".join(search.entities.labels))
+    label = input("Rótulo: ").strip()
+    entities = read_entity_filter()
+    for value, count in search.facets(label, entities, top=15):
+        print(f"{Fore.CYAN}{count:6d}{Style.RESET_ALL}  {value}")
 
 def run_menu():
     while True:
         print(f"\n{Fore.CYAN}=== MENU DE BUSCA ==={Style.RESET_ALL}")
-        print("1. Buscar com TF-IDF 🔍")
+        print("1. Buscar com BM25 🔍")
         print("2. Buscar com Semantic 🧠")
         print("3. Buscar com Hybrid 🧪")
-        print("4. Sair 🚪")
+        print("4. Entidades mais frequentes 🏷️")
+        print("5. Sair 🚪")
 
-        choice = input("Escolha uma opção (1-4): ").strip()
+        choice = input("Escolha uma opção (1-5): ").strip()
 
         if choice == "1" or choice == "2" or choice == "3":
             query = input("Digite sua busca: ")
+            entities = read_entity_filter()
             print(Fore.BLUE + "═" * 60)
             print(f"{Fore.GREEN}=== {query.upper()} {'═' * max(0, 60 - len(query) - 5)}{Style.RESET_ALL}")
             print(Fore.BLUE + "═" * 60)
 
         if choice == "1":
-            results = tdidf_search(query, top_k=5)
-            for result, score in results:
-                pretty_print_dream(result, score)
+            results = engine.get().lexical(query, top_k=5, entities=entities)
+            print_results(results)
 
         elif choice == "2":
-            results = semantic_search(query)
-            for result, score in results:
-                pretty_print_dream(result, score)
+            results = engine.get().semantic(query, top_k=5, entities=entities)
+            print_results(results)
 
         elif choice == "3":
             try:
                 alpha = float(input("Peso do embedding (0.0 a 1.0): "))
             except ValueError:
                 alpha = 0.5
-            results = hybrid_search(query, alpha=alpha, top_k=5)
-            for result, score in results:
-                pretty_print_dream(result, score)
+            fusion = "rrf" if input("Fusão: soma ponderada (p) ou RRF (r) [p]: ").strip().lower() == "r" else "weighted"
+            results = engine.get().hybrid(query, alpha=alpha, top_k=5, fusion=fusion, entities=entities)
+            print_results(results)
 
         elif choice == "4":
+            print_facets()
+
+        elif choice == "5":
             print(f"{Fore.YELLOW}Saindo...{Style.RESET_ALL}")
             break
         else:
             print(f"{Fore.RED}Opção inválida. Tente novamente.{Style.RESET_ALL}")
 
 
+def run_batch(path, mode="hybrid", top_k=5, entities=None):
+    """
+    Roda todas as consultas do arquivo (uma por linha) de uma vez e mostra o melhor de cada uma.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    search = engine.get()
+    batch_search = {"bm25": search.lexical_batch, "semantic": search.semantic_batch, "hybrid": search.hybrid_batch}[mode]
+
+    started = time.perf_counter()
+    results = batch_search(queries, top_k=top_k, entities=entities)
+    elapsed = time.perf_counter() - started
+
+    for query, query_results in zip(queries, results):
+        print(f"\n{Fore.GREEN}=== {query}{Style.RESET_ALL}")
+        for doc, score in query_results:
+            print(f"{Fore.YELLOW}{score:8.4f}{Style.RESET_ALL}  {doc.metadata.get('date', '')}  {doc.metadata.get('title', 'Sem título')}")
+
+    print(f"\n{len(queries)} consultas em {elapsed:.2f}s ({len(queries) / elapsed if elapsed else 0:.1f} consultas/s)")
+
+
+def profile_imports(budget=None, top=15):
+    """
+    Mostra o tempo de import do startup do script e dos módulos da primeira busca.
+    Retorna 1 se o startup passar do orçamento (em segundos).
+    """
+    from import_profile import profile_command, profile_modules, print_import_profile
+
+    entries, elapsed = profile_command([os.path.abspath(__file__), "--startup-only"])
+    startup = print_import_profile("Startup (até o menu)", entries, elapsed, top)
+
+    entries, elapsed = profile_modules(lazy_modules, cwd=os.path.dirname(os.path.abspath(__file__)))
+    print_import_profile("Primeira busca (carregado sob demanda)", entries, elapsed, top)
+
+    if budget is not None and startup > budget:
+        print(f"{Fore.RED}Startup em {startup:.2f}s passou do orçamento de {budget:.2f}s{Style.RESET_ALL}")
+        return 1
+    return 0
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Busca na base de sonhos")
+    parser.add_argument("--prewarm", action="store_true", help="carrega a base em segundo plano ao abrir o menu")
+    parser.add_argument("--prewarm-ner", action="store_true", help="também carrega o modelo do GLiNER em segundo plano")
+    parser.add_argument("--profile-imports", action="store_true", help="mostra o tempo de import e sai")
+    parser.add_argument("--budget", type=float, help="orçamento de startup em segundos (com --profile-imports)")
+    parser.add_argument("--batch", metavar="ARQUIVO", help="roda as consultas do arquivo (uma por linha) em lote e sai")
+    parser.add_argument("--mode", choices=("bm25", "semantic", "hybrid"), default="hybrid", help="busca usada com --batch")
+    parser.add_argument("--entities", default="", help="filtro de entidades para --batch (ex: Location=mar)")
+    parser.add_argument("--startup-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_only:
+        sys.exit(0)
+    if args.profile_imports:
+        sys.exit(profile_imports(args.budget))
+    if args.batch:
+        from entity_index import parse_entity_filter
+        run_batch(args.batch, args.mode, entities=parse_entity_filter(args.entities))
+        sys.exit(0)
+
+    if args.prewarm or args.prewarm_ner:
+        engine.prewarm()
+        entity_cache.prewarm()
+    if args.prewarm_ner:
+        ner_model.prewarm()
+
     run_menu()
     
\ No newline at end of file
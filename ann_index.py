@@ -0,0 +1,533 @@
+import json
+import uuid
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from topk import top_k_indices
+
+# Índice vetorial aproximado (IVF) em processo, sobre uma matriz float32.
+#
+# Os vetores são agrupados em nlist listas por k-means (coarse quantizer);
+# uma consulta só visita as nprobe listas com centróide mais próximo.
+# Cada lista fica contígua na memória, então pontuar uma lista é um único
+# produto matriz-vetor. Opcionalmente (pq_m) os resíduos são comprimidos com
+# product quantization (IVF-PQ): 1 byte por subespaço em vez de 4 bytes por dimensão.
+# O PQ sozinho perde recall (~0.4 de recall@10 com pq_m=16 em 64 dimensões), então
+# por padrão os k * rerank melhores são repontuados com os vetores completos (~0.97
+# com rerank=10): a varredura fica barata, mas a memória não diminui. rerank=0
+# guarda só os códigos, para quando a memória importa mais que o recall.
+# Inserções novas esperam num bloco pendente e entram na ordem por lista em lote.
+#
+# Parâmetros de recall/velocidade:
+#   nlist   número de listas (padrão: ~4 * sqrt(N); 1 = busca exata)
+#   nprobe  listas visitadas por consulta (mais = mais recall, mais lento)
+#   pq_m    subespaços do PQ (None = vetores completos, sem perda)
+#   rerank  com PQ, candidatos repontuados por resultado (0 = sem rerank)
+#
+# O ANNVectorStore expõe o índice como VectorStore do LangChain (as_retriever,
+# filtros por metadados como {"source": ...}, MMR) e salva tudo num único arquivo .npz.
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def default_nlist(n):
+    if n < 1024:
+        return 1
+    return int(4 * np.sqrt(n))
+
+
+def kmeans(vectors, k, n_iter=15, seed=0, spherical=True, sample_size=None):
+    """
+    k-means em lote. spherical=True usa similaridade de cosseno (centróides normalizados).
+    """
+    generator = np.random.default_rng(seed)
+    if sample_size and len(vectors) > sample_size:
+        vectors = vectors[generator.choice(len(vectors), sample_size, replace=False)]
+
+    k = min(k, len(vectors))
+    centroids = vectors[generator.choice(len(vectors), k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign(vectors, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+
+        empty = counts == 0
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        # Lista vazia: reinicia com um ponto aleatório
+        if empty.any():
+            centroids[empty] = vectors[generator.choice(len(vectors), int(empty.sum()))]
+        if spherical:
+            centroids = normalize_rows(centroids)
+
+    return centroids.astype(np.float32)
+
+
+def assign(vectors, centroids, spherical=True, batch_size=65536):
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        if spherical:
+            assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+        else:
+            # ||x - c||² = ||x||² - 2 x·c + ||c||² (o ||x||² não muda o argmin)
+            assignments[start:start + batch_size] = np.argmin(centroid_norms - 2 * batch @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex:
+
+    def __init__(self, dim, nlist=None, nprobe=8, pq_m=None, n_iter=15, seed=0, rerank=10, merge_every=4096):
+        """
+        rerank (só com PQ): os k * rerank melhores pelo PQ são repontuados com os vetores
+        completos, guardados à parte. 0 = sem rerank e sem os vetores completos (só os
+        códigos na memória, com perda de recall).
+        merge_every: inserções ficam num bloco pendente até passar disso (ou de 1/8 do índice).
+        """
+        if pq_m is not None and dim % pq_m:
+            raise ValueError(f"pq_m ({pq_m}) precisa dividir a dimensão ({dim})")
+
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.n_iter = n_iter
+        self.seed = seed
+        self.rerank = rerank if pq_m else 0
+        self.merge_every = merge_every
+
+        self.centroids = None
+        self.codebooks = None  # (pq_m, 256, dim / pq_m)
+
+        # Armazenamento ordenado por lista: data[offsets[l]:offsets[l+1]] é a lista l
+        self.data = np.zeros((0, pq_m or dim), dtype=np.uint8 if pq_m else np.float32)
+        self.full = np.zeros((0, dim), dtype=np.float32) if self.rerank else None  # vetores do rerank
+        self.rows = np.zeros(0, dtype=np.int64)          # posição -> linha (ordem de inserção)
+        self.lists = np.zeros(0, dtype=np.int64)         # posição -> lista
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.positions = np.zeros(0, dtype=np.int64)     # linha -> posição
+
+        # Inserções ainda fora da ordem por lista: [(data, full, lists)], linhas a partir de len(self.rows)
+        self._pending = []
+        self._pending_arrays = None
+
+    def __len__(self):
+        return len(self.rows) + sum(len(lists) for _, _, lists in self._pending)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    # --- Treino / inserção ---
+
+    def train(self, vectors):
+        vectors = normalize_rows(vectors)
+        nlist = self.nlist or default_nlist(len(vectors))
+        self.centroids = kmeans(vectors, nlist, self.n_iter, self.seed, sample_size=max(nlist * 64, 65536))
+
+        if self.pq_m:
+            residuals = vectors - self.centroids[assign(vectors, self.centroids)]
+            sub_dim = self.dim // self.pq_m
+            self.codebooks = np.stack([
+                kmeans(residuals[:, j * sub_dim:(j + 1) * sub_dim], 256, self.n_iter, self.seed + j,
+                       spherical=False, sample_size=65536)
+                for j in range(self.pq_m)
+            ])
+
+    def encode(self, vectors, lists):
+        residuals = vectors - self.centroids[lists]
+        sub_dim = self.dim // self.pq_m
+        codes = np.empty((len(vectors), self.pq_m), dtype=np.uint8)
+        for j in range(self.pq_m):
+            codes[:, j] = assign(residuals[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j], spherical=False)
+        return codes
+
+    def add(self, vectors):
+        vectors = normalize_rows(vectors)
+        first_row = len(self)
+        new_rows = np.arange(first_row, first_row + len(vectors))
+        if not self.is_trained:
+            self.train(vectors)
+
+        new_lists = assign(vectors, self.centroids)
+        new_data = self.encode(vectors, new_lists) if self.pq_m else vectors
+        new_full = vectors if self.rerank else None
+
+        # Reordenar tudo a cada inserção seria O(N) por add: as novas linhas esperam num
+        # bloco pendente (pontuado à parte na busca) e entram na ordem por lista em lote.
+        # O primeiro add entra direto (não há nada ordenado para refazer)
+        self._pending.append((new_data, new_full, new_lists))
+        self._pending_arrays = None
+        if not len(self.rows) or len(self) - len(self.rows) >= max(self.merge_every, len(self.rows) // 8):
+            self.merge()
+        return new_rows
+
+    def _pending_block(self):
+        if self._pending_arrays is None:
+            data, full, lists = zip(*self._pending)
+            self._pending_arrays = (np.concatenate(data), np.concatenate(full) if self.rerank else None,
+                                    np.concatenate(lists))
+        return self._pending_arrays
+
+    def merge(self):
+        """
+        Coloca as inserções pendentes na ordem por lista.
+        """
+        if not self._pending:
+            return
+        data, full, lists = self._pending_block()
+        first_row = len(self.rows)
+        self._rebuild(
+            np.concatenate([self.data, data]),
+            np.concatenate([self.full, full]) if self.rerank else None,
+            np.concatenate([self.rows, np.arange(first_row, first_row + len(lists))]),
+            np.concatenate([self.lists, lists]),
+        )
+        self._pending = []
+        self._pending_arrays = None
+
+    def _rebuild(self, data, full, rows, lists):
+        order = np.argsort(lists, kind="stable")
+        self.data = np.ascontiguousarray(data[order])
+        self.full = np.ascontiguousarray(full[order]) if full is not None else None
+        self.rows = rows[order]
+        self.lists = lists[order]
+        counts = np.bincount(self.lists, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.positions = np.empty(len(self.rows), dtype=np.int64)
+        self.positions[self.rows] = np.arange(len(self.rows))
+
+    def retrain(self, nlist=None):
+        """
+        Refaz as listas (ex: o índice cresceu muito desde o treino). Com PQ, só se os
+        vetores completos estão guardados (rerank).
+        """
+        if self.pq_m and not self.rerank:
+            raise ValueError("retrain() precisa dos vetores completos; reconstrua o índice com PQ a partir dos dados")
+        self.merge()
+        vectors = (self.full if self.pq_m else self.data)[self.positions]
+        self.nlist = nlist or self.nlist
+        self.train(vectors)
+        lists = assign(vectors, self.centroids)
+        data = self.encode(vectors, lists) if self.pq_m else vectors
+        self._rebuild(data, vectors if self.rerank else None, np.arange(len(vectors)), lists)
+
+    # --- Busca ---
+
+    def _score(self, query, data, lists, tables=None, coarse=None):
+        if not self.pq_m:
+            return data @ query
+        return coarse[lists] + tables[np.arange(self.pq_m), data].sum(axis=1)
+
+    def _pq_tables(self, query):
+        sub_dim = self.dim // self.pq_m
+        # Para produto interno a tabela não depende da lista: q·x = q·c + Σ q_j·r_j
+        return np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.pq_m, sub_dim))
+
+    def search(self, query, k, nprobe=None, mask=None, exact_threshold=2048):
+        """
+        Retorna (linhas, similaridades de cosseno) dos k vizinhos mais próximos.
+        mask: bool por linha com as linhas permitidas (filtros). Se sobram poucas
+        linhas permitidas, pontua todas elas (exato) em vez de visitar listas.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        query = normalize_rows(query)
+        coarse = self.centroids @ query
+        tables = self._pq_tables(query) if self.pq_m else None
+        sorted_rows = len(self.rows)
+
+        exact = mask is not None and mask.sum() <= exact_threshold
+        if exact:
+            positions = self.positions[np.flatnonzero(mask[:sorted_rows])]
+        else:
+            probes = top_k_indices(coarse, nprobe or self.nprobe)
+            positions = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probes])
+            if mask is not None:
+                positions = positions[mask[self.rows[positions]]]
+        rows = self.rows[positions]
+        scores = self._score(query, self.data[positions], self.lists[positions], tables, coarse)
+        full = self.full[positions] if self.rerank else None
+
+        if self._pending:
+            # Bloco pendente: as linhas das listas visitadas (ou as permitidas pelo filtro)
+            data, pending_full, lists = self._pending_block()
+            pending_rows = np.arange(sorted_rows, sorted_rows + len(lists))
+            keep = np.ones(len(lists), dtype=bool) if exact else np.isin(lists, probes)
+            if mask is not None:
+                keep &= mask[pending_rows]
+            rows = np.concatenate([rows, pending_rows[keep]])
+            scores = np.concatenate([scores, self._score(query, data[keep], lists[keep], tables, coarse)])
+            if self.rerank:
+                full = np.concatenate([full, pending_full[keep]])
+
+        if self.rerank:
+            # O PQ só escolhe os candidatos; a ordem final vem dos vetores completos
+            candidates = top_k_indices(scores, k * self.rerank)
+            rows, scores = rows[candidates], full[candidates] @ query
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+    def reconstruct(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._pending and len(rows) and rows.max() >= len(self.rows):
+            self.merge()
+        positions = self.positions[rows]
+        if not self.pq_m:
+            return self.data[positions]
+        if self.rerank:
+            return self.full[positions]
+        codes = self.data[positions]
+        residuals = np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.pq_m)], axis=1)
+        return normalize_rows(self.centroids[self.lists[positions]] + residuals)
+
+    # --- Persistência ---
+
+    def to_arrays(self):
+        self.merge()
+        arrays = {
+            "params": np.array([self.dim, self.nlist or 0, self.nprobe, self.pq_m or 0, self.n_iter, self.seed,
+                                self.rerank]),
+            "data": self.data, "rows": self.rows, "lists": self.lists,
+        }
+        if self.centroids is not None:
+            arrays["centroids"] = self.centroids
+        if self.codebooks is not None:
+            arrays["codebooks"] = self.codebooks
+        if self.rerank:
+            arrays["full"] = self.full
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        params = [int(v) for v in arrays["params"]]
+        dim, nlist, nprobe, pq_m, n_iter, seed = params[:6]
+        # Arquivos de antes do rerank: PQ sem os vetores completos
+        rerank = params[6] if len(params) > 6 else 0
+        index = cls(dim, nlist or None, nprobe, pq_m or None, n_iter, seed, rerank=rerank)
+        if "centroids" in arrays:
+            index.centroids = arrays["centroids"]
+            index.codebooks = arrays["codebooks"] if "codebooks" in arrays else None
+            index._rebuild(arrays["data"], arrays["full"] if index.rerank else None, arrays["rows"], arrays["lists"])
+        return index
+
+
+class ANNVectorStore(VectorStore):
+    """
+    VectorStore do LangChain sobre o IVFIndex. Substitui o DocArrayInMemorySearch
+    (busca exaustiva) e pode ser usado no lugar do Chroma:
+
+        db = ANNVectorStore.from_documents(docs, embedding, nprobe=16)
+        db.as_retriever(search_kwargs={"k": 4, "filter": {"source": "..."}})
+        db.save("vectordb/lectures.npz"); ANNVectorStore.load("vectordb/lectures.npz", embedding)
+    """
+
+    def __init__(self, embedding, nlist=None, nprobe=8, pq_m=None, exact_threshold=2048, rerank=10):
+        self._embedding = embedding
+        self.index_params = {"nlist": nlist, "nprobe": nprobe, "pq_m": pq_m, "rerank": rerank}
+        self.exact_threshold = exact_threshold
+        self.index = None
+
+        self.texts = []
+        self.metadatas = []
+        self.ids = []
+        self.id_to_row = {}
+        self.deleted = np.zeros(0, dtype=bool)
+        self._postings = {}  # chave de metadado -> {valor: linhas}, montado sob demanda
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self.ids) - int(self.deleted.sum())
+
+    @property
+    def nbytes(self):
+        """
+        Memória aproximada: arrays do índice + textos e metadados (como JSON).
+        """
+        arrays = self.index.to_arrays().values() if self.index is not None else []
+        payload = sum(len(t.encode("utf-8")) for t in self.texts)
+        payload += sum(len(json.dumps(m, ensure_ascii=False)) for m in self.metadatas)
+        return sum(a.nbytes for a in arrays) + payload + self.deleted.nbytes
+
+    # --- Inserção / remoção ---
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        if not texts:
+            return []
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = IVFIndex(vectors.shape[1], **self.index_params)
+
+        # Ids repetidos substituem o documento anterior
+        self.delete([i for i in ids if i in self.id_to_row])
+
+        rows = self.index.add(vectors)
+        for row, text, metadata, doc_id in zip(rows, texts, metadatas, ids):
+            self.texts.append(text)
+            self.metadatas.append(dict(metadata))
+            self.ids.append(doc_id)
+            self.id_to_row[doc_id] = int(row)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(rows), dtype=bool)])
+        self._postings.clear()
+
+        # Índice auto-dimensionado cresceu muito além do treino: refaz as listas
+        if (self.index_params["nlist"] is None and not self.index_params["pq_m"]
+                and default_nlist(len(self.index)) >= 2 * len(self.index.centroids)):
+            self.index.retrain(default_nlist(len(self.index)))
+
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        for doc_id in ids or []:
+            row = self.id_to_row.pop(doc_id, None)
+            if row is not None:
+                self.deleted[row] = True
+        return True
+
+    def get_by_ids(self, ids):
+        return [self._document(self.id_to_row[i]) for i in ids if i in self.id_to_row]
+
+    def _document(self, row):
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+    # --- Filtros ---
+
+    def _rows_for(self, key, value):
+        if key not in self._postings:
+            postings = {}
+            for row, metadata in enumerate(self.metadatas):
+                if key in metadata:
+                    postings.setdefault(json.dumps(metadata[key], sort_keys=True), []).append(row)
+            self._postings[key] = {v: np.array(rows) for v, rows in postings.items()}
+        return self._postings[key].get(json.dumps(value, sort_keys=True), np.zeros(0, dtype=np.int64))
+
+    def _filter_mask(self, filter):
+        """
+        Aceita {"campo": valor}, {"campo": {"$in": [...]}} ou {"$and": [...]}
+        (o mesmo subconjunto de sintaxe do Chroma usado nos scripts).
+        """
+        mask = ~self.deleted
+        if not filter:
+            return mask
+
+        conditions = filter["$and"] if "$and" in filter else [{k: v} for k, v in filter.items()]
+        for condition in conditions:
+            for key, value in condition.items():
+                if isinstance(value, dict) and "$eq" in value:
+                    values = [value["$eq"]]
+                elif isinstance(value, dict) and "$in" in value:
+                    values = value["$in"]
+                elif isinstance(value, dict):
+                    raise ValueError(f"Operador de filtro não suportado: {value}")
+                else:
+                    values = [value]
+                allowed = np.zeros(len(self.ids), dtype=bool)
+                for v in values:
+                    allowed[self._rows_for(key, v)] = True
+                mask &= allowed
+        return mask
+
+    # --- Busca ---
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, nprobe=None, **kwargs):
+        if self.index is None:
+            return []
+        mask = self._filter_mask(filter)
+        rows, scores = self.index.search(embedding, k, nprobe=nprobe, mask=mask,
+                                         exact_threshold=self.exact_threshold)
+        return [(self._document(int(row)), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter, **kwargs)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Scores são similaridades de cosseno em [-1, 1]
+        return lambda score: (score + 1) / 2
+
+    def mmr_candidates(self, embedding, fetch_k=20, filter=None, nprobe=None):
+        """
+        (linhas, vetores normalizados) dos fetch_k mais próximos, em ordem de relevância.
+        """
+        if self.index is None:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(embedding)), dtype=np.float32)
+        mask = self._filter_mask(filter)
+        rows, _ = self.index.search(embedding, fetch_k, nprobe=nprobe, mask=mask,
+                                    exact_threshold=self.exact_threshold)
+        return rows, normalize_rows(self.index.reconstruct(rows))
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5,
+                                                filter=None, nprobe=None, **kwargs):
+        from mmr import mmr_select
+
+        rows, candidates = self.mmr_candidates(embedding, fetch_k, filter, nprobe)
+        selected = mmr_select(normalize_rows(embedding), candidates, k, lambda_mult, normalized=True)
+        return [self._document(int(rows[i])) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k, fetch_k, lambda_mult, filter, **kwargs)
+
+    # --- Construção / persistência ---
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def save(self, path):
+        """
+        Salva índice, textos e metadados num único arquivo .npz.
+        """
+        payload = json.dumps({
+            "texts": self.texts, "metadatas": self.metadatas, "ids": self.ids,
+            "index_params": self.index_params, "exact_threshold": self.exact_threshold,
+        }, ensure_ascii=False).encode("utf-8")
+        arrays = self.index.to_arrays() if self.index is not None else {}
+        np.savez(path, payload=np.frombuffer(payload, dtype=np.uint8), deleted=self.deleted, **arrays)
+
+    @classmethod
+    def load(cls, path, embedding):
+        with np.load(path) as arrays:
+            payload = json.loads(arrays["payload"].tobytes().decode("utf-8"))
+            store = cls(embedding, exact_threshold=payload["exact_threshold"], **payload["index_params"])
+            store.texts = payload["texts"]
+            store.metadatas = payload["metadatas"]
+            store.ids = payload["ids"]
+            store.deleted = arrays["deleted"]
+            store.id_to_row = {doc_id: row for row, doc_id in enumerate(store.ids) if not store.deleted[row]}
+            if "params" in arrays:
+                store.index = IVFIndex.from_arrays({name: arrays[name] for name in arrays.files})
+        return store
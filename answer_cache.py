@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+# Cache semântico de respostas do QA (RetrievalQA, ConversationalRetrievalChain).
+#
+# Busca em dois passos, sempre dentro do mesmo escopo (versão da base de documentos):
+#   1. exata: hash da pergunta normalizada (sem acento, caixa, pontuação e espaços extras)
+#   2. próxima: similaridade de cosseno entre o embedding da pergunta e o das perguntas
+#      já respondidas, acima de threshold
+# O escopo entra na chave: reindexou os documentos, o escopo muda e as respostas
+# antigas deixam de ser encontradas (e acabam descartadas pelo LRU).
+#
+# As respostas ficam num SQLite (TTL + LRU por entradas); os embeddings de cada
+# escopo são carregados uma vez numa matriz float32, e a busca próxima é um único
+# produto matriz-vetor.
+#
+# Só perguntas sem histórico de conversa são cacheadas: numa conversa, "e por quê?"
+# depende das trocas anteriores.
+
+default_cache_file = 'vectordb/answer_cache.sqlite'
+
+
+def normalize_question(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def answer_key(scope, normalized):
+    return hashlib.sha256(f"{scope}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+def file_version(path):
+    """
+    Versão de um arquivo ou diretório de índice (ex: o chroma.sqlite3) para usar como escopo.
+    """
+    paths = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in os.walk(path)
+                                                 for name in names]
+    stats = [os.stat(p) for p in sorted(paths)]
+    return hashlib.sha256(json.dumps([(s.st_mtime_ns, s.st_size) for s in stats]).encode("utf-8")).hexdigest()[:16]
+
+
+def dump_outputs(outputs):
+    # Documentos viram dicts; o resto da saída do chain precisa ser serializável em JSON.
+    # Lista vazia também (ex: source_documents quando o ContextPacker não coube nada)
+    serialized = {}
+    for name, value in outputs.items():
+        if isinstance(value, list) and all(isinstance(d, Document) for d in value):
+            serialized[name] = {"documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in value]}
+        elif isinstance(value, (str, int, float, bool, type(None))):
+            serialized[name] = value
+    return json.dumps(serialized, ensure_ascii=False)
+
+
+def load_outputs(payload):
+    outputs = json.loads(payload)
+    for name, value in outputs.items():
+        if isinstance(value, dict) and "documents" in value:
+            outputs[name] = [Document(**d) for d in value["documents"]]
+    return outputs
+
+
+class AnswerCache:
+
+    def __init__(self, embedding, cache_file=default_cache_file, threshold=0.95, ttl=7 * 24 * 3600,
+                 max_entries=10_000):
+        """
+        embedding = Embeddings das perguntas (None = só busca exata).
+        ttl em segundos (None = não expira).
+        """
+        self.embedding = embedding
+        self.cache_file = cache_file
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY,"
+            " scope TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " outputs TEXT NOT NULL,"
+            " vector BLOB,"
+            " created REAL NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers(scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM answers").fetchone()
+        self._clock = row[0]
+
+        # escopo -> (chaves, matriz normalizada das perguntas)
+        self._vectors = {}
+        # Embedding da última pergunta sem hit: o store() logo em seguida não embeda de novo
+        self._last_vector = None
+
+    # --- Armazenamento ---
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _expired_before(self):
+        return time.time() - self.ttl if self.ttl else None
+
+    def _scope_vectors(self, scope):
+        if scope not in self._vectors:
+            rows = self._conn.execute(
+                "SELECT key, vector FROM answers WHERE scope = ? AND vector IS NOT NULL", (scope,)
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            matrix = np.array([np.frombuffer(blob, dtype=np.float32) for _, blob in rows], dtype=np.float32)
+            self._vectors[scope] = (keys, matrix)
+        return self._vectors[scope]
+
+    def _embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _fetch(self, key):
+        row = self._conn.execute("SELECT outputs, created FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        outputs, created = row
+        expired_before = self._expired_before()
+        if expired_before is not None and created < expired_before:
+            return None
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (self._tick(), key))
+        return load_outputs(outputs)
+
+    def _evict(self):
+        expired_before = self._expired_before()
+        removed = 0
+        if expired_before is not None:
+            removed += self._conn.execute("DELETE FROM answers WHERE created < ?", (expired_before,)).rowcount
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            removed += self._conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                " SELECT key FROM answers ORDER BY last_used ASC LIMIT ?)", (excess,)
+            ).rowcount
+        if removed:
+            self._vectors.clear()
+
+    # --- Interface ---
+
+    def lookup(self, question, scope):
+        """
+        (saída do chain, "exact" | "semantic") ou (None, None).
+        """
+        normalized = normalize_question(question)
+        key = answer_key(scope, normalized)
+
+        with self._lock:
+            outputs = self._fetch(key)
+            if outputs is not None:
+                self.exact_hits += 1
+                self._conn.commit()
+                return outputs, "exact"
+
+        if self.embedding is None:
+            with self._lock:
+                self.misses += 1
+            return None, None
+
+        vector = self._embed(question)
+        with self._lock:
+            keys, matrix = self._scope_vectors(scope)
+            if len(keys):
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    outputs = self._fetch(keys[best])
+                    if outputs is not None:
+                        self.semantic_hits += 1
+                        self._conn.commit()
+                        return outputs, "semantic"
+            self.misses += 1
+        self._last_vector = (question, vector)
+        return None, None
+
+    def store(self, question, scope, outputs):
+        normalized = normalize_question(question)
+        key = answer_key(scope, normalized)
+
+        vector = None
+        if self.embedding is not None:
+            last = self._last_vector
+            vector = last[1] if last is not None and last[0] == question else self._embed(question)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, scope, question, outputs, vector, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, question, dump_outputs(outputs), vector.tobytes() if vector is not None else None,
+                 time.time(), self._tick())
+            )
+            if vector is not None and scope in self._vectors:
+                keys, matrix = self._vectors[scope]
+                if key not in keys:
+                    self._vectors[scope] = (keys + [key], np.vstack([matrix.reshape(-1, len(vector)), vector]))
+            self._evict()
+            self._conn.commit()
+
+    # --- Métricas ---
+
+    def stats(self):
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / total if total else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Cache de respostas: {stats['exact_hits']} hits exatos, {stats['semantic_hits']} por similaridade, "
+              f"{stats['misses']} misses ({stats['hit_rate']:.1%} reaproveitado)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedQAChain:
+    """
+    Coloca o AnswerCache na frente de um chain de QA:
+
+        qa = CachedQAChain(RetrievalQA.from_chain_type(...), cache, scope=file_version(persist_directory))
+        qa.invoke({"query": "Is probability a class topic?"})
+
+    A saída ganha "cache_hit": "exact", "semantic" ou None.
+    """
+
+    def __init__(self, chain, cache, scope, question_key=None):
+        self.chain = chain
+        self.cache = cache
+        self.scope = scope
+        # RetrievalQA usa "query"; ConversationalRetrievalChain, "question"
+        self.question_key = question_key or chain.input_keys[0]
+
+    def _cacheable(self, inputs):
+        return not inputs.get("chat_history") and not getattr(self.chain, "memory", None)
+
+    def invoke(self, inputs, **kwargs):
+        if not self._cacheable(inputs):
+            return {**self.chain.invoke(inputs, **kwargs), "cache_hit": None}
+        question = inputs[self.question_key]
+        outputs, hit = self.cache.lookup(question, self.scope)
+        if outputs is not None:
+            return {**outputs, "cache_hit": hit}
+        outputs = self.chain.invoke(inputs, **kwargs)
+        self.cache.store(question, self.scope, outputs)
+        return {**outputs, "cache_hit": None}
+
+    async def ainvoke(self, inputs, **kwargs):
+        if not self._cacheable(inputs):
+            return {**await self.chain.ainvoke(inputs, **kwargs), "cache_hit": None}
+        question = inputs[self.question_key]
+        outputs, hit = self.cache.lookup(question, self.scope)
+        if outputs is not None:
+            return {**outputs, "cache_hit": hit}
+        outputs = await self.chain.ainvoke(inputs, **kwargs)
+        self.cache.store(question, self.scope, outputs)
+        return {**outputs, "cache_hit": None}
+
+    def __call__(self, inputs):
+        return self.invoke(inputs)
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import os
+import time
+
+import numpy as np
+
+# Execução assíncrona de chains (ConversationalRetrievalChain, RetrievalQA...) com
+# limite de concorrência e fila de espera.
+#
+# O chatbot.py chama o chain com ainvoke dentro do callback async do Panel: enquanto
+# a busca e o LLM respondem, o event loop do servidor atende as outras sessões.
+# O ChainRunner limita quantos chains rodam ao mesmo tempo (max_concurrency) e
+# quantos podem esperar na fila (max_queue); acima disso o pedido é recusado na
+# hora com QueueFull, em vez de acumular latência para todo mundo.
+#
+# stream_chain() roda o chain com astream_events e entrega os documentos assim que
+# a busca termina e a resposta token a token, medindo o tempo até o primeiro token
+# (TTFT). Só o LLM marcado com a tag "answer" é transmitido: a condensação da
+# pergunta também chama um LLM, mas o usuário não vê esse texto.
+#
+# Teste de carga contra o servidor falso (nada vai para a OpenAI):
+#
+#   python async_chain.py --sessions 30 --turns 2 --latency 0.5 --max-concurrency 8
+#   python async_chain.py --stream --token-latency 0.02     # TTFT x tempo total
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class ChainRunner:
+
+    def __init__(self, max_concurrency=8, max_queue=64, timeout=None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_times = collections.deque(maxlen=1000)
+        self.run_times = collections.deque(maxlen=1000)
+
+        self._loop = None
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        # O semáforo pertence a um event loop: recria se o loop mudou (ex: vários asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        Espera uma vaga de execução. Fila cheia -> QueueFull.
+        """
+        semaphore = self._get_semaphore()
+        if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(f"Servidor ocupado: {self.active} em execução e {self.waiting} na fila")
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.wait_times.append(started - queued)
+        self.active += 1
+        try:
+            yield
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+        self.completed += 1
+        self.run_times.append(time.perf_counter() - started)
+
+    async def ainvoke(self, chain, inputs, **kwargs):
+        async with self.slot():
+            return await asyncio.wait_for(chain.ainvoke(inputs, **kwargs), self.timeout)
+
+    async def astream_events(self, chain, inputs, **kwargs):
+        """
+        chain.astream_events(inputs) ocupando uma vaga até o último evento.
+        """
+        async with self.slot():
+            deadline = time.monotonic() + self.timeout if self.timeout else None
+            events = chain.astream_events(inputs, version="v2", **kwargs)
+            try:
+                while True:
+                    # O prazo vale também para a espera do próximo evento (LLM parado não manda nada)
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise asyncio.TimeoutError(f"Chain passou de {self.timeout}s")
+                    try:
+                        event = await asyncio.wait_for(events.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise asyncio.TimeoutError(f"Chain passou de {self.timeout}s")
+                    yield event
+            finally:
+                await events.aclose()
+
+    # --- Métricas ---
+
+    def stats(self):
+        percentile = lambda values, q: float(np.percentile(values, q)) if values else 0.0
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_p50_s": percentile(self.wait_times, 50),
+            "wait_p95_s": percentile(self.wait_times, 95),
+            "run_p50_s": percentile(self.run_times, 50),
+            "run_p95_s": percentile(self.run_times, 95),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Chains: {stats['completed']} concluídos, {stats['failed']} com erro, {stats['rejected']} recusados "
+              f"(fila cheia); agora {stats['active']} rodando e {stats['waiting']} na fila")
+        print(f"Espera na fila p50/p95: {stats['wait_p50_s']:.2f}s / {stats['wait_p95_s']:.2f}s; "
+              f"execução p50/p95: {stats['run_p50_s']:.2f}s / {stats['run_p95_s']:.2f}s")
+
+
+class StreamTimer:
+    """
+    Tempos de uma resposta transmitida: busca, primeiro token (TTFT) e total.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.retrieval_s = None
+        self.ttft_s = None
+        self.total_s = None
+        self.tokens = 0
+
+    def retrieval_done(self):
+        self.retrieval_s = time.perf_counter() - self.started
+
+    def token(self):
+        if self.ttft_s is None:
+            self.ttft_s = time.perf_counter() - self.started
+        self.tokens += 1
+
+    def done(self):
+        self.total_s = time.perf_counter() - self.started
+
+    def summary(self):
+        parts = []
+        if self.retrieval_s is not None:
+            parts.append(f"busca {self.retrieval_s:.2f}s")
+        if self.ttft_s is not None:
+            parts.append(f"primeiro token {self.ttft_s:.2f}s")
+        if self.total_s is not None:
+            parts.append(f"total {self.total_s:.2f}s ({self.tokens} tokens)")
+        return ", ".join(parts)
+
+
+class StreamStats:
+    """
+    TTFT e tempo total das últimas respostas transmitidas.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.ttft = collections.deque(maxlen=max_entries)
+        self.total = collections.deque(maxlen=max_entries)
+
+    def record(self, timer):
+        if timer.ttft_s is not None:
+            self.ttft.append(timer.ttft_s)
+        if timer.total_s is not None:
+            self.total.append(timer.total_s)
+
+    def stats(self):
+        percentile = lambda values, q: float(np.percentile(values, q)) if values else 0.0
+        return {
+            "responses": len(self.total),
+            "ttft_p50_s": percentile(self.ttft, 50),
+            "ttft_p95_s": percentile(self.ttft, 95),
+            "total_p50_s": percentile(self.total, 50),
+            "total_p95_s": percentile(self.total, 95),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Streaming: {stats['responses']} respostas; primeiro token p50/p95 "
+              f"{stats['ttft_p50_s']:.2f}s / {stats['ttft_p95_s']:.2f}s; total p50/p95 "
+              f"{stats['total_p50_s']:.2f}s / {stats['total_p95_s']:.2f}s")
+
+
+async def stream_chain(runner, chain, inputs, answer_tag="answer", stats=None):
+    """
+    Roda o chain transmitindo a resposta. Gera eventos (tipo, valor):
+      ("sources", [Document])   assim que a busca termina
+      ("token", texto)          a cada pedaço da resposta do LLM com a tag answer_tag
+      ("result", dict)          saída final do chain (answer, source_documents...)
+    O StreamTimer da resposta vem no ("result", ...) em result["timer"].
+    """
+    timer = StreamTimer()
+    retrievers = set()
+    async for event in runner.astream_events(chain, inputs):
+        kind = event["event"]
+        if kind == "on_retriever_start":
+            retrievers.add(event["run_id"])
+        elif kind == "on_retriever_end":
+            # Retriever dentro de outro (ex: o PackedRetriever embrulhando a busca): só o de fora conta
+            if retrievers.intersection(event.get("parent_ids", [])):
+                continue
+            timer.retrieval_done()
+            yield "sources", event["data"]["output"]
+        elif kind == "on_chat_model_stream" and answer_tag in event.get("tags", []):
+            text = event["data"]["chunk"].content
+            if text:
+                timer.token()
+                yield "token", text
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            timer.done()
+            if stats is not None:
+                stats.record(timer)
+            yield "result", {**event["data"]["output"], "timer": timer}
+
+
+_shared_runner = None
+_shared_stream_stats = None
+
+
+def get_runner():
+    """
+    Runner único do processo, compartilhado por todas as sessões do Panel
+    (o módulo é importado uma vez; o script do chatbot roda de novo a cada sessão).
+    Limites em CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE e CHAT_TIMEOUT (s).
+    """
+    global _shared_runner
+    if _shared_runner is None:
+        timeout = os.environ.get("CHAT_TIMEOUT")
+        _shared_runner = ChainRunner(
+            max_concurrency=int(os.environ.get("CHAT_MAX_CONCURRENCY", 8)),
+            max_queue=int(os.environ.get("CHAT_MAX_QUEUE", 64)),
+            timeout=float(timeout) if timeout else None,
+        )
+    return _shared_runner
+
+
+def get_stream_stats():
+    global _shared_stream_stats
+    if _shared_stream_stats is None:
+        _shared_stream_stats = StreamStats()
+    return _shared_stream_stats
+
+
+# --- Teste de carga ---
+
+def build_test_chain(base_url, k=4):
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_openai import ChatOpenAI
+
+    from ann_index import ANNVectorStore
+    from benchmark import synthetic_corpus
+    from fake_models import HashingEmbeddings
+
+    records, _ = synthetic_corpus(200)
+    db = ANNVectorStore.from_texts([r["text"] for r in records], HashingEmbeddings(),
+                                   metadatas=[{"id": r["id"]} for r in records])
+    return ConversationalRetrievalChain.from_llm(
+        llm=ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, base_url=base_url, api_key="fake", tags=["answer"]),
+        condense_question_llm=ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, base_url=base_url, api_key="fake"),
+        chain_type="stuff",
+        retriever=db.as_retriever(search_kwargs={"k": k}),
+        return_source_documents=True,
+        return_generated_question=True,
+    )
+
+
+async def simulate_sessions(runner, chain, sessions, turns, stream_stats=None):
+    """
+    Cada sessão faz `turns` perguntas em sequência, como no chatbot; as sessões rodam juntas.
+    Com stream_stats, as respostas são transmitidas (stream_chain) e o TTFT é registrado.
+    Retorna (latências dos pedidos atendidos, nº de recusados).
+    """
+    latencies = []
+    rejected = 0
+
+    async def session(number):
+        nonlocal rejected
+        chat_history = []
+        for turn in range(turns):
+            question = f"sessão {number}, pergunta {turn}: o que acontece no sonho com o mar?"
+            started = time.perf_counter()
+            inputs = {"question": question, "chat_history": chat_history}
+            try:
+                if stream_stats is None:
+                    result = await runner.ainvoke(chain, inputs)
+                else:
+                    async for kind, value in stream_chain(runner, chain, inputs, stats=stream_stats):
+                        if kind == "result":
+                            result = value
+            except QueueFull:
+                rejected += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            chat_history.append((question, result["answer"]))
+
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return latencies, rejected
+
+
+def main():
+    from fake_openai_server import start_in_background
+
+    parser = argparse.ArgumentParser(description="Teste de carga do caminho assíncrono do chatbot")
+    parser.add_argument("--sessions", type=int, default=20, help="sessões simultâneas")
+    parser.add_argument("--turns", type=int, default=2, help="perguntas por sessão")
+    parser.add_argument("--latency", type=float, default=0.3, help="atraso do servidor falso por requisição (s)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="atraso entre palavras da resposta (s)")
+    parser.add_argument("--stream", action="store_true", help="transmite as respostas e mede o tempo até o primeiro token")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=64)
+    args = parser.parse_args()
+
+    server, base_url = start_in_background(latency=args.latency, token_latency=args.token_latency)
+    try:
+        chain = build_test_chain(base_url)
+        runner = ChainRunner(args.max_concurrency, args.max_queue)
+        stream_stats = StreamStats() if args.stream else None
+
+        started = time.perf_counter()
+        latencies, rejected = asyncio.run(simulate_sessions(runner, chain, args.sessions, args.turns, stream_stats))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    served = len(latencies)
+    print(f"{served} pedidos atendidos e {rejected} recusados em {elapsed:.2f}s "
+          f"({served / elapsed if elapsed else 0:.1f} pedidos/s)")
+    if latencies:
+        print(f"Latência por pedido p50/p95: {np.percentile(latencies, 50):.2f}s / {np.percentile(latencies, 95):.2f}s")
+    # Cada pedido faz 2 chamadas ao LLM quando há histórico (condensação + resposta)
+    calls = args.sessions * (2 * args.turns - 1)
+    print(f"Em série seriam ~{calls * args.latency:.1f}s só de espera pelo LLM")
+    runner.print_stats()
+    if stream_stats is not None:
+        stream_stats.print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+# Benchmark das estratégias de recuperação do repositório.
+#
+#   python benchmark.py                         # corpus sintético, todos os modos
+#   python benchmark.py --records 5000 --modes chroma_similarity dream_hybrid
+#   python benchmark.py --corpus docs/json/dreams.json --queries queries.json
+#   python benchmark.py --output benchmarks/2025-07-01.json
+#   python benchmark.py --modes dream_hybrid dream_hybrid_batch --batch-size 64
+#
+# Cada modo roda num processo próprio (pico de memória isolado), num diretório
+# temporário, com o HashingEmbeddings e o FakeRetrievalLLM do fake_models.py:
+# nada vai para a OpenAI e os números são reprodutíveis.
+#
+# Métricas por modo: tempo de construção do índice, latência p50/p95/p99,
+# throughput (consultas/s), pico de RSS do processo e recall@k.
+# Nos modos *_batch as consultas vão em lotes de --batch-size (um embedding por
+# lote); a latência de cada consulta é o tempo do lote dividido pelo tamanho dele.
+# recall@k = registros relevantes entre os k primeiros / min(k, nº de relevantes).
+#
+# Formato de --queries: [{"query": "...", "relevant": ["<id do registro>", ...]}, ...]
+
+modes = (
+    "chroma_similarity",
+    "chroma_mmr",
+    "chroma_mmr_matrix",
+    "chroma_mmr_matrix_batch",
+    "ann_similarity",
+    "ann_mmr",
+    "svm",
+    "tfidf_retriever",
+    "self_query",
+    "compression",
+    "compression_embedding",
+    "dream_bm25",
+    "dream_semantic",
+    "dream_hybrid",
+    "dream_hybrid_rrf",
+    "dream_bm25_batch",
+    "dream_semantic_batch",
+    "dream_hybrid_batch",
+)
+
+# Vocabulário do corpus sintético: cada tema tem suas palavras, e todos
+# compartilham as palavras comuns (ruído que o ranking precisa ignorar)
+themes = {
+    "mar": ["mar", "onda", "praia", "barco", "peixe", "areia", "maré", "náufrago", "farol", "concha"],
+    "voo": ["voar", "céu", "nuvem", "asas", "altura", "pássaro", "vento", "planar", "telhado", "avião"],
+    "perseguição": ["correr", "fugir", "perseguido", "sombra", "escuro", "corredor", "porta", "trancada", "grito", "medo"],
+    "escola": ["escola", "prova", "professor", "sala", "caderno", "atrasado", "colegas", "quadro", "recreio", "nota"],
+    "casa": ["casa", "quarto", "escada", "janela", "porão", "sótão", "cozinha", "mudança", "parede", "chave"],
+    "animais": ["cachorro", "gato", "cobra", "cavalo", "lobo", "coruja", "leão", "aranha", "rato", "borboleta"],
+    "família": ["mãe", "pai", "avó", "irmão", "primo", "filho", "almoço", "visita", "abraço", "saudade"],
+    "queda": ["cair", "abismo", "penhasco", "tropeçar", "buraco", "elevador", "despencar", "chão", "vertigem", "ponte"],
+}
+
+common_words = ["eu", "estava", "então", "de", "repente", "um", "uma", "lugar", "estranho", "lembro",
+                "depois", "muito", "tudo", "parecia", "acordei", "noite", "alguém", "dizia", "ali", "quando"]
+
+
+# --- Corpus ---
+
+def synthetic_sentence(generator, theme):
+    words = generator.sample(themes[theme], 3) + generator.sample(common_words, 5)
+    generator.shuffle(words)
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_corpus(n_records, queries_per_theme=4, seed=42):
+    """
+    Gera registros no formato do dreams.json e consultas rotuladas:
+    os relevantes de uma consulta são os registros do mesmo tema.
+    """
+    generator = random.Random(seed)
+    names = sorted(themes)
+
+    records = []
+    by_theme = {theme: [] for theme in names}
+    for i in range(n_records):
+        theme = names[i % len(names)]
+        text = " ".join(synthetic_sentence(generator, theme) for _ in range(generator.randint(3, 10)))
+        rid = str(i)
+        records.append({"id": rid, "title": f"Sonho {i}", "date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}", "text": text})
+        by_theme[theme].append(rid)
+
+    queries = []
+    for theme in names:
+        for _ in range(queries_per_theme):
+            queries.append({
+                "query": " ".join(generator.sample(themes[theme], 3)),
+                "relevant": by_theme[theme],
+            })
+    return records, queries
+
+
+def load_corpus(args):
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        if not args.queries:
+            raise SystemExit("--corpus precisa de --queries com os relevantes de cada consulta")
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+        return records, queries
+    return synthetic_corpus(args.records, seed=args.seed)
+
+
+# --- Modos ---
+
+def split_chunks(records):
+    """
+    Mesmo split e metadados (id, title, date, chunk_id) do dream_indexer, sem os
+    chunks só de pontuação (o "." que o splitter deixa entre frases).
+    """
+    from langchain_core.documents import Document
+    from dream_indexer import get_splitter, split_record
+    from fake_models import tokenize
+
+    splitter = get_splitter()
+    chunks = []
+    for record in records:
+        doc = Document(page_content=record["text"],
+                       metadata={"id": record.get("id"), "title": record.get("title"), "date": record.get("date")})
+        # Sem palavras não há o que recuperar, e num SVM ou numa distância L2 esses vetores
+        # isolados entram no top-k de qualquer consulta e derrubam o recall
+        chunks.extend(c for c in split_record(str(record.get("id")), doc, splitter) if tokenize(c.page_content))
+    return chunks
+
+
+def build_chroma(chunks, embedding):
+    from langchain_chroma import Chroma
+    return Chroma.from_documents(chunks, embedding, ids=[c.metadata["chunk_id"] for c in chunks])
+
+
+def build_mode(mode, records, embedding, llm, k):
+    """
+    Constrói o índice do modo e retorna search(query) -> [Document]
+    (nos modos *_batch, search([consultas]) -> [[Document], ...]).
+    """
+    if mode.startswith("dream_"):
+        from dream_indexer import update_index, dreams_file
+        from dream_search import DreamSearchEngine
+
+        os.makedirs(os.path.dirname(dreams_file), exist_ok=True)
+        with open(dreams_file, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        update_index(embedding, verbose=False)
+        engine = DreamSearchEngine(embedding)
+
+        if mode == "dream_bm25_batch":
+            return lambda queries: [[doc for doc, _ in r] for r in engine.lexical_batch(queries, top_k=k)]
+        if mode == "dream_semantic_batch":
+            return lambda queries: [[doc for doc, _ in r] for r in engine.semantic_batch(queries, top_k=k)]
+        if mode == "dream_hybrid_batch":
+            return lambda queries: [[doc for doc, _ in r] for r in engine.hybrid_batch(queries, top_k=k)]
+        if mode == "dream_bm25":
+            return lambda query: [doc for doc, _ in engine.lexical(query, top_k=k)]
+        if mode == "dream_semantic":
+            return lambda query: [doc for doc, _ in engine.semantic(query, top_k=k)]
+        fusion = "rrf" if mode == "dream_hybrid_rrf" else "weighted"
+        return lambda query: [doc for doc, _ in engine.hybrid(query, top_k=k, fusion=fusion)]
+
+    chunks = split_chunks(records)
+
+    if mode.startswith("chroma_"):
+        vectordb = build_chroma(chunks, embedding)
+        if mode.startswith("chroma_mmr_matrix"):
+            from mmr import as_retriever
+            retriever = as_retriever(vectordb, search_type="mmr_matrix", search_kwargs={"k": k, "fetch_k": 4 * k})
+            return retriever.search_batch if mode.endswith("_batch") else retriever.invoke
+        if mode == "chroma_mmr":
+            return lambda query: vectordb.max_marginal_relevance_search(query, k=k, fetch_k=4 * k)
+        return lambda query: vectordb.similarity_search(query, k=k)
+
+    if mode in ("ann_similarity", "ann_mmr"):
+        from ann_index import ANNVectorStore
+        vectordb = ANNVectorStore.from_documents(chunks, embedding)
+        if mode == "ann_mmr":
+            return lambda query: vectordb.max_marginal_relevance_search(query, k=k, fetch_k=4 * k)
+        return lambda query: vectordb.similarity_search(query, k=k)
+
+    if mode == "svm":
+        from langchain_community.retrievers import SVMRetriever
+        retriever = SVMRetriever.from_texts([c.page_content for c in chunks], embedding,
+                                            metadatas=[c.metadata for c in chunks], k=k)
+        return retriever.invoke
+
+    if mode == "tfidf_retriever":
+        from langchain_community.retrievers import TFIDFRetriever
+        retriever = TFIDFRetriever.from_documents(chunks, k=k)
+        return retriever.invoke
+
+    if mode == "self_query":
+        from langchain.chains.query_constructor.base import AttributeInfo
+        from langchain.retrievers.self_query.base import SelfQueryRetriever
+
+        metadata_field_info = [
+            AttributeInfo(name="title", description="O título do sonho", type="string"),
+            AttributeInfo(name="date", description="A data do sonho (AAAA-MM-DD)", type="string"),
+        ]
+        retriever = SelfQueryRetriever.from_llm(llm, build_chroma(chunks, embedding), "Relatos de sonhos",
+                                                metadata_field_info, search_kwargs={"k": k})
+        return retriever.invoke
+
+    if mode in ("compression", "compression_embedding"):
+        from langchain.retrievers import ContextualCompressionRetriever
+        from langchain.retrievers.document_compressors import LLMChainExtractor
+        from sentence_compressor import EmbeddingSentenceCompressor
+
+        if mode == "compression":
+            compressor = LLMChainExtractor.from_llm(llm)
+        else:
+            compressor = EmbeddingSentenceCompressor(embedding=embedding)
+        retriever = ContextualCompressionRetriever(
+            base_compressor=compressor,
+            base_retriever=build_chroma(chunks, embedding).as_retriever(search_kwargs={"k": k})
+        )
+        return retriever.invoke
+
+    raise ValueError(f"Modo desconhecido: {mode} (use um de {modes})")
+
+
+# --- Medição ---
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def recall_at_k(docs, relevant, k):
+    relevant = set(map(str, relevant))
+    if not relevant:
+        return None
+    found = list(dict.fromkeys(str(doc.metadata.get("id")) for doc in docs))[:k]
+    return len(relevant.intersection(found)) / min(k, len(relevant))
+
+
+def run_mode(mode, records, queries, config, workdir):
+    """
+    Roda um modo inteiro (construção + consultas). Executa num processo próprio.
+    """
+    from fake_models import HashingEmbeddings, FakeRetrievalLLM
+
+    # Os caminhos do dream_indexer são relativos: cada modo ganha seu diretório
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    k = config["k"]
+    embedding = HashingEmbeddings(size=config["dim"], latency=config["embed_latency"])
+    llm = FakeRetrievalLLM(latency=config["llm_latency"])
+
+    started = time.perf_counter()
+    search = build_mode(mode, records, embedding, llm, k)
+    build_time = time.perf_counter() - started
+
+    batch_size = config["batch_size"] if mode.endswith("_batch") else None
+
+    if batch_size:
+        search([query["query"] for query in queries[:config["warmup"]]])
+    else:
+        for query in queries[:config["warmup"]]:
+            search(query["query"])
+
+    latencies = []
+    recalls = []
+    for _ in range(config["repeat"]):
+        if batch_size:
+            for start in range(0, len(queries), batch_size):
+                batch = queries[start:start + batch_size]
+                started = time.perf_counter()
+                results = search([query["query"] for query in batch])
+                # Custo do lote dividido igualmente entre as consultas
+                latencies.extend([(time.perf_counter() - started) / len(batch)] * len(batch))
+                for docs, query in zip(results, batch):
+                    recall = recall_at_k(docs, query["relevant"], k)
+                    if recall is not None:
+                        recalls.append(recall)
+            continue
+
+        for query in queries:
+            started = time.perf_counter()
+            docs = search(query["query"])
+            latencies.append(time.perf_counter() - started)
+            recall = recall_at_k(docs, query["relevant"], k)
+            if recall is not None:
+                recalls.append(recall)
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "build_time_s": build_time,
+        "queries": len(latencies),
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+        },
+        "throughput_qps": len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+        "batch_size": batch_size,
+        "peak_rss_mb": peak_rss_mb(),
+        f"recall@{k}": float(np.mean(recalls)) if recalls else None,
+        "llm_calls": llm.calls,
+    }
+
+
+def print_table(results, k):
+    header = f"{'modo':<24}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/s':>9}{'RSS MB':>9}{f'R@{k}':>8}"
+    print(header)
+    print("-" * len(header))
+    for mode, result in results.items():
+        if "error" in result:
+            print(f"{mode:<24}erro: {result['error']}")
+            continue
+        latency = result["latency_ms"]
+        recall = result[f"recall@{k}"]
+        print(f"{mode:<24}{result['build_time_s']:>9.2f}{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+              f"{latency['p99']:>9.2f}{result['throughput_qps']:>9.1f}{result['peak_rss_mb']:>9.0f}"
+              f"{recall if recall is not None else float('nan'):>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das estratégias de recuperação")
+    parser.add_argument("--modes", nargs="+", default=list(modes), choices=modes)
+    parser.add_argument("--records", type=int, default=2000, help="tamanho do corpus sintético")
+    parser.add_argument("--corpus", help="arquivo no formato do dreams.json (em vez do corpus sintético)")
+    parser.add_argument("--queries", help="consultas rotuladas para o --corpus")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="vezes que o conjunto de consultas é repetido")
+    parser.add_argument("--warmup", type=int, default=2, help="consultas de aquecimento (não medidas)")
+    parser.add_argument("--batch-size", type=int, default=64, help="consultas por lote nos modos *_batch")
+    parser.add_argument("--dim", type=int, default=256, help="dimensão do embedding falso")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="atraso simulado por chamada de embedding (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="atraso simulado por chamada ao LLM (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="grava o resultado em JSON neste arquivo")
+    args = parser.parse_args()
+
+    records, queries = load_corpus(args)
+    config = {
+        "k": args.k, "repeat": args.repeat, "warmup": args.warmup, "dim": args.dim, "batch_size": args.batch_size,
+        "embed_latency": args.embed_latency, "llm_latency": args.llm_latency,
+    }
+
+    repo_directory = os.path.dirname(os.path.abspath(__file__))
+    base_directory = tempfile.mkdtemp(prefix="benchmark-")
+    results = {}
+    try:
+        for mode in args.modes:
+            print(f"Rodando {mode}...", flush=True)
+            # spawn: processo limpo, sem a memória dos modos anteriores
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+                                     initializer=sys.path.insert, initargs=(0, repo_directory)) as pool:
+                future = pool.submit(run_mode, mode, records, queries, config, os.path.join(base_directory, mode))
+                try:
+                    results[mode] = future.result()
+                except Exception as e:
+                    results[mode] = {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        shutil.rmtree(base_directory, ignore_errors=True)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "corpus": {"source": args.corpus or "synthetic", "records": len(records), "queries": len(queries),
+                   "seed": None if args.corpus else args.seed},
+        "config": config,
+        "results": results,
+    }
+
+    print()
+    print_table(results, args.k)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado salvo em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
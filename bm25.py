@@ -0,0 +1,482 @@
+import json
+import os
+import re
+import shutil
+import unicodedata
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from topk import top_k_indices
+from varint import encode_varints, decode_varints
+
+try:
+    from nltk.stem.snowball import SnowballStemmer
+except ImportError:  # nltk é opcional: sem ele, use o stemmer "light"
+    SnowballStemmer = None
+
+# Busca lexical BM25 sobre um índice invertido.
+#
+# Análise: tokens \w+ em minúsculas, sem stopwords, com stemming e sem acentos
+# (Analyzer, configurável). Cada termo vira um id por hashing (TermHasher), então
+# o dream_indexer guarda só a matriz de contagens e não precisa de vocabulário.
+#
+# Índice (diretório, arquivos binários lidos com mmap):
+#   meta.json                       parâmetros (k1, b, delta), nº de chunks, analisador
+#   features.npy                    ids dos termos presentes, ordenados (busca binária)
+#   term_idf.npy / term_max.npy     idf e maior score possível de cada termo
+#   term_blocks.npy                 primeiro bloco de cada termo
+#   docs.bin / tfs.bin              postings (deltas das posições) e frequências, em varint
+#   block_*.npy                     blocos de 128 postings: último chunk, offsets, tamanho
+#   doc_norm.npy                    k1 * (1 - b + b * tamanho / tamanho médio) de cada chunk
+#
+# Top-k com MaxScore: os termos são processados do maior para o menor score
+# máximo; quando a soma dos máximos que faltam não alcança o k-ésimo score, nenhum
+# chunk novo entra no top-k, e dos termos restantes só são lidos os blocos que
+# contêm os candidatos que sobraram.
+#
+# Em lote (search_batch), as consultas viram uma matriz esparsa (consultas x termos)
+# multiplicada pela matriz de impactos (termos x chunks, montada uma vez a partir
+# dos postings): todas as consultas são pontuadas num único produto esparso.
+
+portuguese_stopwords = frozenset("""
+a à ao aos aquela aquelas aquele aqueles aquilo as às até com como da das de dela delas dele
+deles depois do dos e é ela elas ele eles em entre era eram essa essas esse esses esta estas
+este estes eu foi fomos for foram há isso isto já lhe lhes mais mas me mesmo meu meus minha
+minhas muito na nas não nem no nos nós nossa nossas nosso nossos num numa o os ou para pela
+pelas pelo pelos por qual quando que quem se sem ser seu seus só sua suas também te tem tinha
+tu tua tuas um uma umas uns você vocês vos
+""".split())
+
+stopword_lists = {
+    "portuguese": portuguese_stopwords,
+    None: frozenset(),
+}
+
+_token_pattern = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def light_stem(token):
+    """
+    Stemmer leve para português: plural, advérbios em -mente e vogal final
+    (gênero). Junta "flores"/"flor", "leões"/"leão", "menina"/"menino".
+    """
+    if len(token) > 3:
+        if token.endswith("ões"):
+            token = token[:-3] + "ão"
+        elif token.endswith("ns"):
+            token = token[:-2] + "m"
+        elif len(token) > 4 and token.endswith("ais"):
+            token = token[:-2] + "l"
+        elif token.endswith("éis"):
+            token = token[:-3] + "el"
+        elif token.endswith("óis"):
+            token = token[:-3] + "ol"
+        elif token.endswith(("res", "zes", "les")):
+            token = token[:-2]
+        elif token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+    if len(token) > 6 and token.endswith("mente"):
+        token = token[:-5]
+    if len(token) > 3 and token[-1] in "aoe":
+        token = token[:-1]
+    return token
+
+
+_snowball = None
+
+
+def snowball_stem(token):
+    global _snowball
+    if _snowball is None:
+        if SnowballStemmer is None:
+            raise ImportError("O stemmer 'snowball' precisa do nltk: pip install nltk")
+        _snowball = SnowballStemmer("portuguese")
+    return _snowball.stem(token)
+
+
+# Novos stemmers podem ser registrados aqui (nome -> função token -> token)
+stemmers = {
+    "light": light_stem,
+    "snowball": snowball_stem,
+    None: None,
+}
+
+
+class Analyzer:
+
+    def __init__(self, stopwords="portuguese", stemmer="light", fold=True, min_length=2):
+        self.stopwords_name = stopwords
+        self.stemmer_name = stemmer
+        self.fold = fold
+        self.min_length = min_length
+
+        words = stopword_lists[stopwords]
+        # Compara com e sem acento: "nao" também é stopword
+        self.stopwords = words | {fold_accents(w) for w in words}
+        self.stem = stemmers[stemmer]
+
+    @property
+    def config(self):
+        return {"stopwords": self.stopwords_name, "stemmer": self.stemmer_name,
+                "fold": self.fold, "min_length": self.min_length}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+    def __call__(self, text):
+        tokens = []
+        for token in _token_pattern.findall(text.lower()):
+            if len(token) < self.min_length or token in self.stopwords:
+                continue
+            if self.stem is not None:
+                token = self.stem(token)
+            if self.fold:
+                token = fold_accents(token)
+            tokens.append(token)
+        return tokens
+
+
+class TermHasher:
+    """
+    Texto -> contagens de termos por id (crc32 do termo analisado, módulo n_features).
+    """
+
+    def __init__(self, analyzer=None, n_features=2 ** 22):
+        self.analyzer = analyzer or Analyzer()
+        self.n_features = n_features
+
+    @property
+    def config(self):
+        return {"analyzer": self.analyzer.config, "n_features": self.n_features}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(Analyzer.from_config(config["analyzer"]), config["n_features"])
+
+    def term_counts(self, text):
+        ids = np.array([zlib.crc32(t.encode("utf-8")) % self.n_features for t in self.analyzer(text)],
+                       dtype=np.int64)
+        return np.unique(ids, return_counts=True)
+
+    def counts(self, texts):
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            ids, counts = self.term_counts(text)
+            indices.append(ids)
+            data.append(counts)
+            indptr.append(indptr[-1] + len(ids))
+        n_rows = len(indptr) - 1
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        data = np.concatenate(data).astype(np.float32) if data else np.zeros(0, dtype=np.float32)
+        return sparse.csr_matrix((data, indices, np.array(indptr)), shape=(n_rows, self.n_features))
+
+
+def _load(path):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def _gather(blob, offsets, blocks):
+    """
+    Bytes dos blocos pedidos, concatenados (sem ler os outros).
+    """
+    starts = offsets[blocks]
+    lengths = offsets[blocks + 1] - starts
+    positions = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+    return blob[positions]
+
+
+class BM25Index:
+
+    def __init__(self, directory):
+        self.directory = directory
+        path = lambda name: os.path.join(directory, name)
+
+        with open(path("meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.k1 = self.meta["k1"]
+        self.b = self.meta["b"]
+        self.delta = self.meta["delta"]
+        self.n_docs = self.meta["n_docs"]
+
+        load = lambda name: np.load(path(name), mmap_mode="r")
+        self.features = load("features.npy")
+        self.term_df = load("term_df.npy")
+        self.term_idf = load("term_idf.npy")
+        self.term_max = load("term_max.npy")
+        self.term_blocks = load("term_blocks.npy")
+        self.block_last = load("block_last.npy")
+        self.block_count = load("block_count.npy")
+        self.block_doc_offsets = load("block_doc_offsets.npy")
+        self.block_tf_offsets = load("block_tf_offsets.npy")
+        self.doc_norm = load("doc_norm.npy")
+        self.docs_blob = _load(path("docs.bin"))
+        self.tfs_blob = _load(path("tfs.bin"))
+
+        self.hasher = TermHasher.from_config(self.meta["hasher"])
+        self.last_stats = {}
+        self._impacts = None
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "meta.json"))
+
+    def __len__(self):
+        return self.n_docs
+
+    # --- Postings ---
+
+    def query_terms(self, query):
+        """
+        Consulta -> (termos do índice, frequência de cada um na consulta).
+        Termos que não aparecem em nenhum chunk são descartados.
+        """
+        ids, counts = self.hasher.term_counts(query)
+        positions = np.searchsorted(self.features, ids)
+        found = positions < len(self.features)
+        found[found] = self.features[positions[found]] == ids[found]
+        return positions[found], counts[found].astype(np.float64)
+
+    def _decode(self, term, blocks):
+        if not len(blocks):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        counts = self.block_count[blocks].astype(np.int64)
+        deltas = decode_varints(_gather(self.docs_blob, self.block_doc_offsets, blocks))
+        tfs = decode_varints(_gather(self.tfs_blob, self.block_tf_offsets, blocks))
+
+        # Cada bloco recomeça do último chunk do bloco anterior do mesmo termo
+        first = np.cumsum(counts) - counts
+        bases = np.where(blocks == self.term_blocks[term], 0, self.block_last[np.maximum(blocks - 1, 0)])
+        deltas[first] += bases
+        running = np.cumsum(deltas)
+        docs = running - np.repeat(running[first] - deltas[first], counts)
+        self.last_stats["decoded"] = self.last_stats.get("decoded", 0) + len(docs)
+        return docs, tfs
+
+    def _term_blocks(self, term):
+        return np.arange(self.term_blocks[term], self.term_blocks[term + 1])
+
+    def _blocks_with(self, term, rows):
+        """
+        Blocos do termo que podem conter alguma das posições (ordenadas) em rows.
+        """
+        start, end = int(self.term_blocks[term]), int(self.term_blocks[term + 1])
+        found = np.searchsorted(self.block_last[start:end], rows)
+        return np.unique(found[found < end - start]) + start
+
+    def _scores(self, term, weight, docs, tfs):
+        tfs = tfs.astype(np.float64)
+        return self.term_idf[term] * weight * (tfs * (self.k1 + 1) / (tfs + self.doc_norm[docs]) + self.delta)
+
+    # --- Pontuação ---
+
+    def score_rows(self, terms, weights, rows):
+        """
+        Score BM25 exato das posições em rows (ordenadas, sem repetição).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows))
+        for term, weight in zip(terms, weights):
+            docs, tfs = self._decode(term, self._blocks_with(term, rows))
+            positions = np.searchsorted(rows, docs)
+            hit = positions < len(rows)
+            hit[hit] = rows[positions[hit]] == docs[hit]
+            scores[positions[hit]] += self._scores(term, weight, docs[hit], tfs[hit])
+        return scores
+
+    def search(self, terms, weights, k, allowed=None):
+        """
+        Top-k por BM25 com MaxScore. allowed = posições permitidas (ordenadas).
+        Retorna (posições, scores) em ordem decrescente.
+        """
+        # decoded = postings lidos; postings = total das listas dos termos da consulta
+        self.last_stats = {"decoded": 0, "postings": int(self.term_df[terms].sum()) if len(terms) else 0}
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0)
+        if not len(terms) or k <= 0:
+            return empty
+
+        if allowed is not None and len(allowed) * 10 <= self.n_docs:
+            # Filtro seletivo: pontua só as posições permitidas
+            scores = self.score_rows(terms, weights, allowed)
+            nonzero = np.flatnonzero(scores)
+            top = nonzero[np.argsort(-scores[nonzero], kind="stable")[:k]]
+            return np.asarray(allowed)[top], scores[top]
+
+        upper = self.term_max[terms] * weights
+        order = np.argsort(-upper, kind="stable")
+
+        candidates, scores = empty
+        threshold = 0.0
+        remaining = float(upper.sum())
+
+        for term, weight, bound in zip(terms[order], weights[order], upper[order]):
+            if len(candidates) >= k and remaining <= threshold:
+                # Termos "não essenciais": só atualizam os candidatos atuais
+                docs, tfs = self._decode(term, self._blocks_with(term, candidates))
+                positions = np.searchsorted(candidates, docs)
+                hit = positions < len(candidates)
+                hit[hit] = candidates[positions[hit]] == docs[hit]
+                scores[positions[hit]] += self._scores(term, weight, docs[hit], tfs[hit])
+                remaining = max(0.0, remaining - bound)  # sem erro de arredondamento negativo
+                # Descarta quem não alcança o k-ésimo nem com o máximo que falta
+                threshold = np.partition(scores, -k)[-k]
+                keep = scores + remaining >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+            else:
+                docs, tfs = self._decode(term, self._term_blocks(term))
+                if allowed is not None:
+                    keep = np.isin(docs, allowed, assume_unique=True)
+                    docs, tfs = docs[keep], tfs[keep]
+                merged, inverse = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, self._scores(term, weight, docs, tfs)]),
+                                     minlength=len(merged))
+                candidates = merged
+                remaining = max(0.0, remaining - bound)
+                if len(candidates) >= k:
+                    threshold = np.partition(scores, -k)[-k]
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        return candidates[top], scores[top]
+
+    # --- Em lote ---
+
+    @property
+    def impacts(self):
+        """
+        Matriz esparsa (termos x chunks) com a contribuição BM25 de cada posting.
+        Decodifica todos os postings de uma vez, no primeiro uso.
+        """
+        if self._impacts is None:
+            df = self.term_df.astype(np.int64)
+            indptr = np.concatenate([[0], np.cumsum(df)])
+            deltas = decode_varints(np.asarray(self.docs_blob))
+            tfs = decode_varints(np.asarray(self.tfs_blob))
+
+            # O delta recomeça em cada termo (o primeiro posting é absoluto)
+            running = np.cumsum(deltas)
+            first = indptr[:-1]
+            docs = running - np.repeat(running[first] - deltas[first], df)
+            terms = np.repeat(np.arange(len(df)), df)
+
+            data = self._scores(terms, 1.0, docs, tfs).astype(np.float32)
+            self._impacts = sparse.csr_matrix((data, docs, indptr), shape=(len(df), self.n_docs))
+        return self._impacts
+
+    def query_matrix(self, queries):
+        """
+        Consultas -> matriz esparsa (consultas x termos do índice) com a frequência de cada termo.
+        """
+        indptr, indices, data = [0], [], []
+        for query in queries:
+            terms, weights = self.query_terms(query)
+            indices.append(terms)
+            data.append(weights)
+            indptr.append(indptr[-1] + len(terms))
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        data = np.concatenate(data).astype(np.float32) if data else np.zeros(0, dtype=np.float32)
+        return sparse.csr_matrix((data, indices, np.array(indptr)), shape=(len(queries), len(self.features)))
+
+    def score_matrix(self, queries, allowed=None):
+        """
+        Scores BM25 de todos os chunks para todas as consultas: matriz esparsa (consultas x chunks).
+        """
+        scores = (self.query_matrix(queries) @ self.impacts).tocsr()
+        if allowed is not None:
+            mask = np.zeros(self.n_docs, dtype=np.float32)
+            mask[np.asarray(allowed, dtype=np.int64)] = 1.0
+            scores = scores.multiply(mask[None, :]).tocsr()
+            scores.eliminate_zeros()
+        return scores
+
+    def search_batch(self, queries, k, allowed=None):
+        """
+        Top-k por BM25 de cada consulta. Retorna [(posições, scores)], um par por consulta.
+        """
+        scores = self.score_matrix(queries, allowed)
+        results = []
+        for row in range(scores.shape[0]):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            top = top_k_indices(scores.data[start:end], k)
+            results.append((scores.indices[start:end][top].astype(np.int64), scores.data[start:end][top].astype(np.float64)))
+        return results
+
+    # --- Escrita ---
+
+    @staticmethod
+    def write(directory, counts, hasher, k1=1.2, b=0.75, delta=0.0, block_size=128):
+        """
+        Monta o índice a partir da matriz de contagens (chunks x termos) do TermHasher.
+        delta > 0 = BM25+ (limite inferior para chunks longos).
+        """
+        directory = directory.rstrip("/")
+        tmp_directory = directory + ".tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        path = lambda name: os.path.join(tmp_directory, name)
+
+        counts = sparse.csc_matrix(counts)
+        counts.sort_indices()
+        n_docs = counts.shape[0]
+
+        doc_lengths = np.asarray(counts.sum(axis=1), dtype=np.float64).ravel()
+        avgdl = float(doc_lengths.mean()) if n_docs else 0.0
+        doc_norm = k1 * (1 - b + b * doc_lengths / avgdl) if avgdl else np.full(n_docs, k1)
+
+        column_sizes = np.diff(counts.indptr)
+        features = np.flatnonzero(column_sizes)
+        df = column_sizes[features]
+        term_starts = counts.indptr[features]
+        docs = counts.indices.astype(np.int64)
+        tfs = np.rint(counts.data).astype(np.int64)
+        nnz = len(docs)
+
+        # Postings de todos os termos em sequência; o delta volta a zero em cada termo
+        deltas = np.diff(docs, prepend=0)
+        deltas[term_starts] = docs[term_starts]
+
+        offset_in_term = np.arange(nnz) - np.repeat(term_starts, df)
+        block_starts = np.flatnonzero(offset_in_term % block_size == 0)
+        block_ends = np.append(block_starts[1:], nnz)
+        blocks_per_term = -(-df // block_size)
+
+        doc_bytes, doc_starts = encode_varints(deltas)
+        tf_bytes, tf_starts = encode_varints(tfs)
+
+        idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        tf_part = tfs * (k1 + 1) / (tfs + doc_norm[docs]) + delta
+        term_max = idf * np.maximum.reduceat(tf_part, term_starts) if nnz else np.zeros(0)
+
+        np.save(path("features.npy"), features.astype(np.int64))
+        np.save(path("term_df.npy"), df.astype(np.int64))
+        np.save(path("term_idf.npy"), idf.astype(np.float64))
+        np.save(path("term_max.npy"), term_max.astype(np.float64))
+        np.save(path("term_blocks.npy"), np.concatenate([[0], np.cumsum(blocks_per_term)]).astype(np.int64))
+        np.save(path("block_last.npy"), docs[block_ends - 1])
+        np.save(path("block_count.npy"), (block_ends - block_starts).astype(np.int16))
+        np.save(path("block_doc_offsets.npy"), np.append(doc_starts[block_starts], len(doc_bytes)).astype(np.int64))
+        np.save(path("block_tf_offsets.npy"), np.append(tf_starts[block_starts], len(tf_bytes)).astype(np.int64))
+        np.save(path("doc_norm.npy"), doc_norm.astype(np.float64))
+        doc_bytes.tofile(path("docs.bin"))
+        tf_bytes.tofile(path("tfs.bin"))
+
+        with open(path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": k1, "b": b, "delta": delta, "n_docs": n_docs, "avgdl": avgdl,
+                       "terms": len(features), "postings": nnz, "block_size": block_size,
+                       "hasher": hasher.config}, f)
+
+        old_directory = directory + ".old"
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, old_directory)
+        os.rename(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+        return len(features)
@@ -9,6 +9,7 @@ from langchain.document_loaders import TextLoader
 from langchain.document_loaders import PyPDFLoader
 
 import os
+import asyncio
 import openai
 from dotenv import load_dotenv, find_dotenv
 
@@ -27,6 +28,14 @@ from langchain_openai import OpenAIEmbeddings
 from langchain_openai import OpenAI
 from langchain_openai import ChatOpenAI
 
+from embedding_cache import CachedEmbeddings
+from ann_index import ANNVectorStore
+from async_chain import get_runner, get_stream_stats, stream_chain, QueueFull
+from index_cache import FileIndexCache, get_shared_cache
+from answer_cache import AnswerCache
+from context_packer import ContextPacker, PackedRetriever
+from conversation_memory import ConversationWindow
+
 from langchain.chains import RetrievalQA
 from langchain.chains import ConversationalRetrievalChain
 from langchain.chains.query_constructor.base import AttributeInfo
@@ -46,6 +55,8 @@ openai.api_key  = os.environ['OPENAI_API_KEY']
 
 persist_directory = 'docs/chroma/'
 
+llm_name = "gpt-3.5-turbo"
+
 embedding = OpenAIEmbeddings()
 
 vectordb = Chroma(
@@ -76,28 +87,64 @@ memory = ConversationBufferMemory(
 
 
 
-def load_db(file, chain_type, k):
+def build_pdf_index(file, source):
     # load documents
     loader = PyPDFLoader(file)
     documents = loader.load()
+    for doc in documents:
+        doc.metadata["source"] = source
     # split documents
     text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
     docs = text_splitter.split_documents(documents)
-    # define embedding
-    embeddings = OpenAIEmbeddings()
     # create vector database from data
-    db = DocArrayInMemorySearch.from_documents(docs, embeddings)
+    return ANNVectorStore.from_documents(docs, pdf_index_cache.embedding)
+
+# Índices dos PDFs por hash do conteúdo, compartilhados por todas as sessões do processo:
+# abrir uma sessão no PDF padrão ou reenviar um PDF conhecido não reprocessa nada.
+# A versão entra na chave: mudou o splitter ou o modelo, os índices antigos não servem.
+def create_pdf_index_cache():
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    return FileIndexCache(
+        embeddings,
+        build_pdf_index,
+        version=f"recursive-1000-150:{embeddings.model}",
+        memory_budget=int(os.environ.get("PDF_CACHE_MEMORY_MB", 512)) * 2 ** 20,
+    )
+
+pdf_index_cache = get_shared_cache("pdf", create_pdf_index_cache)
+
+# Respostas da primeira pergunta de cada conversa, por PDF (o escopo é a chave do
+# índice): a mesma pergunta, ou uma quase igual, sobre o mesmo PDF sai do cache
+answer_cache = get_shared_cache("answers", lambda: AnswerCache(pdf_index_cache.embedding))
+
+# Contexto do "stuff" sem a sobreposição entre chunks vizinhos e limitado a
+# CONTEXT_MAX_TOKENS; o packer é do processo, então as métricas somam todas as sessões
+context_packer = get_shared_cache(
+    "context", lambda: ContextPacker(max_tokens=int(os.environ.get("CONTEXT_MAX_TOKENS", 1000)), model=llm_name))
+
+def load_db(file, chain_type, k, data=None):
+    # file = caminho do PDF ou, com data (bytes do upload), só o nome exibido.
+    # Retorna (chain, escopo do answer_cache = chave do índice do PDF)
+    if data is not None:
+        db, scope = pdf_index_cache.get_keyed(data, file)
+    else:
+        db, scope = pdf_index_cache.get_file_keyed(file)
     # define retriever
     retriever = db.as_retriever(search_type="similarity", search_kwargs={"k": k})
+    if chain_type == "stuff":
+        retriever = PackedRetriever(retriever=retriever, packer=context_packer)
     # create a chatbot chain. Memory is managed externally.
+    # A tag "answer" marca o LLM da resposta, o único transmitido token a token
+    # (a pergunta condensada usa outro LLM, sem tag, e não aparece no chat)
     qa = ConversationalRetrievalChain.from_llm(
-        llm=ChatOpenAI(model_name=llm_name, temperature=0), 
+        llm=ChatOpenAI(model_name=llm_name, temperature=0, tags=["answer"]),
+        condense_question_llm=ChatOpenAI(model_name=llm_name, temperature=0),
         chain_type=chain_type, 
         retriever=retriever, 
         return_source_documents=True,
         return_generated_question=True,
     )
-    return qa 
+    return qa, scope
 
 import panel as pn
 import param
@@ -111,35 +158,82 @@ class cbfs(param.Parameterized):
     def __init__(self,  **params):
         super(cbfs, self).__init__( **params)
         self.panels = []
+        # Só as últimas trocas vão na íntegra para o chain; as antigas viram um resumo
+        self.memory = ConversationWindow(ChatOpenAI(model_name=llm_name, temperature=0),
+                                         max_turns=4, max_tokens=1000, model=llm_name)
         self.loaded_file = "docs/cs229_lectures/MachineLearning-Lecture01.pdf"
-        self.qa = load_db(self.loaded_file,"stuff", 4)
+        self.qa, self.scope = load_db(self.loaded_file,"stuff", 4)
     
-    def call_load_db(self, count):
+    async def call_load_db(self, count):
         if count == 0 or file_input.value is None:  # init or no file specified :
             return pn.pane.Markdown(f"Loaded File: {self.loaded_file}")
         else:
-            file_input.save("temp.pdf")  # local copy
             self.loaded_file = file_input.filename
             button_load.button_style="outline"
-            self.qa = load_db("temp.pdf", "stuff", 4)
+            # Leitura, split e embeddings fora do event loop: as outras sessões não param
+            self.qa, self.scope = await asyncio.to_thread(
+                load_db, file_input.filename, "stuff", 4, data=file_input.value)
             button_load.button_style="solid"
         self.clr_history()
         return pn.pane.Markdown(f"Loaded File: {self.loaded_file}")
 
-    def convchain(self, query):
+    async def convchain(self, query):
         if not query:
-            return pn.WidgetBox(pn.Row('User:', pn.pane.Markdown("", width=600)), scroll=True)
-        result = self.qa({"question": query, "chat_history": self.chat_history})
-        self.chat_history.extend([(query, result["answer"])])
-        self.db_query = result["generated_question"]
-        self.db_response = result["source_documents"]
-        self.answer = result['answer'] 
+            yield pn.WidgetBox(pn.Row('User:', pn.pane.Markdown("", width=600)), scroll=True)
+            return
+        # A resposta aparece token a token: o painel é exibido vazio e preenchido
+        # conforme o LLM responde; as fontes aparecem assim que a busca termina
+        answer_pane = pn.pane.Markdown("", width=600, style={'background-color': '#F6F6F6'})
+        timing_pane = pn.pane.Str("", styles={'color': '#888888', 'font-size': '11px'})
         self.panels.extend([
             pn.Row('User:', pn.pane.Markdown(query, width=600)),
-            pn.Row('ChatBot:', pn.pane.Markdown(self.answer, width=600, style={'background-color': '#F6F6F6'}))
+            pn.Row('ChatBot:', pn.Column(answer_pane, timing_pane))
         ])
+        yield pn.WidgetBox(*self.panels,scroll=True)
+
+        # Sem histórico a resposta só depende da pergunta e do PDF: pode vir do cache
+        cacheable = not self.memory.turns and not self.memory.summary
+        if cacheable:
+            # O embedding da pergunta é uma chamada bloqueante: fora do loop do Panel
+            cached, hit = await asyncio.to_thread(answer_cache.lookup, query, self.scope)
+            if cached is not None:
+                self.show_result(cached, answer_pane)
+                timing_pane.object = f"resposta em cache ({'exata' if hit == 'exact' else 'pergunta parecida'})"
+                await self.memory.aadd_turn(query, cached["answer"])
+                self.chat_history = self.memory.chat_history()
+                return
+
+        # O runner é do processo (limite de concorrência e fila valem para todas as sessões)
+        result = None
+        try:
+            async for kind, value in stream_chain(get_runner(), self.qa,
+                                                  {"question": query, "chat_history": self.memory.chat_history()},
+                                                  stats=get_stream_stats()):
+                if kind == "sources":
+                    self.db_response = value
+                elif kind == "token":
+                    answer_pane.object += value
+                else:
+                    result = value
+        except QueueFull:
+            answer_pane.object = "Muitas perguntas ao mesmo tempo, tente de novo em instantes."
+            inp.value = ''
+            return
+        self.show_result(result, answer_pane)
+        timing_pane.object = result["timer"].summary()
+        if cacheable:
+            await asyncio.to_thread(answer_cache.store, query, self.scope,
+                                    {name: result[name] for name in ("answer", "generated_question", "source_documents")})
+        # Resumir (quando a janela estoura) só depois de a resposta estar na tela
+        await self.memory.aadd_turn(query, result["answer"])
+        self.chat_history = self.memory.chat_history()
+
+    def show_result(self, result, answer_pane):
+        self.db_query = result["generated_question"]
+        self.db_response = result["source_documents"]
+        self.answer = result['answer'] 
+        answer_pane.object = self.answer
         inp.value = ''  #clears loading indicator when cleared
-        return pn.WidgetBox(*self.panels,scroll=True)
 
     @param.depends('db_query ', )
     def get_lquest(self):
@@ -168,10 +262,14 @@ class cbfs(param.Parameterized):
             return pn.WidgetBox(pn.Row(pn.pane.Str("No History Yet")), width=600, scroll=True)
         rlist=[pn.Row(pn.pane.Markdown(f"Current Chat History variable", styles={'background-color': '#F6F6F6'}))]
         for exchange in self.chat_history:
-            rlist.append(pn.Row(pn.pane.Str(exchange)))
+            rlist.append(pn.Row(pn.pane.Str(exchange if isinstance(exchange, tuple) else exchange.content)))
+        stats = self.memory.turn_stats[-1]
+        rlist.append(pn.Row(pn.pane.Str(f"Histórico enviado: {stats['sent_tokens']} tokens "
+                                        f"(completo teria {stats['full_tokens']})")))
         return pn.WidgetBox(*rlist, width=600, scroll=True)
 
     def clr_history(self,count=0):
+        self.memory.clear()
         self.chat_history = []
         return 
     
@@ -0,0 +1,260 @@
+import array
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+# Armazenamento de chunks em disco, aberto com mmap.
+#
+#   text.bin / text.offsets.npy      textos de todos os chunks num blob UTF-8 contíguo + offsets
+#   chunk_record.npy                 registro de origem de cada chunk
+#   chunk_ordinal.npy                posição do chunk dentro do registro (o "i" do chunk_id)
+#   record_ids.*                     id de cada registro (mesmo formato: blob + offsets)
+#   columns/<nome>.*                 metadados por registro, uma coluna por campo (valores em JSON)
+#   record_first.npy                 índice do primeiro chunk de cada registro
+#   record_keys.npy/record_order.npy hash ordenado dos ids, para achar um registro por busca binária
+#
+# Metadados ficam uma vez por registro (não copiados em cada chunk), e abrir a
+# base só mapeia os arquivos: o custo de startup não depende do tamanho do corpus.
+
+
+def record_key(rid):
+    return int.from_bytes(hashlib.blake2b(str(rid).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def split_chunk_id(chunk_id):
+    rid, ordinal = chunk_id.rsplit(":", 1)
+    return rid, int(ordinal)
+
+
+class StringColumn:
+
+    def __init__(self, prefix):
+        self.offsets = np.load(prefix + ".offsets.npy", mmap_mode="r")
+        self._file = open(prefix + ".bin", "rb")
+        if os.path.getsize(prefix + ".bin"):
+            self.blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.blob = b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        self._file.close()
+
+
+class StringColumnWriter:
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._file = open(prefix + ".bin", "wb")
+        self.offsets = array.array("q", [0])
+
+    def append(self, value):
+        data = value.encode("utf-8")
+        self._file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self._file.close()
+        np.save(self.prefix + ".offsets.npy", np.frombuffer(self.offsets, dtype=np.int64))
+
+
+class ChunkStore:
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        path = lambda name: os.path.join(directory, name)
+
+        self.texts = StringColumn(path("text"))
+        self.record_ids = StringColumn(path("record_ids"))
+        self.columns = {name: StringColumn(path(os.path.join("columns", name))) for name in self.meta["columns"]}
+
+        self.chunk_record = np.load(path("chunk_record.npy"), mmap_mode="r")
+        self.chunk_ordinal = np.load(path("chunk_ordinal.npy"), mmap_mode="r")
+        self.record_first = np.load(path("record_first.npy"), mmap_mode="r")
+        self.record_keys = np.load(path("record_keys.npy"), mmap_mode="r")
+        self.record_order = np.load(path("record_order.npy"), mmap_mode="r")
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, "meta.json"))
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def generation(self):
+        # Muda a cada write(): índices derivados guardam a geração para saber se ainda valem
+        return self.meta.get("generation")
+
+    @property
+    def n_records(self):
+        return len(self.record_ids)
+
+    # --- Acesso por chunk (O(1)) ---
+
+    def text(self, i):
+        return self.texts[i]
+
+    def record_id(self, i):
+        return self.record_ids[int(self.chunk_record[i])]
+
+    def chunk_id(self, i):
+        return f"{self.record_id(i)}:{int(self.chunk_ordinal[i])}"
+
+    def record_metadata(self, row):
+        return {name: json.loads(column[row]) for name, column in self.columns.items()}
+
+    def metadata(self, i):
+        metadata = self.record_metadata(int(self.chunk_record[i]))
+        metadata["chunk_id"] = self.chunk_id(i)
+        return metadata
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Document(page_content=self.text(i), metadata=self.metadata(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # --- Busca por id (O(log n)) ---
+
+    def record_row(self, rid):
+        key = np.uint64(record_key(rid))
+        pos = int(np.searchsorted(self.record_keys, key))
+        while pos < len(self.record_keys) and self.record_keys[pos] == key:
+            row = int(self.record_order[pos])
+            if self.record_ids[row] == str(rid):
+                return row
+            pos += 1
+        return None
+
+    def index_of(self, chunk_id):
+        rid, ordinal = split_chunk_id(chunk_id)
+        row = self.record_row(rid)
+        if row is None:
+            return None
+        # Os chunks de um registro são sempre gravados em sequência
+        i = int(self.record_first[row]) + ordinal
+        if i < len(self) and self.chunk_record[i] == row and self.chunk_ordinal[i] == ordinal:
+            return i
+        return None
+
+    def close(self):
+        self.texts.close()
+        self.record_ids.close()
+        for column in self.columns.values():
+            column.close()
+
+    # --- Escrita ---
+
+    @staticmethod
+    def write(directory, documents):
+        """
+        Grava os documentos (com metadata["chunk_id"] = "<registro>:<i>") em directory.
+        Os chunks de um mesmo registro precisam vir em sequência. A gravação é feita
+        num diretório temporário e trocada no final, então leitores nunca veem
+        uma base pela metade.
+        """
+        directory = directory.rstrip("/")
+        tmp_directory = directory + ".tmp"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(os.path.join(tmp_directory, "columns"))
+
+        path = lambda name: os.path.join(tmp_directory, name)
+
+        texts = StringColumnWriter(path("text"))
+        record_ids = StringColumnWriter(path("record_ids"))
+        column_writers = {}
+        chunk_record = array.array("q")
+        chunk_ordinal = array.array("q")
+        record_first = array.array("q")
+        seen_records = set()
+
+        current_rid = None
+        n_records = 0
+        n_chunks = 0
+
+        for doc in documents:
+            rid, ordinal = split_chunk_id(doc.metadata["chunk_id"])
+
+            if rid != current_rid:
+                if rid in seen_records:
+                    raise ValueError(f"Chunks do registro {rid} não estão em sequência")
+                seen_records.add(rid)
+                current_rid = rid
+
+                record_ids.append(rid)
+                record_first.append(n_chunks)
+                fields = {k: v for k, v in doc.metadata.items() if k != "chunk_id"}
+                for name in fields.keys() - column_writers.keys():
+                    # Coluna nova: registros anteriores ficam com null
+                    writer = StringColumnWriter(path(os.path.join("columns", name)))
+                    for _ in range(n_records):
+                        writer.append("null")
+                    column_writers[name] = writer
+                for name, writer in column_writers.items():
+                    writer.append(json.dumps(fields.get(name), ensure_ascii=False))
+                n_records += 1
+
+            texts.append(doc.page_content)
+            chunk_record.append(n_records - 1)
+            chunk_ordinal.append(ordinal)
+            n_chunks += 1
+
+        texts.close()
+        record_ids.close()
+        for writer in column_writers.values():
+            writer.close()
+
+        np.save(path("chunk_record.npy"), np.frombuffer(chunk_record, dtype=np.int64))
+        np.save(path("chunk_ordinal.npy"), np.frombuffer(chunk_ordinal, dtype=np.int64))
+        np.save(path("record_first.npy"), np.frombuffer(record_first, dtype=np.int64))
+
+        keys = np.array([record_key(rid) for rid in _iter_column(path("record_ids"))], dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        np.save(path("record_keys.npy"), keys[order])
+        np.save(path("record_order.npy"), order.astype(np.int64))
+
+        with open(path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"columns": sorted(column_writers), "chunks": n_chunks, "records": n_records,
+                       "generation": uuid.uuid4().hex}, f)
+
+        # Troca de diretórios (no Linux, um leitor com o antigo mapeado continua funcionando)
+        old_directory = directory + ".old"
+        shutil.rmtree(old_directory, ignore_errors=True)
+        if os.path.exists(directory):
+            os.rename(directory, old_directory)
+        os.rename(tmp_directory, directory)
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+        return n_chunks
+
+
+def _iter_column(prefix):
+    column = StringColumn(prefix)
+    try:
+        for i in range(len(column)):
+            yield column[i]
+    finally:
+        column.close()
@@ -0,0 +1,182 @@
+import collections
+import functools
+import re
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from embedding_pipeline import get_token_counter
+
+# Empacotamento do contexto do chain "stuff" num orçamento de tokens.
+#
+# O stuff manda os k chunks inteiros no prompt. Antes disso, o ContextPacker:
+#   1. conta os tokens de cada chunk (tokenizer único por modelo + cache por texto,
+#      já que os mesmos chunks voltam em várias perguntas)
+#   2. remove a sobreposição entre chunks vizinhos do mesmo arquivo: os splitters
+#      repetem até chunk_overlap caracteres (150) no fim de um e no começo do outro
+#   3. preenche max_tokens na ordem de relevância da busca; o primeiro chunk que não
+#      cabe inteiro é cortado em frases, e os seguintes ficam de fora
+#
+# PackedRetriever embrulha qualquer retriever, então serve para o RetrievalQA e para o
+# ConversationalRetrievalChain sem mudar o prompt. query_stats guarda, por pergunta,
+# os tokens antes e depois (quanto saiu na sobreposição e quanto no corte).
+#
+#   packer = ContextPacker(max_tokens=800)
+#   retriever = PackedRetriever(retriever=vectordb.as_retriever(), packer=packer)
+
+_sentence_pattern = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _sentence_pattern.split(text) if sentence.strip()]
+
+
+def overlap(first, second, min_chars=20, max_chars=300):
+    """
+    Tamanho do maior fim de first que é também o começo de second (0 se < min_chars).
+    """
+    if len(first) < min_chars or len(second) < min_chars:
+        return 0
+    tail = first[-max_chars:]
+    probe = second[:min_chars]
+    start = tail.find(probe)
+    while start != -1:
+        if second.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+class ContextPacker:
+
+    def __init__(self, max_tokens=1000, model="gpt-3.5-turbo", min_overlap=20, max_overlap=300,
+                 separator="\n\n", cache_size=4096, count_tokens=None):
+        """
+        max_tokens = orçamento do contexto (só os documentos, sem o resto do prompt).
+        """
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.separator = separator
+        self.count_tokens = functools.lru_cache(maxsize=cache_size)(count_tokens or get_token_counter(model))
+        self.separator_tokens = self.count_tokens(separator)
+
+        self.query_stats = collections.deque(maxlen=1000)
+
+    # --- Sobreposição ---
+
+    def _same_file(self, a, b):
+        return (a.metadata.get("source"), a.metadata.get("page")) == (b.metadata.get("source"), b.metadata.get("page"))
+
+    def _dedup(self, text, doc, kept):
+        # Tira do chunk o trecho que um chunk vizinho já incluído repete
+        for other, other_text in kept:
+            if not self._same_file(doc, other):
+                continue
+            if text in other_text:
+                return ""
+            cut = overlap(other_text, text, self.min_overlap, self.max_overlap)
+            if cut:
+                text = text[cut:].lstrip()
+            cut = overlap(text, other_text, self.min_overlap, self.max_overlap)
+            if cut:
+                text = text[:-cut].rstrip()
+        return text
+
+    # --- Corte ---
+
+    def _trim(self, text, budget):
+        # Frases do começo do chunk enquanto couberem
+        kept = []
+        used = 0
+        for sentence in split_sentences(text):
+            tokens = self.count_tokens(sentence + " ")
+            if used + tokens > budget:
+                break
+            kept.append(sentence)
+            used += tokens
+        return " ".join(kept)
+
+    def pack(self, question, docs):
+        """
+        Documentos na ordem recebida (relevância), sem sobreposição e dentro de max_tokens.
+        """
+        original = sum(self.count_tokens(doc.page_content) for doc in docs) + self.separator_tokens * max(len(docs) - 1, 0)
+
+        kept = []  # (documento original, texto que entra)
+        used = 0
+        overlap_tokens = 0
+        trimmed_tokens = 0
+        for position, doc in enumerate(docs):
+            text = self._dedup(doc.page_content, doc, kept)
+            overlap_tokens += self.count_tokens(doc.page_content) - (self.count_tokens(text) if text else 0)
+            if not text:
+                continue
+
+            budget = self.max_tokens - used - (self.separator_tokens if kept else 0)
+            tokens = self.count_tokens(text)
+            if tokens > budget:
+                trimmed = self._trim(text, budget) if budget > 0 else ""
+                trimmed_tokens += tokens - (self.count_tokens(trimmed) if trimmed else 0)
+                text = trimmed
+                if text:
+                    kept.append((doc, text))
+                # Os demais (menos relevantes) ficam de fora
+                for rest in docs[position + 1:]:
+                    trimmed_tokens += self.count_tokens(rest.page_content)
+                break
+            kept.append((doc, text))
+            used += tokens + (self.separator_tokens if len(kept) > 1 else 0)
+
+        packed = [Document(page_content=text, metadata=doc.metadata) for doc, text in kept]
+        packed_tokens = sum(self.count_tokens(doc.page_content) for doc in packed) \
+            + self.separator_tokens * max(len(packed) - 1, 0)
+        self.query_stats.append({
+            "question": question,
+            "documents": len(docs),
+            "packed_documents": len(packed),
+            "original_tokens": original,
+            "packed_tokens": packed_tokens,
+            "saved_tokens": original - packed_tokens,
+            "overlap_tokens": overlap_tokens,
+            "trimmed_tokens": trimmed_tokens,
+        })
+        return packed
+
+    # --- Métricas ---
+
+    def stats(self):
+        original = sum(stat["original_tokens"] for stat in self.query_stats)
+        saved = sum(stat["saved_tokens"] for stat in self.query_stats)
+        return {
+            "queries": len(self.query_stats),
+            "original_tokens": original,
+            "saved_tokens": saved,
+            "overlap_tokens": sum(stat["overlap_tokens"] for stat in self.query_stats),
+            "trimmed_tokens": sum(stat["trimmed_tokens"] for stat in self.query_stats),
+            "saved_ratio": saved / original if original else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Contexto: {stats['queries']} perguntas, {stats['saved_tokens']} de {stats['original_tokens']} tokens "
+              f"economizados ({stats['saved_ratio']:.1%}): {stats['overlap_tokens']} de sobreposição, "
+              f"{stats['trimmed_tokens']} cortados pelo orçamento de {self.max_tokens}")
+
+
+class PackedRetriever(BaseRetriever):
+    """
+    Retriever cujos documentos passam pelo ContextPacker antes de ir para o prompt.
+    """
+
+    retriever: Any
+    packer: Any
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        return self.packer.pack(query, docs)
+
+    async def _aget_relevant_documents(self, query, *, run_manager):
+        docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()})
+        return self.packer.pack(query, docs)
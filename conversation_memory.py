@@ -0,0 +1,185 @@
+from typing import Any
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from embedding_pipeline import get_token_counter
+
+# Memória de conversa com custo limitado por turno.
+#
+# As últimas max_turns trocas ficam na íntegra, desde que caibam em max_tokens
+# (com espaço reservado para o resumo); as mais antigas são dobradas num resumo
+# contínuo. Cada dobra manda ao LLM só o resumo atual + as trocas que saíram da
+# janela, então o custo de resumir também não cresce com a conversa.
+#
+# O histórico enviado ao ConversationalRetrievalChain fica limitado a ~max_tokens,
+# em vez de crescer a cada turno como no ConversationBufferMemory. turn_stats
+# registra, por turno, quantos tokens o histórico completo teria e quantos foram
+# enviados (e quanto as dobras gastaram).
+#
+#   window = ConversationWindow(llm, max_turns=4, max_tokens=800)
+#   qa({"question": q, "chat_history": window.chat_history()})   # histórico externo (chatbot)
+#   window.add_turn(q, result["answer"])
+#
+#   memory = SummaryWindowMemory(window=window)                   # ou como memory= do chain
+
+summary_template = """Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary in at most {max_words} words. Keep the names, numbers and topics the user may refer back to.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+
+
+class ConversationWindow:
+
+    def __init__(self, llm=None, max_turns=4, max_tokens=1000, summary_words=150,
+                 model="gpt-3.5-turbo", count_tokens=None):
+        """
+        llm = modelo que resume as trocas antigas (None = só descarta, sem resumo).
+        """
+        self.llm = llm
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_words = summary_words
+        self.count_tokens = count_tokens or get_token_counter(model)
+
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = []  # [(pergunta, resposta, tokens)]
+
+        self.full_tokens = 0  # o que um buffer sem limite mandaria
+        self.turn_stats = []
+
+    # --- Histórico ---
+
+    def chat_history(self):
+        """
+        Histórico no formato do ConversationalRetrievalChain: resumo (se houver) + trocas recentes.
+        """
+        history = [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] if self.summary else []
+        return history + [(human, ai) for human, ai, _ in self.turns]
+
+    def messages(self):
+        history = [SystemMessage(content=f"Summary of the earlier conversation: {self.summary}")] if self.summary else []
+        for human, ai, _ in self.turns:
+            history.extend([HumanMessage(content=human), AIMessage(content=ai)])
+        return history
+
+    @property
+    def tokens(self):
+        return self.summary_tokens + sum(tokens for _, _, tokens in self.turns)
+
+    # --- Atualização ---
+
+    def _append(self, human, ai):
+        tokens = self.count_tokens(f"Human: {human}\nAssistant: {ai}")
+        self.turns.append((human, ai, tokens))
+        self.full_tokens += tokens
+
+    @property
+    def summary_reserve(self):
+        # O tamanho do próximo resumo só é conhecido depois da dobra: reserva o máximo pedido
+        if self.llm is None:
+            return 0
+        return max(self.summary_tokens, self.summary_words * 4 // 3)
+
+    def _overflow(self):
+        # A troca mais recente sempre fica, mesmo que sozinha passe do orçamento
+        folded = []
+        budget = self.max_tokens - self.summary_reserve
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns
+                                       or self.tokens - self.summary_tokens > budget):
+            folded.append(self.turns.pop(0))
+        return folded
+
+    def _summary_prompt(self, folded):
+        new_lines = "\n".join(f"Human: {human}\nAssistant: {ai}" for human, ai, _ in folded)
+        return summary_template.format(max_words=self.summary_words, summary=self.summary or "(empty)",
+                                       new_lines=new_lines)
+
+    def _record(self, prompt=None):
+        sent = self.tokens
+        self.turn_stats.append({
+            "turn": len(self.turn_stats) + 1,
+            "full_tokens": self.full_tokens,
+            "sent_tokens": sent,
+            "saved_tokens": self.full_tokens - sent,
+            "summary_prompt_tokens": self.count_tokens(prompt) if prompt else 0,
+        })
+
+    def _set_summary(self, result):
+        self.summary = str(getattr(result, "content", result)).strip()
+        self.summary_tokens = self.count_tokens(self.summary)
+
+    def add_turn(self, human, ai):
+        self._append(human, ai)
+        folded = self._overflow()
+        prompt = None
+        if folded and self.llm is not None:
+            prompt = self._summary_prompt(folded)
+            self._set_summary(self.llm.invoke(prompt))
+        self._record(prompt)
+
+    async def aadd_turn(self, human, ai):
+        self._append(human, ai)
+        folded = self._overflow()
+        prompt = None
+        if folded and self.llm is not None:
+            prompt = self._summary_prompt(folded)
+            self._set_summary(await self.llm.ainvoke(prompt))
+        self._record(prompt)
+
+    def clear(self):
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = []
+        self.full_tokens = 0
+        self.turn_stats = []
+
+    # --- Métricas ---
+
+    def print_stats(self):
+        if not self.turn_stats:
+            print("Memória: nenhum turno ainda")
+            return
+        last = self.turn_stats[-1]
+        spent = sum(stat["summary_prompt_tokens"] for stat in self.turn_stats)
+        print(f"Memória: turno {last['turn']}, histórico enviado com {last['sent_tokens']} tokens "
+              f"(completo teria {last['full_tokens']}, economia de {last['saved_tokens']}); "
+              f"{spent} tokens gastos em resumos até aqui")
+
+
+class SummaryWindowMemory(BaseChatMemory):
+    """
+    ConversationWindow como memory= de chains do LangChain (no lugar do ConversationBufferMemory).
+    """
+
+    window: Any
+    memory_key: str = "chat_history"
+    return_messages: bool = True
+
+    @property
+    def memory_variables(self):
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs):
+        if self.return_messages:
+            return {self.memory_key: self.window.messages()}
+        history = [f"System: {self.window.summary}"] if self.window.summary else []
+        history += [f"Human: {human}\nAI: {ai}" for human, ai, _ in self.window.turns]
+        return {self.memory_key: "\n".join(history)}
+
+    def save_context(self, inputs, outputs):
+        human, ai = self._get_input_output(inputs, outputs)
+        self.window.add_turn(human, ai)
+
+    async def asave_context(self, inputs, outputs):
+        human, ai = self._get_input_output(inputs, outputs)
+        await self.window.aadd_turn(human, ai)
+
+    def clear(self):
+        self.window.clear()
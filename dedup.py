@@ -0,0 +1,186 @@
+import hashlib
+import re
+import unicodedata
+
+import numpy as np
+
+# Deduplicação de chunks entre o split e o embedding.
+#   1. Exata: hash do texto normalizado (minúsculas, espaços colapsados, NFKC).
+#   2. Quase-duplicata: MinHash dos shingles de palavras + LSH por bandas; os
+#      candidatos de um mesmo bucket são confirmados pela similaridade de Jaccard
+#      estimada (>= threshold).
+# O chunk que sobrevive recebe nos metadados as fontes das duplicatas descartadas.
+
+_mersenne_prime = np.uint64((1 << 61) - 1)
+_max_hash = np.uint64((1 << 32) - 1)
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def shingles(text, size=5):
+    words = normalize_text(text).split(" ")
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def lsh_params(threshold, num_perm):
+    """
+    Escolhe (bandas, linhas por banda) cuja curva S tem o ponto de inflexão,
+    (1/b) ** (1/r), mais próximo do threshold.
+    """
+    best = None
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+def source_label(metadata):
+    source = metadata.get("source", "?")
+    page = metadata.get("page")
+    return f"{source}#p{page}" if page is not None else str(source)
+
+
+class ChunkDeduplicator:
+    """
+    Filtro de duplicatas com estado: pode ser aplicado lote a lote (streaming),
+    e um chunk de um lote posterior é comparado com todos os anteriores.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=128, shingle_size=5, near_duplicates=True, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.near_duplicates = near_duplicates
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self._b = generator.randint(0, np.iinfo(np.int64).max, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+        self.survivors = []        # documentos mantidos, na ordem em que passaram
+        self.signatures = []       # assinatura MinHash de cada sobrevivente
+        self.by_hash = {}          # hash exato -> índice do sobrevivente
+        self.buckets = [dict() for _ in range(self.bands)]
+
+        self.emitted = 0           # sobreviventes já devolvidos por filter()
+        self.late_merges = set()   # sobreviventes já devolvidos que receberam duplicatas depois
+
+        self.seen = 0
+        self.exact_duplicates = 0
+        self.near_duplicates_found = 0
+
+    # --- MinHash / LSH ---
+
+    def signature(self, text):
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in shingles(text, self.shingle_size)],
+            dtype=np.uint64
+        )
+        # (a*x + b) mod p, truncado em 32 bits; o overflow de uint64 é intencional
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _mersenne_prime & _max_hash
+        return permuted.min(axis=0)
+
+    def band_keys(self, signature):
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, signature[start:start + self.rows].tobytes()
+
+    def find_near_duplicate(self, signature):
+        candidates = set()
+        for band, key in self.band_keys(signature):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        best, best_similarity = None, self.threshold
+        for idx in candidates:
+            similarity = float(np.mean(self.signatures[idx] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = idx, similarity
+        return best
+
+    # --- Filtro ---
+
+    def merge(self, idx, duplicate):
+        survivor = self.survivors[idx]
+        sources = survivor.metadata.get("duplicate_sources")
+        label = source_label(duplicate.metadata)
+        # Chroma só aceita metadados escalares: as fontes viram uma string
+        survivor.metadata["duplicate_sources"] = f"{sources}; {label}" if sources else label
+        survivor.metadata["duplicate_count"] = survivor.metadata.get("duplicate_count", 0) + 1
+        if idx < self.emitted:
+            self.late_merges.add(idx)
+
+    def filter(self, docs):
+        """
+        Retorna só os chunks inéditos deste lote. Cada um recebe um id
+        determinístico (hash do texto normalizado), usado também no vector store.
+        """
+        kept = []
+        for doc in docs:
+            self.seen += 1
+            key = text_hash(doc.page_content)
+
+            if key in self.by_hash:
+                self.exact_duplicates += 1
+                self.merge(self.by_hash[key], doc)
+                continue
+
+            signature = None
+            if self.near_duplicates:
+                signature = self.signature(doc.page_content)
+                idx = self.find_near_duplicate(signature)
+                if idx is not None:
+                    self.near_duplicates_found += 1
+                    self.by_hash[key] = idx
+                    self.merge(idx, doc)
+                    continue
+
+            idx = len(self.survivors)
+            doc.id = key
+            self.survivors.append(doc)
+            self.signatures.append(signature)
+            self.by_hash[key] = idx
+            if signature is not None:
+                for band, band_key in self.band_keys(signature):
+                    self.buckets[band].setdefault(band_key, []).append(idx)
+            kept.append(doc)
+
+        self.emitted = len(self.survivors)
+        return kept
+
+    def apply_late_merges(self, vectordb):
+        """
+        Atualiza no Chroma os metadados dos chunks que já tinham sido indexados
+        quando uma duplicata deles apareceu em um lote posterior.
+        """
+        if not self.late_merges:
+            return 0
+        docs = [self.survivors[idx] for idx in sorted(self.late_merges)]
+        vectordb._collection.update(ids=[d.id for d in docs], metadatas=[d.metadata for d in docs])
+        self.late_merges.clear()
+        return len(docs)
+
+    def stats(self):
+        return {
+            "seen": self.seen,
+            "kept": len(self.survivors),
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates_found,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Deduplicação: {stats['seen']} chunks, {stats['kept']} mantidos, "
+              f"{stats['exact_duplicates']} duplicatas exatas, {stats['near_duplicates']} quase-duplicatas")
@@ -0,0 +1,303 @@
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+from scipy import sparse
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import JSONLoader
+from langchain_core.documents import Document
+
+from langchain_chroma import Chroma
+
+from embedding_cache import CachedEmbeddings
+from chunk_store import ChunkStore
+from bm25 import BM25Index, TermHasher
+from entity_index import build_entity_index
+
+# Indexador incremental da base de sonhos.
+# Um manifesto guarda, para cada registro do dreams.json (pelo seu "id"),
+# o hash do conteúdo e os ids dos chunks gerados. A cada execução só os
+# registros novos ou alterados são divididos e embedados; os chunks de
+# registros alterados ou removidos são apagados do Chroma e da matriz de contagens
+# de termos, a partir da qual o índice BM25 é remontado.
+
+dreams_file = 'docs/json/dreams.json'
+
+persist_directory = 'vectordb/dreams/'
+term_counts_file = persist_directory + 'term_counts.npz'
+bm25_directory = persist_directory + 'bm25/'
+chunks_directory = persist_directory + 'chunks/'
+manifest_file = persist_directory + 'manifest.json'
+entities_file = persist_directory + 'entities.sqlite'
+entity_index_directory = persist_directory + 'entity_index/'
+
+chunk_size = 300
+chunk_overlap = 20
+separators = ["\n\n", "\\n\\n", "\n", "\\n", ".", " ", ""]
+
+# Mudar a configuração do splitter invalida todos os hashes do manifesto
+splitter_signature = json.dumps([chunk_size, chunk_overlap, separators])
+
+chroma_batch_size = 1000
+
+
+def load_json_metadata(record: dict, metadata: dict) -> dict:
+    metadata["id"] = record.get("id")
+    metadata["title"] = record.get("title")
+    metadata["date"] = record.get("date")
+
+    return metadata
+
+
+def get_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=separators
+    )
+
+
+def get_term_hasher():
+    # Analisador padrão do BM25: português, stemmer leve, sem acentos
+    return TermHasher()
+
+
+def record_id(doc):
+    rid = doc.metadata.get("id")
+    if rid is None:
+        rid = doc.metadata.get("seq_num")
+    return str(rid)
+
+
+def record_hash(doc):
+    payload = json.dumps({
+        "text": doc.page_content,
+        "title": doc.metadata.get("title"),
+        "date": doc.metadata.get("date"),
+        "splitter": splitter_signature,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_records():
+    loader = JSONLoader(
+        file_path=dreams_file,
+        jq_schema='.[]',
+        content_key='text',
+        metadata_func=load_json_metadata
+    )
+
+    records = {}
+    for doc in loader.load():
+        # seq_num muda quando um registro é inserido no meio do arquivo;
+        # não deve fazer parte da identidade do chunk
+        doc.metadata.pop("seq_num", None)
+        records[record_id(doc)] = doc
+    return records
+
+
+def load_manifest():
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+
+def split_record(rid, doc, splitter):
+    chunks = []
+    for i, text in enumerate(splitter.split_text(doc.page_content)):
+        metadata = dict(doc.metadata)
+        metadata["chunk_id"] = f"{rid}:{i}"
+        chunks.append(Document(page_content=text, metadata=metadata))
+    return chunks
+
+
+def load_state():
+    store = ChunkStore(chunks_directory)
+    counts = sparse.load_npz(term_counts_file).tocsr()
+    return store, counts
+
+
+def save_state(documents, counts, hasher):
+    total = ChunkStore.write(chunks_directory, documents)
+
+    sparse.save_npz(term_counts_file, counts)
+    BM25Index.write(bm25_directory, counts, hasher)
+    return total
+
+
+def lexical_state_matches(hasher):
+    # Mudar o analisador muda os ids dos termos: as contagens salvas não servem mais
+    if not BM25Index.exists(bm25_directory):
+        return False
+    with open(os.path.join(bm25_directory, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f).get("hasher") == hasher.config
+
+
+def update_index(embedding, verbose=True):
+    """
+    Sincroniza os índices (chunks, BM25 e Chroma) com o dreams.json.
+    Retorna um dict com quantos registros foram adicionados/alterados/removidos.
+    """
+
+    os.makedirs(persist_directory, exist_ok=True)
+
+    manifest = load_manifest()
+    hasher = get_term_hasher()
+    full_rebuild = (not manifest or not ChunkStore.exists(chunks_directory)
+                    or not os.path.exists(term_counts_file) or not lexical_state_matches(hasher))
+
+    vectordb = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding
+    )
+
+    if full_rebuild:
+        # Sem manifesto não dá para saber quais ids estão no Chroma: recomeça do zero
+        vectordb.delete_collection()
+        vectordb = Chroma(
+            persist_directory=persist_directory,
+            embedding_function=embedding
+        )
+        manifest = {}
+        store = None
+        counts = sparse.csr_matrix((0, hasher.n_features), dtype=np.float32)
+    else:
+        store, counts = load_state()
+
+    records = load_records()
+    hashes = {rid: record_hash(doc) for rid, doc in records.items()}
+
+    added = [rid for rid in records if rid not in manifest]
+    changed = [rid for rid in records if rid in manifest and manifest[rid]["hash"] != hashes[rid]]
+    removed = [rid for rid in manifest if rid not in records]
+
+    summary = {"added": len(added), "changed": len(changed), "removed": len(removed)}
+
+    if not (added or changed or removed):
+        if verbose:
+            print("Base de sonhos já está atualizada.")
+        if store is not None:
+            store.close()
+        return summary
+
+    # --- 1. Remove chunks obsoletos ---
+    # Filtra pelo registro de origem (e não só pelos ids do manifesto) para que
+    # uma execução interrompida antes de salvar o manifesto não duplique linhas
+    dirty = set(added + changed + removed)
+    stale_ids = {cid for rid in changed + removed for cid in manifest[rid]["chunk_ids"]}
+
+    if store is not None:
+        dirty_rows = [row for row in (store.record_row(rid) for rid in dirty) if row is not None]
+        keep = ~np.isin(store.chunk_record, dirty_rows)
+    else:
+        keep = np.zeros(0, dtype=bool)
+
+    if not keep.all():
+        counts = counts[keep]
+
+    # Os chunks mantidos são lidos sob demanda do store atual ao gravar o novo
+    kept_chunks = (store[int(i)] for i in np.flatnonzero(keep))
+
+    if stale_ids:
+        stale_list = sorted(stale_ids)
+        for start in range(0, len(stale_list), chroma_batch_size):
+            vectordb.delete(ids=stale_list[start:start + chroma_batch_size])
+
+        for rid in removed:
+            del manifest[rid]
+
+    # --- 2. Divide e indexa apenas registros novos/alterados ---
+    splitter = get_splitter()
+    new_chunks = []
+    for rid in added + changed:
+        chunks = split_record(rid, records[rid], splitter)
+        new_chunks.extend(chunks)
+        manifest[rid] = {
+            "hash": hashes[rid],
+            "chunk_ids": [c.metadata["chunk_id"] for c in chunks],
+        }
+
+    if new_chunks:
+        new_counts = hasher.counts([c.page_content for c in new_chunks])
+        counts = sparse.vstack([counts, new_counts], format="csr")
+
+        # Com cache, embeda todo o delta numa chamada só (o pipeline paraleliza os
+        # lotes e grava checkpoints); os add_documents abaixo só encontram hits
+        if isinstance(embedding, CachedEmbeddings):
+            embedding.embed_documents([c.page_content for c in new_chunks])
+
+        for start in range(0, len(new_chunks), chroma_batch_size):
+            batch = new_chunks[start:start + chroma_batch_size]
+            vectordb.add_documents(batch, ids=[c.metadata["chunk_id"] for c in batch])
+
+    # --- 3. Persiste; o manifesto por último, para que uma falha no meio refaça o delta ---
+    total = save_state(itertools.chain(kept_chunks, new_chunks), counts, hasher)
+    save_manifest(manifest)
+
+    if store is not None:
+        store.close()
+
+    if verbose:
+        print(f"Base de sonhos atualizada: {summary['added']} novos, "
+              f"{summary['changed']} alterados, {summary['removed']} removidos "
+              f"({len(new_chunks)} chunks embedados, {total} no total).")
+        if hasattr(embedding, "print_stats"):
+            embedding.print_stats()
+
+    return summary
+
+
+def ensure_index(embedding):
+    if not os.path.exists(manifest_file):
+        update_index(embedding)
+
+
+def index_entities(entity_cache, verbose=True):
+    """
+    Extrai (em lote) as entidades de todos os chunks que ainda não estão no
+    cache e reconstrói o índice invertido de entidades. Como a chave do cache
+    é o texto do chunk, só chunks novos/alterados passam pelo modelo.
+    """
+    store = ChunkStore(chunks_directory)
+    try:
+        computed = entity_cache.precompute((store.text(i) for i in range(len(store))), verbose=verbose)
+        terms = build_entity_index(entity_index_directory, store, entity_cache)
+    finally:
+        store.close()
+    if verbose:
+        print(f"Entidades: {computed} chunks processados pelo modelo, {terms} entidades distintas no índice.")
+        entity_cache.print_stats()
+    return computed
+
+
+if __name__ == "__main__":
+    import argparse
+    import openai
+    from dotenv import load_dotenv, find_dotenv
+    from langchain_openai import OpenAIEmbeddings
+    from embedding_pipeline import EmbeddingPipeline
+
+    _ = load_dotenv(find_dotenv())
+    openai.api_key = os.environ['OPENAI_API_KEY']
+
+    parser = argparse.ArgumentParser(description="Atualiza os índices da base de sonhos")
+    parser.add_argument("--entities", action="store_true", help="também extrai as entidades (GLiNER) dos chunks")
+    args = parser.parse_args()
+
+    embedding = CachedEmbeddings(EmbeddingPipeline(OpenAIEmbeddings()))
+    update_index(embedding)
+
+    if args.entities:
+        from entity_cache import EntityCache
+        index_entities(EntityCache(entities_file))
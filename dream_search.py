@@ -0,0 +1,382 @@
+import os
+
+import numpy as np
+
+from langchain_chroma import Chroma
+
+from dream_indexer import persist_directory, bm25_directory, chunks_directory, manifest_file
+from dream_indexer import entity_index_directory
+from dream_indexer import ensure_index
+from chunk_store import ChunkStore
+from bm25 import BM25Index
+from entity_index import EntityIndex
+from topk import top_k_indices, top_k_rows
+
+# Serviço de busca na base de sonhos.
+# Carrega chunks, índice BM25 e cliente do Chroma uma única vez e os mantém
+# em memória; cada consulta paga só o custo de pontuar.
+#
+# As versões *_batch recebem uma lista de consultas: um único pedido de embeddings,
+# BM25 como produto esparso (consultas x termos) @ (termos x chunks), similaridade
+# como Q @ E.T sobre a matriz float32 dos embeddings e top-k por linha com argpartition.
+
+# Tamanho padrão do conjunto de candidatos de cada lado da busca híbrida
+default_candidates = 100
+
+fusion_methods = ("weighted", "rrf")
+
+# Com filtro de entidades, até quantos chunks permitidos a busca semântica
+# pontua direto (vetores lidos do Chroma) em vez de passar o filtro ao Chroma
+semantic_exact_limit = 5000
+
+# Consultas pontuadas juntas nas versões em lote (limita as matrizes consultas x chunks)
+default_batch_size = 128
+
+
+class DreamSearchEngine:
+
+    def __init__(self, embedding):
+        self.embedding = embedding
+        ensure_index(embedding)
+        self.load()
+
+    def load(self):
+        if getattr(self, "chunks", None) is not None:
+            self.chunks.close()
+        if getattr(self, "entities", None) is not None:
+            self.entities.close()
+        # Só mapeia os arquivos: os textos e metadados são lidos sob demanda
+        self.chunks = ChunkStore(chunks_directory)
+
+        # O índice de entidades guarda posições de chunks: só vale para a mesma geração do store
+        self.entities = None
+        if EntityIndex.exists(entity_index_directory):
+            entities = EntityIndex(entity_index_directory)
+            if entities.generation == self.chunks.generation:
+                self.entities = entities
+            else:
+                entities.close()
+
+        # Postings comprimidos em disco (mmap): só os blocos dos termos consultados são lidos
+        self.lexical_index = BM25Index(bm25_directory)
+
+        self.vectordb = Chroma(
+            persist_directory=persist_directory,
+            embedding_function=self.embedding
+        )
+        # Matriz de embeddings (chunks x dimensão), lida do Chroma só na primeira busca em lote
+        self._embedding_matrix = None
+
+        self.loaded_version = self.index_version()
+
+    def index_version(self):
+        # O dream_indexer grava o manifesto por último: mudou o manifesto, mudou a base
+        return os.path.getmtime(manifest_file) if os.path.exists(manifest_file) else None
+
+    def reload_if_changed(self):
+        if self.index_version() != self.loaded_version:
+            self.load()
+
+    # --- Entidades ---
+
+    def entity_rows(self, entities):
+        """
+        Posições dos chunks que têm as entidades pedidas ({rótulo: valor ou [valores]}),
+        ou None sem filtro.
+        """
+        if not entities:
+            return None
+        if self.entities is None:
+            raise ValueError("Índice de entidades ausente ou desatualizado: rode python dream_indexer.py --entities")
+        return self.entities.match(entities)
+
+    def facets(self, label, entities=None, top=10):
+        """
+        Valores mais frequentes de um rótulo (ex: "Emotion"), opcionalmente dentro de um filtro.
+        """
+        self.reload_if_changed()
+        if self.entities is None:
+            raise ValueError("Índice de entidades ausente ou desatualizado: rode python dream_indexer.py --entities")
+        return self.entities.facets(label, self.entity_rows(entities), top)
+
+    # --- Pontuação ---
+
+    def lexical_candidates(self, query, m, allowed=None):
+        """
+        Top-m do BM25, pulando os postings que não podem entrar no top-m (MaxScore).
+        allowed = posições permitidas (filtro de entidades).
+        Retorna (índices, scores) em ordem decrescente.
+        """
+        terms, weights = self.lexical_index.query_terms(query)
+        return self.lexical_index.search(terms, weights, m, allowed)
+
+    def lexical_scores_for(self, query, indices):
+        terms, weights = self.lexical_index.query_terms(query)
+        indices = np.asarray(indices, dtype=np.int64)
+        order = np.argsort(indices)
+        scores = np.zeros(len(indices))
+        scores[order] = self.lexical_index.score_rows(terms, weights, indices[order])
+        return scores
+
+    def semantic_candidates(self, query_vector, m, allowed=None):
+        """
+        Top-m do Chroma como (chunk_id, similaridade), com similaridade = 1 - distância.
+        allowed = posições permitidas (filtro de entidades).
+        """
+        if allowed is None:
+            results = self.vectordb.similarity_search_by_vector_with_relevance_scores(query_vector, k=m)
+            return [(doc.metadata["chunk_id"], 1 - score) for doc, score in results]
+
+        chunk_ids = [self.chunks.chunk_id(int(i)) for i in allowed]
+        if not chunk_ids:
+            return []
+        if len(chunk_ids) <= semantic_exact_limit:
+            # Poucos chunks permitidos: busca exata só entre eles
+            scores = self.semantic_scores_for(query_vector, chunk_ids)
+            ranked = list(scores.items())
+            top = top_k_indices(np.array([score for _, score in ranked]), m)
+            return [ranked[i] for i in top]
+
+        results = self.vectordb.similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=m, filter={"chunk_id": {"$in": chunk_ids}})
+        return [(doc.metadata["chunk_id"], 1 - score) for doc, score in results]
+
+    def semantic_scores_for(self, query_vector, chunk_ids):
+        found = self.vectordb.get(ids=list(chunk_ids), include=["embeddings"])
+        vectors = np.asarray(found["embeddings"], dtype=np.float32)
+        query = np.asarray(query_vector, dtype=np.float32)
+        # Mesma métrica do Chroma (l2 ao quadrado) para manter a escala do "1 - distância"
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        return dict(zip(found["ids"], 1 - distances))
+
+    # --- Consultas ---
+
+    def lexical(self, query, top_k=5, entities=None):
+        self.reload_if_changed()
+
+        indices, scores = self.lexical_candidates(query, top_k, self.entity_rows(entities))
+
+        return [(self.chunks[i], score) for i, score in zip(indices, scores)]
+
+    def semantic(self, query, top_k=5, entities=None):
+        self.reload_if_changed()
+
+        if not entities:
+            return self.vectordb.similarity_search_with_score(query, k=top_k)
+
+        ranked = self.semantic_candidates(self.embedding.embed_query(query), top_k, self.entity_rows(entities))
+        # Mesmo formato do Chroma: (documento, distância)
+        return [(self.chunks[self.chunks.index_of(cid)], 1 - similarity) for cid, similarity in ranked]
+
+    def hybrid(self, query, alpha=0.5, top_k=5, fusion="weighted", candidates=None, rrf_k=60, entities=None):
+        """
+        alpha = peso do resultado semântico (0.0 a 1.0)
+        fusion = "weighted" (soma ponderada dos scores) ou "rrf" (reciprocal rank fusion)
+        candidates = quantos candidatos buscar de cada lado (padrão: default_candidates)
+        entities = filtro de entidades, ex: {"Location": "mar", "Emotion": ["medo", "pavor"]}
+
+        Só os candidatos de cada lado são pontuados, então o custo não cresce com o corpus.
+        """
+        if fusion not in fusion_methods:
+            raise ValueError(f"Fusão desconhecida: {fusion} (use uma de {fusion_methods})")
+
+        self.reload_if_changed()
+
+        m = max(candidates or default_candidates, top_k)
+
+        # Pré-filtro: os dois lados só pontuam chunks com as entidades pedidas
+        allowed = self.entity_rows(entities)
+        if allowed is not None and not len(allowed):
+            return []
+
+        # --- Parte 1: BM25 ---
+        lexical_indices, lexical_scores = self.lexical_candidates(query, m, allowed)
+        lexical_ranked = [(self.chunks.chunk_id(i), s) for i, s in zip(lexical_indices, lexical_scores)]
+
+        # --- Parte 2: Embeddings semânticos ---
+        query_vector = self.embedding.embed_query(query)
+        semantic_ranked = self.semantic_candidates(query_vector, m, allowed)
+
+        # --- Combinar scores ---
+        final_scores = {}
+
+        if fusion == "rrf":
+            for weight, ranked in ((1 - alpha, lexical_ranked), (alpha, semantic_ranked)):
+                for rank, (chunk_id, _) in enumerate(ranked):
+                    final_scores[chunk_id] = final_scores.get(chunk_id, 0.0) + weight / (rrf_k + rank + 1)
+        else:
+            lexical_map = dict(lexical_ranked)
+            semantic_map = dict(semantic_ranked)
+
+            # Completa o lado que faltou, pontuando só os candidatos do outro lado
+            missing_lexical = {cid: self.chunks.index_of(cid) for cid in semantic_map if cid not in lexical_map}
+            missing_lexical = {cid: i for cid, i in missing_lexical.items() if i is not None}
+            if missing_lexical:
+                scores = self.lexical_scores_for(query, list(missing_lexical.values()))
+                lexical_map.update(zip(missing_lexical, scores))
+
+            missing_semantic = [cid for cid in lexical_map if cid not in semantic_map]
+            if missing_semantic:
+                semantic_map.update(self.semantic_scores_for(query_vector, missing_semantic))
+
+            # BM25 não tem teto fixo (o cosseno ficava em 0..1): escala pelo melhor candidato
+            top_lexical = max(lexical_scores.max() if len(lexical_scores) else 0.0, 1e-12)
+
+            for chunk_id in dict.fromkeys([*lexical_map, *semantic_map]):
+                final_scores[chunk_id] = alpha * semantic_map.get(chunk_id, 0.0) + (1 - alpha) * lexical_map.get(chunk_id, 0.0) / top_lexical
+
+        # Ids estáveis (os mesmos usados no Chroma) -> posição do chunk
+        positions = {cid: self.chunks.index_of(cid) for cid in final_scores}
+        ranked_ids = [cid for cid, i in positions.items() if i is not None]
+        scores = np.array([final_scores[cid] for cid in ranked_ids])
+        top = top_k_indices(scores, top_k)
+
+        return [(self.chunks[positions[ranked_ids[i]]], scores[i]) for i in top]
+
+    # --- Em lote ---
+
+    def embed_queries(self, queries):
+        # CachedEmbeddings separa o cache de consultas; outros Embeddings embedam tudo num pedido só
+        if hasattr(self.embedding, "embed_queries"):
+            vectors = self.embedding.embed_queries(queries)
+        else:
+            vectors = self.embedding.embed_documents(queries)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embedding_matrix(self, page_size=10000):
+        """
+        (embeddings float32 na ordem do ChunkStore, norma ao quadrado de cada um).
+        """
+        if self._embedding_matrix is None:
+            matrix = None
+            offset = 0
+            while True:
+                found = self.vectordb.get(include=["embeddings"], limit=page_size, offset=offset)
+                if not len(found["ids"]):
+                    break
+                vectors = np.asarray(found["embeddings"], dtype=np.float32)
+                if matrix is None:
+                    matrix = np.zeros((len(self.chunks), vectors.shape[1]), dtype=np.float32)
+                positions = [self.chunks.index_of(cid) for cid in found["ids"]]
+                known = [i for i, p in enumerate(positions) if p is not None]
+                matrix[[positions[i] for i in known]] = vectors[known]
+                offset += len(found["ids"])
+            if matrix is None:
+                matrix = np.zeros((len(self.chunks), 0), dtype=np.float32)
+            self._embedding_matrix = (matrix, (matrix ** 2).sum(axis=1))
+        return self._embedding_matrix
+
+    def semantic_matrix(self, query_vectors, allowed=None):
+        """
+        Similaridade (1 - l2 ao quadrado, a escala do Chroma) de cada consulta com todos os chunks.
+        Chunks fora do filtro ficam com -inf.
+        """
+        matrix, norms = self.embedding_matrix()
+        query_norms = (query_vectors ** 2).sum(axis=1)
+        # |q - e|² = |q|² + |e|² - 2 q·e: um único produto matricial
+        similarity = 1 - (query_norms[:, None] + norms[None, :] - 2 * (query_vectors @ matrix.T))
+        if allowed is not None:
+            blocked = np.ones(len(norms), dtype=bool)
+            blocked[allowed] = False
+            similarity[:, blocked] = -np.inf
+        return similarity
+
+    def _batches(self, queries, batch_size):
+        queries = list(queries)
+        batch_size = batch_size or default_batch_size
+        for start in range(0, len(queries), batch_size):
+            yield queries[start:start + batch_size]
+
+    def lexical_batch(self, queries, top_k=5, entities=None, batch_size=None):
+        """
+        lexical() para uma lista de consultas: [[(documento, score)], ...], na ordem das consultas.
+        """
+        self.reload_if_changed()
+        allowed = self.entity_rows(entities)
+
+        results = []
+        for batch in self._batches(queries, batch_size):
+            for indices, scores in self.lexical_index.search_batch(batch, top_k, allowed):
+                results.append([(self.chunks[i], score) for i, score in zip(indices, scores)])
+        return results
+
+    def semantic_batch(self, queries, top_k=5, entities=None, batch_size=None):
+        """
+        semantic() para uma lista de consultas, com busca exata: [[(documento, distância)], ...].
+        """
+        self.reload_if_changed()
+        allowed = self.entity_rows(entities)
+        if allowed is not None and not len(allowed):
+            return [[] for _ in queries]
+
+        results = []
+        for batch in self._batches(queries, batch_size):
+            similarity = self.semantic_matrix(self.embed_queries(batch), allowed)
+            top, scores = top_k_rows(similarity, top_k)
+            for indices, row in zip(top, scores):
+                keep = np.isfinite(row)
+                results.append([(self.chunks[i], 1 - s) for i, s in zip(indices[keep], row[keep])])
+        return results
+
+    def hybrid_batch(self, queries, alpha=0.5, top_k=5, fusion="weighted", candidates=None, rrf_k=60,
+                     entities=None, batch_size=None):
+        """
+        hybrid() para uma lista de consultas: [[(documento, score)], ...].
+        Os candidatos de cada lado são o top-m de cada consulta, como na versão unitária; só
+        eles são pontuados na fusão (o BM25 do lote continua esparso).
+        """
+        if fusion not in fusion_methods:
+            raise ValueError(f"Fusão desconhecida: {fusion} (use uma de {fusion_methods})")
+
+        self.reload_if_changed()
+
+        m = max(candidates or default_candidates, top_k)
+        allowed = self.entity_rows(entities)
+        if allowed is not None and not len(allowed):
+            return [[] for _ in queries]
+
+        results = []
+        contribution = 1.0 / (rrf_k + np.arange(m, dtype=np.float32) + 1)
+        for batch in self._batches(queries, batch_size):
+            # BM25 fica esparso; só o semântico (exato) é uma matriz densa do lote
+            lexical = self.lexical_index.score_matrix(batch, allowed)
+            lexical.sort_indices()
+            semantic = self.semantic_matrix(self.embed_queries(batch), allowed).astype(np.float32, copy=False)
+            semantic_top, semantic_scores = top_k_rows(semantic, m)
+
+            for row in range(len(batch)):
+                start, end = lexical.indptr[row], lexical.indptr[row + 1]
+                lexical_rows, lexical_row_scores = lexical.indices[start:end], lexical.data[start:end]
+
+                # Candidatos: top-m de cada lado (do BM25, só quem tem algum termo da consulta)
+                top = top_k_indices(lexical_row_scores, m)
+                lexical_hit = lexical_row_scores[top] > 0
+                lexical_top = lexical_rows[top][lexical_hit]
+                semantic_hit = np.isfinite(semantic_scores[row])
+                semantic_candidates = semantic_top[row][semantic_hit]
+                candidates_rows = np.union1d(lexical_top, semantic_candidates)
+
+                fused = np.zeros(len(candidates_rows), dtype=np.float32)
+                if fusion == "rrf":
+                    fused[np.searchsorted(candidates_rows, lexical_top)] += \
+                        (1 - alpha) * contribution[:len(top)][lexical_hit]
+                    fused[np.searchsorted(candidates_rows, semantic_candidates)] += \
+                        alpha * contribution[:len(semantic_hit)][semantic_hit]
+                    keep = fused > 0
+                    candidates_rows, fused = candidates_rows[keep], fused[keep]
+                else:
+                    # Score BM25 dos candidatos (0 se a consulta não tem termo nenhum do chunk)
+                    positions = np.searchsorted(lexical_rows, candidates_rows)
+                    positions = np.minimum(positions, max(len(lexical_rows) - 1, 0))
+                    found = lexical_rows[positions] == candidates_rows if len(lexical_rows) else \
+                        np.zeros(len(candidates_rows), dtype=bool)
+                    lexical_values = np.where(found, lexical_row_scores[positions] if len(lexical_rows) else 0.0, 0.0)
+                    semantic_values = semantic[row, candidates_rows]
+                    # BM25 escalado pelo melhor candidato de cada consulta, como na versão unitária
+                    top_lexical = max(float(lexical_row_scores.max()) if len(lexical_row_scores) else 0.0, 1e-12)
+                    fused = alpha * np.where(np.isfinite(semantic_values), semantic_values, 0.0) \
+                        + (1 - alpha) * lexical_values / top_lexical
+
+                best = top_k_indices(fused, top_k)
+                results.append([(self.chunks[int(i)], float(s)) for i, s in zip(candidates_rows[best], fused[best])])
+        return results
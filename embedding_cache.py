@@ -0,0 +1,220 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+# Cache de embeddings endereçado por conteúdo.
+# A chave é o hash (sha256) do nome do modelo + texto do chunk, então
+# reconstruir uma base só paga a API pelos textos que ainda não foram vistos.
+# Os vetores ficam em um SQLite como blobs float32 (4 bytes por dimensão),
+# com limite de entradas e descarte LRU.
+
+default_cache_file = 'vectordb/embedding_cache.sqlite'
+
+
+def model_name_of(embeddings) -> str:
+    # Wrappers (ex: EmbeddingPipeline) não mudam os vetores: a chave é a do modelo de dentro
+    inner = getattr(embeddings, "underlying", None)
+    if inner is not None:
+        return model_name_of(inner)
+    for attr in ("model", "model_name", "deployment"):
+        name = getattr(embeddings, attr, None)
+        if name:
+            return str(name)
+    return type(embeddings).__name__
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envolve um Embeddings (ex: OpenAIEmbeddings) com um cache persistente.
+    Pode ser passado direto para Chroma.from_documents / DocArrayInMemorySearch.from_documents.
+    """
+
+    def __init__(self, underlying, cache_file=default_cache_file, max_entries=1_000_000, cache_queries=True):
+        self.underlying = underlying
+        self.model = model_name_of(underlying)
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.cache_queries = cache_queries
+
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+        # Relógio lógico para o LRU (mais barato e estável que timestamps)
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()
+        self._clock = row[0]
+
+    # --- Armazenamento -------------------------------------------------
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        # SQLite limita o número de parâmetros por consulta
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            clock = self._tick()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(clock, key) for key in found]
+            )
+        return found
+
+    def _store(self, items):
+        clock = self._tick()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes(), clock) for key, vector in items]
+        )
+        self._evict()
+
+    def _checkpoint(self, texts, vectors):
+        # Chamado pelo pipeline a cada lote concluído, fora do lock de embed_documents
+        with self._lock:
+            self._store([(cache_key(self.model, text), vector) for text, vector in zip(texts, vectors)])
+            self._conn.commit()
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    # --- Interface Embeddings -----------------------------------------
+    # O lock cobre só o SQLite: as chamadas ao modelo (rede) rodam fora dele, então
+    # embedders concorrentes não fazem fila atrás da API uns dos outros.
+
+    def _find(self, keys, texts):
+        """
+        (vetores já no cache, {chave: texto} que faltam), contando hits e misses.
+        """
+        with self._lock:
+            found = self._lookup(keys)
+            self._conn.commit()
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+
+            # Misses = textos efetivamente enviados à API (repetidos no lote contam como hit)
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return found, missing
+
+    def _save(self, items):
+        with self._lock:
+            self._store(items)
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        found, missing = self._find(keys, texts)
+
+        if missing:
+            if getattr(self.underlying, "supports_on_batch", False):
+                # EmbeddingPipeline: cada lote concluído já é gravado (checkpoint)
+                vectors = self.underlying.embed_documents(list(missing.values()), on_batch=self._checkpoint)
+            else:
+                vectors = self.underlying.embed_documents(list(missing.values()))
+                self._save(list(zip(missing.keys(), vectors)))
+            for key, vector in zip(missing.keys(), vectors):
+                found[key] = np.asarray(vector, dtype=np.float32)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        if not self.cache_queries:
+            return self.underlying.embed_query(text)
+
+        # Prefixo separa o espaço de chaves de consultas do de documentos,
+        # já que alguns modelos embedam consultas de forma diferente
+        key = cache_key(self.model + "\0query", text)
+
+        found, missing = self._find([key], [text])
+        if key in found:
+            return found[key].tolist()
+
+        vector = np.asarray(self.underlying.embed_query(text), dtype=np.float32)
+        self._save([(key, vector)])
+        return vector.tolist()
+
+    def embed_queries(self, texts):
+        """
+        Várias consultas de uma vez: os misses vão à API numa única chamada.
+        """
+        if not self.cache_queries:
+            return self.underlying.embed_documents(list(texts))
+
+        keys = [cache_key(self.model + "\0query", text) for text in texts]
+        found, missing = self._find(keys, texts)
+
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            self._save(list(zip(missing.keys(), vectors)))
+            for key, vector in zip(missing.keys(), vectors):
+                found[key] = np.asarray(vector, dtype=np.float32)
+
+        return [found[key].tolist() for key in keys]
+
+    # --- Métricas ------------------------------------------------------
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Cache de embeddings: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.1%} reaproveitado)")
+        if hasattr(self.underlying, "print_stats"):
+            self.underlying.print_stats()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
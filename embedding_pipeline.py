@@ -0,0 +1,282 @@
+import asyncio
+import collections
+import functools
+import random
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken é opcional: sem ele a contagem de tokens é estimada
+    tiktoken = None
+
+# Pipeline de embeddings em lotes e concorrente.
+# Os textos são agrupados em lotes limitados por número de tokens e enviados
+# por um pool de workers asyncio, respeitando limites de requisições por minuto
+# (RPM) e tokens por minuto (TPM). Falhas passageiras (429, 5xx, timeout) são
+# repetidas com backoff exponencial; as outras (ex: chave inválida) sobem na hora.
+#
+# Checkpoint: cada lote concluído é entregue a um callback on_batch assim que
+# termina. O CachedEmbeddings usa esse callback para gravar os vetores no cache,
+# então uma construção interrompida recomeça de onde parou (os lotes já feitos
+# viram hits).
+#
+# Para testar sem a API da OpenAI, use o fake_openai_server.py:
+#   python fake_openai_server.py --port 8765
+#   OpenAIEmbeddings(base_url="http://localhost:8765/v1", api_key="fake", check_embedding_ctx_length=False)
+
+
+class TokenCounter:
+
+    def __init__(self, model="text-embedding-ada-002"):
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    self.encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    self.encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                # tiktoken baixa o vocabulário na primeira vez; offline, fica a estimativa
+                self.encoding = None
+
+    def __call__(self, text):
+        if self.encoding is None:
+            # Aproximação usual: ~4 caracteres por token
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_counter(model="text-embedding-ada-002"):
+    """
+    TokenCounter único por modelo: carregar o vocabulário do tiktoken custa caro.
+    """
+    return TokenCounter(model)
+
+
+class RateLimiter:
+    """
+    Janela deslizante de 60s para requisições (RPM) e tokens (TPM).
+    acquire() espera até que a próxima requisição caiba nos dois limites.
+    O estado fica atrás de um threading.Lock: o mesmo limitador serve chamadas
+    seguidas (cada uma com seu event loop, via run_sync) e simultâneas.
+    """
+
+    def __init__(self, requests_per_minute=3000, tokens_per_minute=1_000_000, period=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.period = period
+        self._events = collections.deque()  # (instante, tokens)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        while self._events and now - self._events[0][0] >= self.period:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _fits(self, tokens):
+        if not self._events:
+            # Um lote maior que o TPM inteiro passa sozinho, senão nunca passaria
+            return True
+        return (len(self._events) < self.requests_per_minute
+                and self._tokens_in_window + tokens <= self.tokens_per_minute)
+
+    async def acquire(self, tokens):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._purge(now)
+                if self._fits(tokens):
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                wait = max(0.0, self.period - (now - self._events[0][0])) + 0.01
+            await asyncio.sleep(wait)
+
+
+# Erros que passam sozinhos (nomes das exceções do cliente da OpenAI/httpx, sem importá-los)
+retryable_errors = ("RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+                    "TimeoutException", "ConnectError", "RemoteProtocolError")
+
+
+def is_retryable(error):
+    """
+    Vale tentar de novo: limite de taxa (429), erro do servidor (5xx), timeout ou conexão.
+    Chave inválida, requisição malformada (400) etc. falham na hora.
+    """
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in retryable_errors for cls in type(error).__mro__):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status in (408, 409, 429) or status >= 500)
+
+
+def run_sync(coro):
+    """
+    Executa uma corrotina a partir de código síncrono, mesmo que já exista um
+    event loop rodando nesta thread (Jupyter, Panel): nesse caso usa outra thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def target():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+class EmbeddingPipeline(Embeddings):
+    """
+    Envolve um Embeddings (ex: OpenAIEmbeddings) com lotes por tokens,
+    concorrência limitada, controle de RPM/TPM e retry com backoff.
+    """
+
+    # O CachedEmbeddings usa isso para passar o callback de checkpoint
+    supports_on_batch = True
+
+    def __init__(self, underlying, max_batch_tokens=100_000, max_batch_size=512, max_concurrency=4,
+                 requests_per_minute=3000, tokens_per_minute=1_000_000,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, verbose=False):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", None)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.verbose = verbose
+
+        self.count_tokens = get_token_counter(self.model or "text-embedding-ada-002")
+        # Um limitador por pipeline: chamadas seguidas ou simultâneas dividem o mesmo RPM/TPM
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+        self.batches = 0
+        self.retries = 0
+        self.tokens = 0
+        self.elapsed = 0.0
+
+    # --- Lotes ---
+
+    def make_batches(self, texts):
+        """
+        Agrupa os índices dos textos em lotes de até max_batch_tokens / max_batch_size.
+        Retorna [(índices, tokens do lote)].
+        """
+        batches = []
+        current, current_tokens = [], 0
+
+        for i, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    # --- Execução ---
+
+    async def _embed_batch(self, texts, tokens, limiter):
+        attempt = 0
+        while True:
+            await limiter.acquire(tokens)
+            try:
+                return await self.underlying.aembed_documents(texts)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)  # jitter evita que os workers voltem juntos
+                if self.verbose:
+                    print(f"Falha no lote ({type(e).__name__}: {e}); nova tentativa em {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts, on_batch=None):
+        texts = list(texts)
+        if not texts:
+            return []
+
+        started = time.perf_counter()
+        queue = asyncio.Queue()
+        for batch in self.make_batches(texts):
+            queue.put_nowait(batch)
+
+        vectors = [None] * len(texts)
+
+        async def worker():
+            while True:
+                try:
+                    indices, tokens = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                batch_texts = [texts[i] for i in indices]
+                batch_vectors = await self._embed_batch(batch_texts, tokens, self.limiter)
+                for i, vector in zip(indices, batch_vectors):
+                    vectors[i] = vector
+                self.batches += 1
+                self.tokens += tokens
+                if on_batch is not None:
+                    on_batch(batch_texts, batch_vectors)
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.max_concurrency, queue.qsize()))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+        return vectors
+
+    def embed_documents(self, texts, on_batch=None):
+        return run_sync(self.aembed_documents(texts, on_batch=on_batch))
+
+    async def aembed_query(self, text):
+        return await self.underlying.aembed_query(text)
+
+    def embed_query(self, text):
+        return self.underlying.embed_query(text)
+
+    # --- Métricas ---
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "retries": self.retries,
+            "tokens": self.tokens,
+            "elapsed": self.elapsed,
+            "tokens_per_second": self.tokens / self.elapsed if self.elapsed else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Pipeline de embeddings: {stats['batches']} lotes, {stats['tokens']} tokens, "
+              f"{stats['retries']} retries em {stats['elapsed']:.1f}s "
+              f"({stats['tokens_per_second']:.0f} tokens/s)")
@@ -0,0 +1,255 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Cache das entidades extraídas pelo GLiNER.
+# A chave é o hash de modelo + rótulos + threshold + texto do chunk: mudar a
+# lista de rótulos ou o threshold invalida só o que mudou. As entidades ficam
+# num SQLite ao lado da base (LRU por entradas), com um LRU em memória na frente.
+#
+# A extração é feita em lote no momento da indexação ("python dream_indexer.py --entities");
+# na hora de exibir um resultado, o normal é só ler do cache.
+
+default_model = "urchade/gliner_base"
+default_threshold = 0.5
+
+dream_labels = [
+    "Person",             # Pessoas reais ou imaginárias
+    "Animal",             # Animais comuns ou fantásticos
+    "Creature",           # Seres fantásticos ou híbridos
+    "Location",           # Locais reais ou simbólicos
+    "Object",             # Objetos com destaque simbólico
+    "Symbol",             # Símbolos abstratos (ex: cruz, espelho, túnel)
+    "Emotion",            # Emoções mencionadas ou sentidas (ex: medo, êxtase)
+    "Action",             # Ações relevantes (ex: fugir, cair, voar)
+    "Color",              # Cores citadas ou marcantes (ex: vermelho, dourado)
+    "BodyPart",           # Partes do corpo (ex: olhos, mãos, dentes)
+    "Weather",            # Clima (ex: chuva, neblina)
+    "Time",               # Marcação temporal (ex: noite, manhã, infância)
+    "SupernaturalEntity", # Entidades divinas, místicas ou espíritos
+    "VoiceOrSound",       # Vozes, gritos, ruídos
+    "Feeling",            # Sensações físicas ou espirituais
+    "Event",              # Situações como casamento, morte, fuga
+    "FamilyRelation",     # Irmão, pai, filho, etc
+    "Vehicle",            # Carros, trens, barcos
+    "Clothing",           # Roupas com destaque simbólico
+    "Food",               # Alimentos com carga afetiva ou simbólica
+]
+
+
+def load_gliner(model_name=default_model):
+    from gliner import GLiNER
+    return GLiNER.from_pretrained(model_name)
+
+
+def entity_key(model_name, labels, threshold, text):
+    payload = json.dumps([model_name, list(labels), threshold], ensure_ascii=False)
+    return hashlib.sha256(f"{payload}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EntityCache:
+    """
+    get(text) / get_many(texts) devolvem as entidades no formato do
+    gliner.predict_entities ({"text", "label", "score", "start", "end"}).
+    O modelo só é carregado se algum texto não estiver no cache.
+    """
+
+    def __init__(self, cache_file, model_name=default_model, labels=dream_labels, threshold=default_threshold,
+                 max_entries=1_000_000, memory_entries=1024, batch_size=16, max_workers=2, model=None):
+        self.cache_file = cache_file
+        self.model_name = model_name
+        self.labels = list(labels)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self._model = model
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.computed = 0
+
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entities ("
+            " key TEXT PRIMARY KEY,"
+            " entities TEXT NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entities_last_used ON entities(last_used)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM entities").fetchone()
+        self._clock = row[0]
+
+    @property
+    def model(self):
+        with self._model_lock:
+            if self._model is None:
+                self._model = load_gliner(self.model_name)
+            return self._model
+
+    def key(self, text):
+        return entity_key(self.model_name, self.labels, self.threshold, text)
+
+    # --- Armazenamento ---
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _remember(self, key, entities):
+        self._memory[key] = entities
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, entities FROM entities WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, payload in rows:
+                found[key] = json.loads(payload)
+
+        if found:
+            clock = self._tick()
+            self._conn.executemany(
+                "UPDATE entities SET last_used = ? WHERE key = ?",
+                [(clock, key) for key in found]
+            )
+        return found
+
+    def _store(self, items):
+        clock = self._tick()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO entities (key, entities, last_used) VALUES (?, ?, ?)",
+            [(key, json.dumps(entities, ensure_ascii=False), clock) for key, entities in items]
+        )
+        if self.max_entries:
+            count = self._conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM entities WHERE key IN ("
+                    " SELECT key FROM entities ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                )
+        self._conn.commit()
+
+    # --- Extração ---
+
+    def _predict_batch(self, texts):
+        model = self.model
+        if hasattr(model, "batch_predict_entities"):
+            return model.batch_predict_entities(texts, self.labels, threshold=self.threshold)
+        return [model.predict_entities(text, self.labels, threshold=self.threshold) for text in texts]
+
+    def _predict(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or self.max_workers <= 1:
+            results = map(self._predict_batch, batches)
+        else:
+            # O torch libera o GIL durante a inferência: threads bastam
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(self._predict_batch, batches))
+        return [entities for batch in results for entities in batch]
+
+    def get_many(self, texts, remember=True):
+        """
+        Entidades de cada texto, na ordem. Os que faltam no cache são extraídos
+        numa única passada em lotes. remember=False não ocupa o LRU em memória
+        (usado na indexação, que passa por todos os chunks).
+        """
+        keys = [self.key(text) for text in texts]
+        results = {}
+
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    results[key] = self._memory[key]
+                    self._memory.move_to_end(key)
+            self.memory_hits += len(results)
+
+            pending = list(dict.fromkeys(k for k in keys if k not in results))
+            found = self._lookup(pending) if pending else {}
+            self.disk_hits += len(found)
+            results.update(found)
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in results:
+                    missing[key] = text
+
+            if missing:
+                predicted = self._predict(list(missing.values()))
+                self.computed += len(missing)
+                new_items = list(zip(missing.keys(), predicted))
+                self._store(new_items)
+                results.update(new_items)
+            else:
+                self._conn.commit()
+
+            if remember:
+                for key in keys:
+                    self._remember(key, results[key])
+
+        return [results[key] for key in keys]
+
+    def get(self, text):
+        return self.get_many([text])[0]
+
+    def precompute(self, texts, chunk_size=1024, verbose=True):
+        """
+        Passada de indexação: garante todos os textos no cache, em blocos
+        para não montar a lista inteira na memória. Retorna quantos foram extraídos.
+        """
+        before = self.computed
+        block = []
+        seen = 0
+        for text in texts:
+            block.append(text)
+            if len(block) >= chunk_size:
+                self.get_many(block, remember=False)
+                seen += len(block)
+                block = []
+                if verbose:
+                    print(f"Entidades: {seen} chunks verificados...")
+        if block:
+            self.get_many(block, remember=False)
+        return self.computed - before
+
+    # --- Métricas ---
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "computed": self.computed,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Cache de entidades: {stats['memory_hits']} hits em memória, "
+              f"{stats['disk_hits']} hits em disco, {stats['computed']} extraídas pelo modelo")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
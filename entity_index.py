@@ -0,0 +1,224 @@
+import json
+import mmap
+import os
+import shutil
+import unicodedata
+
+import numpy as np
+
+from varint import encode_postings, decode_postings
+
+# Índice invertido de entidades: (rótulo, texto normalizado) -> chunks onde aparece.
+#
+#   CURRENT         nome da versão publicada (v000001, v000002, ...): cada write() grava
+#                   uma versão nova num subdiretório e só então troca o CURRENT com
+#                   os.replace (atômico). Quem lê abre os quatro arquivos abaixo da mesma
+#                   versão; a versão anterior fica no disco até o write() seguinte
+#   <versão>/
+#   terms.json      [[rótulo, valor, nº de chunks], ...] na ordem dos postings
+#   offsets.npy     início de cada lista de postings em postings.bin
+#   postings.bin    posições dos chunks (no ChunkStore), ordenadas, gravadas como
+#                   deltas em varint (7 bits por byte): listas longas de chunks
+#                   próximos custam ~1 byte por ocorrência
+#   meta.json       geração do ChunkStore usado na construção
+#
+# As posições só valem para a geração do ChunkStore em que o índice foi construído;
+# o dream_indexer reconstrói os dois juntos ("python dream_indexer.py --entities").
+
+
+def normalize_entity(text):
+    # Sem acento, minúsculo e com espaços colapsados: "Mar ", "mar" e "már" são o mesmo valor
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+def parse_entity_filter(text):
+    """
+    "Location=mar, Emotion=medo|pavor" -> {"Location": ["mar"], "Emotion": ["medo", "pavor"]}
+    Rótulos diferentes são combinados com E; valores do mesmo rótulo, com OU.
+    """
+    filters = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError(f"Filtro de entidade inválido: {part.strip()!r} (use Rótulo=valor)")
+        label, values = part.split("=", 1)
+        filters.setdefault(label.strip(), []).extend(v.strip() for v in values.split("|") if v.strip())
+    return filters
+
+
+class EntityIndex:
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Índices de antes do CURRENT: arquivos direto no diretório
+        version = EntityIndex.current_version(directory)
+        self.version_directory = os.path.join(directory, version) if version else directory
+        path = lambda name: os.path.join(self.version_directory, name)
+
+        with open(path("meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(path("terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+
+        self.offsets = np.load(path("offsets.npy"))
+        self._file = open(path("postings.bin"), "rb")
+        self.blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path("postings.bin")) else b""
+
+        # rótulo (minúsculo) -> {valor normalizado: (nº do termo, df)}
+        self.terms = {}
+        self.label_names = {}
+        for i, (label, value, df) in enumerate(terms):
+            self.terms.setdefault(label.lower(), {})[value] = (i, df)
+            self.label_names[label.lower()] = label
+
+    @staticmethod
+    def exists(directory):
+        return (os.path.exists(os.path.join(directory, "CURRENT"))
+                or os.path.exists(os.path.join(directory, "meta.json")))
+
+    @staticmethod
+    def current_version(directory):
+        try:
+            with open(os.path.join(directory, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @property
+    def generation(self):
+        return self.meta.get("generation")
+
+    @property
+    def labels(self):
+        return sorted(self.label_names.values())
+
+    # --- Consultas ---
+
+    def _postings(self, term):
+        return decode_postings(self.blob[int(self.offsets[term]):int(self.offsets[term + 1])])
+
+    def rows(self, label, value):
+        found = self.terms.get(label.lower(), {}).get(normalize_entity(value))
+        if found is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._postings(found[0])
+
+    def match(self, filters):
+        """
+        Posições dos chunks que satisfazem {rótulo: valor ou [valores]}.
+        """
+        per_label = []
+        for label, values in filters.items():
+            if isinstance(values, str):
+                values = [values]
+            terms = [self.terms.get(label.lower(), {}).get(normalize_entity(v)) for v in values]
+            terms = [t for t in terms if t is not None]
+            if not terms:
+                return np.zeros(0, dtype=np.int64)
+            per_label.append((sum(df for _, df in terms), [i for i, _ in terms]))
+
+        if not per_label:
+            return None
+
+        # Interseção começando pelo rótulo mais raro: os conjuntos só diminuem
+        per_label.sort()
+        result = None
+        for _, terms in per_label:
+            rows = self._postings(terms[0]) if len(terms) == 1 else np.unique(np.concatenate([self._postings(t) for t in terms]))
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def facets(self, label, rows=None, top=10):
+        """
+        [(valor, nº de chunks)] mais frequentes do rótulo; com rows, conta só dentro delas.
+        """
+        values = self.terms.get(label.lower(), {})
+        if rows is None:
+            counts = [(value, df) for value, (_, df) in values.items()]
+        else:
+            counts = []
+            for value, (term, _) in values.items():
+                count = int(np.isin(self._postings(term), rows, assume_unique=True).sum())
+                if count:
+                    counts.append((value, count))
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts[:top]
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+        self._file.close()
+
+    # --- Escrita ---
+
+    @staticmethod
+    def write(directory, postings, generation):
+        """
+        postings: {(rótulo, valor normalizado): [posições em ordem crescente]}.
+        """
+        os.makedirs(directory, exist_ok=True)
+        previous = EntityIndex.current_version(directory)
+        number = int(previous[1:]) + 1 if previous else 1
+        version = f"v{number:06d}"
+        version_directory = os.path.join(directory, version)
+        shutil.rmtree(version_directory, ignore_errors=True)
+        os.makedirs(version_directory)
+        path = lambda name: os.path.join(version_directory, name)
+
+        terms = []
+        offsets = [0]
+        with open(path("postings.bin"), "wb") as f:
+            for (label, value), rows in sorted(postings.items()):
+                data = encode_postings(rows)
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                terms.append([label, value, len(rows)])
+
+        np.save(path("offsets.npy"), np.array(offsets, dtype=np.int64))
+        with open(path("terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"generation": generation, "terms": len(terms)}, f)
+
+        # Publica: o CURRENT passa da versão anterior para a nova de uma vez só
+        pointer = os.path.join(directory, "CURRENT")
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+
+        # Fica a versão anterior (um leitor pode ter acabado de ler o CURRENT antigo);
+        # saem as mais velhas e os arquivos do formato sem versões
+        for name in os.listdir(directory):
+            if name in (version, previous, "CURRENT"):
+                continue
+            target = os.path.join(directory, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target, ignore_errors=True)
+            elif name in ("meta.json", "terms.json", "offsets.npy", "postings.bin"):
+                os.remove(target)
+        return len(terms)
+
+
+def build_entity_index(directory, store, entity_cache, block_size=1024):
+    """
+    Monta o índice a partir das entidades (em cache) de todos os chunks do store.
+    """
+    postings = {}
+    for start in range(0, len(store), block_size):
+        rows = range(start, min(start + block_size, len(store)))
+        entities = entity_cache.get_many([store.text(i) for i in rows], remember=False)
+        for row, chunk_entities in zip(rows, entities):
+            for entity in chunk_entities:
+                term = (entity["label"], normalize_entity(entity["text"]))
+                row_list = postings.setdefault(term, [])
+                # A mesma entidade pode aparecer várias vezes no chunk
+                if not row_list or row_list[-1] != row:
+                    row_list.append(row)
+    return EntityIndex.write(directory, postings, store.generation)
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+# Modelos falsos em processo, determinísticos e sem rede, para benchmarks e testes.
+#
+# HashingEmbeddings: bag-of-words com hashing, normalizado. Diferente de um vetor
+# aleatório por texto, textos com palavras em comum ficam próximos, então as
+# medidas de recall das buscas semânticas fazem sentido. Texto sem palavras ganha um
+# vetor próprio (nunca o vetor zero).
+#
+# FakeRetrievalLLM: responde aos prompts usados nos scripts de recuperação
+# (SelfQueryRetriever, LLMChainExtractor) e de QA (map_reduce, map_rerank) com
+# saídas válidas para os parsers. latency_jitter soma até essa fração de latency,
+# fixa por prompt, para que as chamadas de um map não terminem todas juntas.
+
+_word_pattern = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return _word_pattern.findall(text.lower())
+
+
+class HashingEmbeddings(Embeddings):
+
+    def __init__(self, size=256, latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"hashing-{size}"
+        self.calls = 0
+
+    def _bucket(self, token):
+        value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        return value % self.size, 1.0 if (value >> 32) & 1 else -1.0
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        tokens = tokenize(text)
+        # Texto sem palavras (ex: o chunk "." do splitter dos sonhos) não pode virar o vetor
+        # zero: na distância L2 do Chroma ele ficaria a 1.0 de toda consulta, à frente dos acertos
+        for token in tokens or ["\0" + text.strip()]:
+            index, sign = self._bucket(token)
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeRetrievalLLM(LLM):
+
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-retrieval"
+
+    def get_num_tokens(self, text):
+        # Sem transformers: conta palavras (o map_reduce do LangChain mede os prompts)
+        return len(tokenize(text))
+
+    def _delay(self, prompt):
+        if not self.latency_jitter:
+            return self.latency
+        fraction = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=2).digest(), "little") / 65535
+        return self.latency * (1 + self.latency_jitter * fraction)
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self._delay(prompt))
+        return self.respond(prompt)
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self._delay(prompt))
+        return self.respond(prompt)
+
+    def respond(self, prompt):
+        if "Structured Request:" in prompt:
+            return self.structured_query(prompt)
+        if "Extracted relevant parts:" in prompt:
+            return self.extract(prompt)
+        if "Score: [score between 0 and 100]" in prompt:
+            return self.rerank(prompt)
+        if "Relevant text, if any:" in prompt:
+            return self.relevant_text(prompt)
+        if "FINAL ANSWER:" in prompt:
+            return self.final_answer(prompt)
+        return "Não sei."
+
+    @staticmethod
+    def structured_query(prompt):
+        # O último "User Query:" do prompt é a pergunta (os anteriores são exemplos)
+        query = prompt.rsplit("User Query:", 1)[1].split("Structured Request:", 1)[0].strip()
+        return "```json\n" + json.dumps({"query": query, "filter": "NO_FILTER"}, ensure_ascii=False) + "\n```"
+
+    @classmethod
+    def extract(cls, prompt):
+        # Devolve as frases do contexto que têm alguma palavra da pergunta
+        question = prompt.rsplit("> Question:", 1)[1].split("> Context:", 1)[0]
+        context = prompt.rsplit(">>>\n", 2)[-2].rsplit("\n>>>", 1)[0]
+        _, sentences = cls.relevant_sentences(question, context)
+        return " ".join(sentences) if sentences else "NO_OUTPUT"
+
+    @staticmethod
+    def relevant_sentences(question, context):
+        words = {w for w in tokenize(question) if len(w) > 3}
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", context.strip()) if words & set(tokenize(s))]
+        return words, sentences
+
+    @classmethod
+    def relevant_text(cls, prompt):
+        # Map do map_reduce: "{context}\nQuestion: {question}\nRelevant text, if any:"
+        body = prompt.split("Return any relevant text verbatim.\n", 1)[1]
+        context, question = body.rsplit("\nQuestion:", 1)
+        question = question.split("Relevant text, if any:", 1)[0]
+        _, sentences = cls.relevant_sentences(question, context)
+        return " ".join(sentences)
+
+    @staticmethod
+    def final_answer(prompt):
+        # Reduce do map_reduce: junta os trechos depois do último "QUESTION:"
+        summaries = prompt.rsplit("QUESTION:", 1)[1].split("=========", 2)[1]
+        parts = [p.strip() for p in summaries.split("Content:") if p.strip()]
+        return " ".join(parts) if parts else "I don't know."
+
+    @classmethod
+    def rerank(cls, prompt):
+        # Nota = fração das palavras da pergunta presentes no contexto
+        body = prompt.rsplit("Context:\n---------\n", 1)[1]
+        context, question = body.split("\n---------\nQuestion:", 1)
+        question = question.split("Helpful Answer:", 1)[0]
+        words, sentences = cls.relevant_sentences(question, context)
+        found = words & set(tokenize(context))
+        score = round(100 * len(found) / len(words)) if words else 0
+        answer = " ".join(sentences) if sentences else "This document does not answer the question"
+        return f"{answer}\nScore: {score}"
+
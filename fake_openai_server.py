@@ -0,0 +1,234 @@
+import argparse
+import base64
+import hashlib
+import json
+import math
+import struct
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidor local que imita a API da OpenAI (embeddings e chat completions), para
+# testar os pipelines e o chatbot sem custo e de forma determinística.
+#
+#   python fake_openai_server.py --port 8765 --latency 0.2 --rpm 60 --token-latency 0.02
+#
+# e no código:
+#
+#   OpenAIEmbeddings(base_url="http://localhost:8765/v1", api_key="fake", check_embedding_ctx_length=False)
+#   ChatOpenAI(base_url="http://localhost:8765/v1", api_key="fake")
+#
+# Cada texto vira sempre o mesmo vetor (derivado do sha256), normalizado.
+# O chat responde a pergunta de condensação do ConversationalRetrievalChain com a
+# própria pergunta e as demais com uma resposta fixa que cita o início da pergunta.
+# Com "stream": true a resposta sai em server-sent events, uma palavra por chunk,
+# com --token-latency entre elas (--latency vira o tempo até o primeiro token).
+# --rpm faz o servidor responder 429 acima do limite, para exercitar o retry.
+
+
+def fake_vector(text, dim):
+    values = []
+    counter = 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        for i in range(0, len(digest), 4):
+            values.append(int.from_bytes(digest[i:i + 4], "little") / 2 ** 31 - 1.0)
+        counter += 1
+    values = values[:dim]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def fake_answer(messages):
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    # Prompt de condensação do ConversationalRetrievalChain: devolve a pergunta como está
+    if "Follow Up Input:" in prompt:
+        question = prompt.split("Follow Up Input:", 1)[1].split("Standalone question:", 1)[0]
+        return question.strip()
+    # Pergunta: linha "Question:" do prompt (RetrievalQA) ou a última mensagem do usuário
+    user_messages = [str(m.get("content", "")) for m in messages if m.get("role") == "user"]
+    if "Question:" in prompt:
+        question = prompt.rsplit("Question:", 1)[1].split("\n", 1)[0].strip()
+    else:
+        question = user_messages[-1].strip() if user_messages else prompt[-80:]
+    return f"Resposta falsa para \"{question[:80]}\", com base em {len(prompt)} caracteres de prompt. thanks for asking!"
+
+
+def input_text(item):
+    # Com check_embedding_ctx_length=True o cliente envia listas de token ids
+    return item if isinstance(item, str) else json.dumps(item)
+
+
+class FakeOpenAIState:
+
+    def __init__(self, dim=1536, latency=0.0, requests_per_minute=0, fail_every=0, token_latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.token_latency = token_latency
+        self.requests_per_minute = requests_per_minute
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.request_times = []
+        self.requests = 0
+        self.rejected = 0
+
+    def admit(self):
+        with self.lock:
+            self.requests += 1
+            if self.fail_every and self.requests % self.fail_every == 0:
+                self.rejected += 1
+                return False
+            if not self.requests_per_minute:
+                return True
+            now = time.monotonic()
+            self.request_times = [t for t in self.request_times if now - t < 60]
+            if len(self.request_times) >= self.requests_per_minute:
+                self.rejected += 1
+                return False
+            self.request_times.append(now)
+            return True
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        request = self.read_json()
+
+        if not self.state.admit():
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                           headers={"Retry-After": "1"})
+            return
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self.handle_embeddings(request)
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            self.handle_chat(request)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def handle_embeddings(self, request):
+        inputs = request.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        dim = request.get("dimensions") or self.state.dim
+        data = []
+        tokens = 0
+        for i, item in enumerate(inputs):
+            text = input_text(item)
+            tokens += len(item) if isinstance(item, list) else len(text) // 4 + 1
+            vector = fake_vector(text, dim)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+        self.send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+    def handle_chat(self, request):
+        messages = request.get("messages", [])
+        answer = fake_answer(messages)
+        if request.get("stream"):
+            self.stream_chat(request, answer)
+            return
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 + 1 for m in messages)
+        completion_tokens = len(answer) // 4 + 1
+
+        self.send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake-chat"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+    def stream_chat(self, request, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake-chat"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_chunk({"role": "assistant", "content": ""})
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            if i and self.state.token_latency:
+                time.sleep(self.state.token_latency)
+            send_chunk({"content": word if i == len(words) - 1 else word + " "})
+        send_chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8765, **state_kwargs):
+    handler = type("Handler", (FakeOpenAIHandler,), {"state": FakeOpenAIState(**state_kwargs)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_in_background(host="127.0.0.1", port=0, **state_kwargs):
+    """
+    Sobe o servidor numa thread daemon e retorna (server, base_url).
+    port=0 escolhe uma porta livre.
+    """
+    server = make_server(host, port, **state_kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor falso da API da OpenAI para testes locais")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536, help="dimensão dos embeddings")
+    parser.add_argument("--latency", type=float, default=0.0, help="atraso por requisição, em segundos")
+    parser.add_argument("--rpm", type=int, default=0, help="limite de requisições por minuto (0 = sem limite)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="atraso entre palavras no chat com stream (s)")
+    parser.add_argument("--fail-every", type=int, default=0, help="responde 429 a cada N requisições")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, dim=args.dim, latency=args.latency,
+                         requests_per_minute=args.rpm, fail_every=args.fail_every,
+                         token_latency=args.token_latency)
+    print(f"Servidor falso da OpenAI em http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,70 @@
+import re
+import subprocess
+import sys
+import time
+
+# Perfil de tempo de import, a partir da saída do "python -X importtime".
+# Cada linha do -X importtime tem: tempo próprio (us) | tempo acumulado (us) | módulo,
+# com o nome indentado conforme a profundidade (2 espaços por nível).
+
+_line_pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(output):
+    """
+    Retorna [(módulo, self_us, cumulative_us, profundidade)] na ordem da saída.
+    """
+    entries = []
+    for line in output.splitlines():
+        match = _line_pattern.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return entries
+
+
+def profile_command(args, cwd=None):
+    """
+    Roda [python -X importtime, *args] e retorna (entradas, tempo total do processo em s).
+    """
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *args],
+                            capture_output=True, text=True, cwd=cwd)
+    elapsed = time.perf_counter() - started
+    return parse_importtime(result.stderr), elapsed
+
+
+def profile_modules(modules, cwd=None):
+    """
+    Perfil de importar os módulos num processo limpo (os que não estão instalados são ignorados).
+    """
+    # "import x" (e não importlib.import_module) para o -X importtime registrar a linha do próprio módulo
+    code = (f"for name in {list(modules)!r}:\n"
+            "    try:\n"
+            "        exec('import ' + name)\n"
+            "    except ImportError:\n"
+            "        pass\n")
+    return profile_command(["-c", code], cwd=cwd)
+
+
+def summarize(entries):
+    """
+    Tempo acumulado (s) por import de primeiro nível, do maior para o menor, e o total.
+    """
+    top_level = [(module, cumulative / 1e6) for module, _, cumulative, depth in entries if depth == 0]
+    top_level.sort(key=lambda item: item[1], reverse=True)
+    return top_level, sum(seconds for _, seconds in top_level)
+
+
+def print_import_profile(title, entries, elapsed=None, top=15):
+    top_level, total = summarize(entries)
+    print(f"\n=== {title} ===")
+    for module, seconds in top_level[:top]:
+        print(f"{seconds * 1000:9.1f} ms  {module}")
+    if len(top_level) > top:
+        rest = sum(seconds for _, seconds in top_level[top:])
+        print(f"{rest * 1000:9.1f} ms  ({len(top_level) - top} outros)")
+    print(f"{total * 1000:9.1f} ms  total em imports")
+    if elapsed is not None:
+        print(f"{elapsed * 1000:9.1f} ms  processo inteiro (interpretador + imports + inicialização)")
+    return total
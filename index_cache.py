@@ -0,0 +1,201 @@
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+from ann_index import ANNVectorStore
+
+# Cache de índices de arquivos (ex: PDFs do chatbot), endereçado pelo conteúdo.
+#
+# A chave é o sha256 dos bytes do arquivo + a versão da configuração (splitter,
+# modelo de embedding): o mesmo PDF enviado de novo, com outro nome ou por outra
+# sessão, reaproveita o índice (com o source do primeiro envio nos metadados). Dois níveis:
+#   memória  ANNVectorStore prontos, LRU limitado por memory_budget (bytes)
+#   disco    um .npz por arquivo (ANNVectorStore.save), LRU por max_disk_entries
+# Cada chave é construída uma única vez, mesmo com várias sessões pedindo juntas.
+# Arquivos enviados como bytes são gravados num temporário com nome único, então
+# uploads simultâneos não se sobrescrevem.
+
+default_directory = 'vectordb/file_indexes/'
+
+
+class FileIndexCache:
+
+    def __init__(self, embedding, build, version="", directory=default_directory,
+                 memory_budget=512 * 2 ** 20, max_disk_entries=200, suffix=".pdf"):
+        """
+        build(path, source) -> ANNVectorStore, com source = nome exibido do arquivo.
+        """
+        self.embedding = embedding
+        self.build = build
+        self.version = version
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.max_disk_entries = max_disk_entries
+        self.suffix = suffix
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+        self.evictions = 0
+
+        self._entries = collections.OrderedDict()  # chave -> (store, bytes)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data):
+        return hashlib.sha256(self.version.encode("utf-8") + b"\0" + data).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    # --- Consulta ---
+
+    def get_file(self, path):
+        return self.get_file_keyed(path)[0]
+
+    def get(self, data, source):
+        """
+        Índice dos bytes do arquivo; source é o nome guardado nos metadados dos chunks.
+        """
+        return self.get_keyed(data, source)[0]
+
+    def get_file_keyed(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        return self._get(data, path, path)
+
+    def get_keyed(self, data, source):
+        """
+        (índice, chave): a chave (hash do conteúdo) serve de identificador do arquivo sem reler os bytes.
+        """
+        return self._get(data, source, None)
+
+    def _get(self, data, source, path):
+        key = self.key(data)
+
+        with self._lock:
+            store = self._touch(key)
+            if store is not None:
+                self.memory_hits += 1
+                return store, key
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Uma construção por chave: quem chega depois espera e pega da memória
+        with key_lock:
+            with self._lock:
+                store = self._touch(key)
+                if store is not None:
+                    self.memory_hits += 1
+                    return store, key
+
+            store = self._load(key)
+            if store is None:
+                store = self._build(key, data, source, path)
+            self._remember(key, store)
+
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return store, key
+
+    def _touch(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        store = ANNVectorStore.load(path, self.embedding)
+        os.utime(path)  # LRU do disco pelo horário de modificação
+        with self._lock:
+            self.disk_hits += 1
+        return store
+
+    def _build(self, key, data, source, path):
+        if path is None:
+            # Nome único por upload (em vez de um temp.pdf compartilhado)
+            with tempfile.NamedTemporaryFile(suffix=self.suffix, delete=False) as f:
+                f.write(data)
+                path = f.name
+            try:
+                store = self.build(path, source)
+            finally:
+                os.remove(path)
+        else:
+            store = self.build(path, source)
+
+        # Grava num temporário e renomeia: outro processo nunca lê um .npz pela metade
+        tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        store.save(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self._evict_disk()
+        with self._lock:
+            self.builds += 1
+        return store
+
+    # --- Descarte ---
+
+    def _remember(self, key, store):
+        size = store.nbytes
+        with self._lock:
+            self._entries[key] = (store, size)
+            self._memory_bytes += size
+            # O mais recente fica mesmo se sozinho passar do orçamento
+            while self._memory_bytes > self.memory_budget and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.evictions += 1
+
+    def _evict_disk(self):
+        if not self.max_disk_entries:
+            return
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if name.endswith(".npz") and ".tmp" not in name]
+        excess = len(files) - self.max_disk_entries
+        if excess > 0:
+            for path in sorted(files, key=os.path.getmtime)[:excess]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # --- Métricas ---
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "builds": self.builds,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "memory_mb": self._memory_bytes / 2 ** 20,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Cache de índices: {stats['memory_hits']} hits em memória, {stats['disk_hits']} em disco, "
+              f"{stats['builds']} construídos; {stats['entries']} em memória ({stats['memory_mb']:.1f} MB), "
+              f"{stats['evictions']} descartados")
+
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache(name, factory):
+    """
+    Cache único do processo com esse nome: todas as sessões do Panel usam o mesmo
+    (o módulo é importado uma vez; o script do chatbot roda de novo a cada sessão).
+    """
+    with _shared_lock:
+        if name not in _shared_caches:
+            _shared_caches[name] = factory()
+        return _shared_caches[name]
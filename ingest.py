@@ -0,0 +1,102 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.document_loaders import TextLoader
+
+# Ingestão paralela: cada arquivo é carregado e dividido em um processo do pool,
+# e os chunks são entregues em lotes (generator) para a etapa de embedding/indexação,
+# sem montar listas com todos os docs e splits na memória.
+#
+# Scripts que usam este módulo precisam de "if __name__ == '__main__':", porque
+# em sistemas que usam spawn (macOS, Windows) os workers reimportam o script.
+
+loaders_by_extension = {
+    ".pdf": PyPDFLoader,
+    ".txt": TextLoader,
+    ".md": TextLoader,
+}
+
+
+def get_loader(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in loaders_by_extension:
+        raise ValueError(f"Tipo de arquivo não suportado: {path}")
+    return loaders_by_extension[extension](path)
+
+
+def load_and_split(path, chunk_size=1500, chunk_overlap=150):
+    """
+    Carrega e divide um único arquivo. Roda dentro dos workers do pool.
+    """
+    docs = get_loader(path).load()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    return text_splitter.split_documents(docs)
+
+
+def find_files(directory, extensions=(".pdf",)):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def iter_split_documents(paths, chunk_size=1500, chunk_overlap=150, batch_size=1000, max_workers=None):
+    """
+    Gera lotes de até batch_size chunks a partir dos arquivos em paths.
+
+    No máximo 2 * max_workers arquivos ficam em andamento de cada vez, então a
+    memória não cresce com o número de arquivos. Os lotes saem na ordem em que
+    os arquivos terminam (não na ordem de paths).
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    paths = iter(paths)
+    batch = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+
+        def submit_next():
+            path = next(paths, None)
+            if path is not None:
+                pending.add(pool.submit(load_and_split, path, chunk_size, chunk_overlap))
+
+        for _ in range(2 * max_workers):
+            submit_next()
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                submit_next()
+                batch.extend(future.result())
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+
+    if batch:
+        yield batch
+
+
+def index_documents(vectordb, batches, verbose=True):
+    """
+    Consome os lotes e os adiciona ao vector store. Retorna o total de chunks.
+    """
+    total = 0
+    for batch in batches:
+        if not batch:
+            continue
+        ids = [doc.id for doc in batch]
+        if all(ids):
+            # Ids determinísticos (ex: do dedup.py) tornam a reindexação idempotente
+            vectordb.add_documents(batch, ids=ids)
+        else:
+            vectordb.add_documents(batch)
+        total += len(batch)
+        if verbose:
+            print(f"{total} chunks indexados...")
+    return total
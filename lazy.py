@@ -0,0 +1,52 @@
+import threading
+import time
+
+# Carregamento sob demanda de objetos caros (modelos, índices, clientes).
+# Nada é importado ou carregado até o primeiro get(); prewarm() faz esse
+# carregamento numa thread em segundo plano, e um get() concorrente só espera
+# a thread terminar em vez de carregar de novo.
+
+
+class Lazy:
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or getattr(factory, "__name__", "objeto")
+        self.load_time = None
+        self._value = None
+        self._loaded = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if self._error is not None:
+                # Falha no prewarm: relança aqui, e o próximo get() tenta de novo
+                error, self._error = self._error, None
+                raise error
+            if not self._loaded:
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.load_time = time.perf_counter() - started
+                self._loaded = True
+        return self._value
+
+    def _prewarm(self):
+        try:
+            self.get()
+        except Exception as e:
+            self._error = e
+
+    def prewarm(self):
+        if self._loaded or self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._prewarm, name=f"prewarm-{self.name}", daemon=True)
+        self._thread.start()
+        return self
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import time
+
+from langchain.chains.question_answering import map_reduce_prompt, map_rerank_prompt
+from langchain_core.output_parsers import StrOutputParser
+
+# Fase de map concorrente para QA com map_reduce e map_rerank.
+#
+# O RetrievalQA do LangChain faz as chamadas do map (uma por documento) em série
+# quando o LLM não tem batch nativo, então a latência cresce com k. Aqui cada
+# documento vira uma tarefa assíncrona, limitada por um semáforo (max_concurrency):
+#
+#   ConcurrentMapReduce  o reduce começa assim que min_outputs respostas do map
+#                        chegam; as chamadas que faltam são canceladas
+#   ConcurrentMapRerank  para na primeira resposta com nota >= threshold; sem
+#                        nenhuma, fica a de maior nota (empate: a mais bem ranqueada)
+#
+# A entrada e a saída seguem o RetrievalQA ({"query"} -> {"result", "source_documents"}).
+# A saída ganha "map_timings": por documento, quando a chamada pegou a vaga, quando
+# terminou e se foi usada ou cancelada; print_map_timings() mostra o caminho crítico.
+# Uma chamada que estoura o timeout ou falha só tira aquele documento da resposta.
+#
+#   python map_chain.py --k 8 --latency 0.3 --max-concurrency 4 --min-outputs 6
+#   python map_chain.py --mode rerank --threshold 80
+
+
+def parse_rerank(text):
+    try:
+        parsed = map_rerank_prompt.output_parser.parse(text)
+        return parsed["answer"].strip(), int(parsed["score"] or 0)
+    except ValueError:
+        # Saída fora do formato "resposta\nScore: n": conta como nota zero
+        return text.strip(), 0
+
+
+class ConcurrentMapChain:
+
+    def __init__(self, llm, retriever, max_concurrency=4, timeout=None):
+        """
+        timeout em segundos para cada chamada do map (None = sem limite).
+        """
+        self.llm = llm
+        self.retriever = retriever
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    async def _map(self, prompt, question, docs, parse, enough):
+        """
+        Roda prompt | llm em cada documento. enough(outputs) -> True encerra o map.
+        Retorna ({posição do documento: saída}, timings).
+        """
+        chain = prompt | self.llm | StrOutputParser()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        started = time.perf_counter()
+        timings = [{"document": i, "source": doc.metadata.get("source"), "status": "waiting",
+                    "start_s": None, "end_s": None} for i, doc in enumerate(docs)]
+
+        async def call(i, doc):
+            timing = timings[i]
+            try:
+                async with semaphore:
+                    timing["status"] = "running"
+                    timing["start_s"] = time.perf_counter() - started
+                    text = await asyncio.wait_for(
+                        chain.ainvoke({"context": doc.page_content, "question": question}), self.timeout)
+            except asyncio.CancelledError:
+                # Sem vaga ainda = nem chegou a chamar o LLM
+                timing["status"] = "cancelled" if timing["status"] == "running" else "skipped"
+                timing["end_s"] = time.perf_counter() - started
+                raise
+            except Exception as e:
+                # Estourou o timeout ou o LLM falhou: o documento sai e o map segue com os outros
+                timing["status"] = "timeout" if isinstance(e, asyncio.TimeoutError) else "failed"
+                timing["error"] = repr(e)
+                timing["end_s"] = time.perf_counter() - started
+                return i, None
+            timing["end_s"] = time.perf_counter() - started
+            timing["status"] = "done"
+            return i, parse(text)
+
+        tasks = [asyncio.create_task(call(i, doc)) for i, doc in enumerate(docs)]
+        outputs = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, output = await next_done
+                if output is None:
+                    continue
+                outputs[i] = output
+                timings[i]["status"] = "used"
+                if enough(outputs):
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return outputs, timings
+
+    async def _retrieve(self, question):
+        started = time.perf_counter()
+        docs = await self.retriever.ainvoke(question)
+        return docs, time.perf_counter() - started
+
+    def invoke(self, inputs):
+        """
+        Versão síncrona. Dentro de um event loop (Panel, Jupyter) use await chain.ainvoke(...).
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.ainvoke(inputs))
+        raise RuntimeError("invoke() dentro de um event loop rodando: use await chain.ainvoke(...)")
+
+    def __call__(self, inputs):
+        return self.invoke(inputs)
+
+
+class ConcurrentMapReduce(ConcurrentMapChain):
+
+    def __init__(self, llm, retriever, max_concurrency=4, min_outputs=None, timeout=None):
+        """
+        min_outputs = respostas do map que bastam para começar o reduce (None = todas).
+        """
+        super().__init__(llm, retriever, max_concurrency, timeout)
+        self.min_outputs = min_outputs
+        self.question_prompt = map_reduce_prompt.QUESTION_PROMPT_SELECTOR.get_prompt(llm)
+        self.combine_prompt = map_reduce_prompt.COMBINE_PROMPT_SELECTOR.get_prompt(llm)
+
+    async def ainvoke(self, inputs):
+        question = inputs["query"]
+        started = time.perf_counter()
+        docs, retrieval_s = await self._retrieve(question)
+
+        needed = min(self.min_outputs or len(docs), len(docs))
+        outputs, timings = await self._map(self.question_prompt, question, docs, str.strip,
+                                           lambda outputs: len(outputs) >= needed)
+        map_s = time.perf_counter() - started - retrieval_s
+
+        # Na ordem do ranking da busca, não na de chegada; trechos vazios não vão para o reduce
+        summaries = "\n\n".join(f"Content: {outputs[i]}" for i in sorted(outputs) if outputs[i])
+        reduce_started = time.perf_counter()
+        result = await (self.combine_prompt | self.llm | StrOutputParser()).ainvoke(
+            {"question": question, "summaries": summaries})
+
+        return {
+            "query": question,
+            "result": result.strip(),
+            "source_documents": docs,
+            "map_timings": timings,
+            "retrieval_s": retrieval_s,
+            "map_s": map_s,
+            "reduce_s": time.perf_counter() - reduce_started,
+            "total_s": time.perf_counter() - started,
+        }
+
+
+class ConcurrentMapRerank(ConcurrentMapChain):
+
+    def __init__(self, llm, retriever, max_concurrency=4, threshold=80, timeout=None):
+        """
+        threshold = nota (0-100) que encerra o map na hora (None = espera todas).
+        """
+        super().__init__(llm, retriever, max_concurrency, timeout)
+        self.threshold = threshold
+        self.prompt = map_rerank_prompt.PROMPT
+
+    async def ainvoke(self, inputs):
+        question = inputs["query"]
+        started = time.perf_counter()
+        docs, retrieval_s = await self._retrieve(question)
+
+        def confident(outputs):
+            return self.threshold is not None and any(score >= self.threshold for _, score in outputs.values())
+
+        outputs, timings = await self._map(self.prompt, question, docs, parse_rerank, confident)
+        for i, (_, score) in outputs.items():
+            timings[i]["score"] = score
+
+        result, score, best = "", 0, None
+        if outputs:
+            best = max(sorted(outputs), key=lambda i: outputs[i][1])
+            result, score = outputs[best]
+
+        return {
+            "query": question,
+            "result": result,
+            "score": score,
+            "source_documents": docs,
+            "best_document": docs[best] if best is not None else None,
+            "map_timings": timings,
+            "retrieval_s": retrieval_s,
+            "map_s": time.perf_counter() - started - retrieval_s,
+            "total_s": time.perf_counter() - started,
+        }
+
+
+def print_map_timings(result, width=40):
+    """
+    Uma linha por documento com a barra da chamada no tempo do map; a chamada
+    usada que terminou por último é o caminho crítico.
+    """
+    timings = result["map_timings"]
+    span = max((t["end_s"] or 0) for t in timings) or 1.0
+    used = [t for t in timings if t["status"] == "used"]
+    critical = max(used, key=lambda t: t["end_s"])["document"] if used else None
+
+    for t in timings:
+        bar = [" "] * width
+        if t["start_s"] is not None:
+            first = int(t["start_s"] / span * (width - 1))
+            last = int(t["end_s"] / span * (width - 1))
+            for position in range(first, last + 1):
+                bar[position] = "#" if t["status"] == "used" else "-"
+            duration = f"{t['end_s'] - t['start_s']:.2f}s"
+            start = f"{t['start_s']:.2f}s"
+        else:
+            duration = start = ""
+        score = f" nota {t['score']}" if "score" in t else ""
+        mark = " <- caminho crítico" if t["document"] == critical else ""
+        print(f"doc {t['document']:>2} |{''.join(bar)}| {t['status']:<9} início {start:>6} duração {duration:>6}"
+              f"{score}{mark}")
+
+    parts = [f"busca {result['retrieval_s']:.2f}s", f"map {result['map_s']:.2f}s"]
+    if "reduce_s" in result:
+        parts.append(f"reduce {result['reduce_s']:.2f}s")
+    skipped = sum(t["status"] in ("cancelled", "skipped") for t in timings)
+    failed = sum(t["status"] in ("timeout", "failed") for t in timings)
+    print(f"Total {result['total_s']:.2f}s ({', '.join(parts)}); {len(used)} de {len(timings)} documentos usados, "
+          f"{skipped} cancelados, {failed} com erro ou timeout")
+
+
+# --- Comparação com o RetrievalQA (LLM falso, sem rede) ---
+
+def main():
+    from langchain.chains import RetrievalQA
+
+    from ann_index import ANNVectorStore
+    from benchmark import synthetic_corpus
+    from fake_models import FakeRetrievalLLM, HashingEmbeddings
+
+    parser = argparse.ArgumentParser(description="Map concorrente x RetrievalQA com o LLM falso")
+    parser.add_argument("--mode", choices=["map_reduce", "rerank"], default="map_reduce")
+    parser.add_argument("--k", type=int, default=8, help="documentos recuperados")
+    parser.add_argument("--latency", type=float, default=0.3, help="atraso do LLM falso por chamada (s)")
+    parser.add_argument("--jitter", type=float, default=1.0, help="variação do atraso, em fração de --latency")
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    parser.add_argument("--min-outputs", type=int, default=None, help="map_reduce: respostas que bastam para o reduce")
+    parser.add_argument("--threshold", type=int, default=80, help="rerank: nota que encerra o map")
+    parser.add_argument("--timeout", type=float, default=None, help="limite de cada chamada do map (s)")
+    parser.add_argument("--query", default="sonho com o mar e ondas na praia")
+    args = parser.parse_args()
+
+    records, _ = synthetic_corpus(200)
+    db = ANNVectorStore.from_texts([r["text"] for r in records], HashingEmbeddings(),
+                                   metadatas=[{"source": f"sonho-{r['id']}"} for r in records])
+    retriever = db.as_retriever(search_kwargs={"k": args.k})
+    llm = FakeRetrievalLLM(latency=args.latency, latency_jitter=args.jitter)
+
+    chain_type = "map_reduce" if args.mode == "map_reduce" else "map_rerank"
+    baseline = RetrievalQA.from_chain_type(llm, retriever=retriever, chain_type=chain_type)
+    started = time.perf_counter()
+    baseline.invoke({"query": args.query})
+    baseline_s = time.perf_counter() - started
+    print(f"RetrievalQA ({chain_type}): {baseline_s:.2f}s")
+
+    if args.mode == "map_reduce":
+        chain = ConcurrentMapReduce(llm, retriever, args.max_concurrency, min_outputs=args.min_outputs,
+                                    timeout=args.timeout)
+    else:
+        chain = ConcurrentMapRerank(llm, retriever, args.max_concurrency, threshold=args.threshold,
+                                    timeout=args.timeout)
+    result = chain.invoke({"query": args.query})
+    print(f"Map concorrente: {result['total_s']:.2f}s ({baseline_s / result['total_s']:.1f}x mais rápido)")
+    print_map_timings(result)
+    print(f"Resposta: {result['result'][:200]}")
+
+
+if __name__ == "__main__":
+    main()
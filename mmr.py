@@ -0,0 +1,233 @@
+import asyncio
+from typing import Any, ClassVar
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+from pydantic import PrivateAttr
+
+from ann_index import normalize_rows
+from topk import top_k_indices, top_k_rows
+
+# MMR (Maximal Marginal Relevance) vetorizado.
+#
+# O maximal_marginal_relevance do LangChain recalcula, a cada escolha, a similaridade
+# de todos os candidatos com todos os já escolhidos (O(k² · fetch_k)), e o
+# Chroma busca os embeddings dos candidatos de novo a cada consulta. Aqui:
+#   - os candidatos são uma matriz float32 contígua e normalizada
+#   - max_sim (maior similaridade de cada candidato com os escolhidos) é atualizado a
+#     cada escolha com um único produto matriz-vetor: O(k · fetch_k · d) no total,
+#     então fetch_k na casa dos milhares continua barato
+#   - mmr_select_batch faz o mesmo para várias consultas de uma vez (tensor B x n x d)
+#
+# MatrixMMRRetriever é um VectorStoreRetriever com o search_type "mmr_matrix". No
+# ANNVectorStore os candidatos vêm do próprio índice; nos outros stores (Chroma) os
+# embeddings da coleção são lidos uma vez e ficam numa matriz em memória, e os
+# fetch_k candidatos saem de um produto matriz-vetor + top-k. Os escolhidos voltam em
+# ordem de relevância (a que o ContextPacker espera), não na ordem em que o MMR os
+# escolheu: é o que o Chroma.max_marginal_relevance_search do langchain_chroma faz
+# (filtra os candidatos na ordem da busca), mas não o ANNVectorStore, que devolve a
+# ordem da seleção. mmr_select dá a ordem da seleção para quem precisar dela.
+# A matriz é relida sozinha quando o número de documentos muda; depois de
+# update_document (ou add + delete que mantém a contagem), chame retriever.refresh().
+#
+#   retriever = as_retriever(vectordb, search_type="mmr_matrix", search_kwargs={"k": 4, "fetch_k": 1000})
+#   retriever.invoke(question); retriever.search_batch(questions)
+
+
+def mmr_select(query, candidates, k=4, lambda_mult=0.5, normalized=False):
+    """
+    Posições dos k candidatos escolhidos, na ordem da escolha.
+    lambda_mult = 1 só relevância, 0 só diversidade (como no LangChain).
+    """
+    if not normalized:
+        query = normalize_rows(query)
+        candidates = normalize_rows(candidates)
+    n = len(candidates)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    relevance = candidates @ query
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected = []
+    scores = relevance.copy()
+    for _ in range(k):
+        if selected:
+            scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(max_sim, candidates @ candidates[pick], out=max_sim)
+    return selected
+
+
+def mmr_select_batch(queries, candidates, k=4, lambda_mult=0.5, valid=None, normalized=False):
+    """
+    MMR de B consultas: queries (B x d), candidates (B x n x d), valid (B x n) marca
+    os candidatos de verdade quando as listas têm tamanhos diferentes (preenchidas).
+    Retorna (B x k) posições, com -1 onde não havia candidatos suficientes.
+    """
+    if not normalized:
+        queries = normalize_rows(queries)
+        candidates = normalize_rows(candidates)
+    batch, n, _ = candidates.shape
+    k = min(k, n)
+    rows = np.arange(batch)
+
+    relevance = np.matmul(candidates, queries[:, :, None])[:, :, 0]
+    max_sim = np.full((batch, n), -np.inf, dtype=np.float32)
+    available = np.ones((batch, n), dtype=bool) if valid is None else valid.copy()
+    selected = np.full((batch, k), -1, dtype=np.int64)
+    for step in range(k):
+        scores = relevance if step == 0 else lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores = np.where(available, scores, -np.inf)
+        picks = np.argmax(scores, axis=1)
+        found = np.isfinite(scores[rows, picks])
+        selected[found, step] = picks[found]
+        available[rows, picks] = False
+        np.maximum(max_sim, np.matmul(candidates, candidates[rows, picks][:, :, None])[:, :, 0], out=max_sim)
+    return selected
+
+
+def _matches(metadata, filter):
+    # Mesmo subconjunto do filtro do Chroma aceito pelo ANNVectorStore
+    conditions = filter["$and"] if "$and" in filter else [{k: v} for k, v in filter.items()]
+    for condition in conditions:
+        for key, value in condition.items():
+            if isinstance(value, dict) and "$eq" in value:
+                allowed = [value["$eq"]]
+            elif isinstance(value, dict) and "$in" in value:
+                allowed = value["$in"]
+            elif isinstance(value, dict):
+                raise ValueError(f"Operador de filtro não suportado: {value}")
+            else:
+                allowed = [value]
+            if metadata.get(key) not in allowed:
+                return False
+    return True
+
+
+class EmbeddingMatrix:
+    """
+    Embeddings de uma coleção (Chroma.get) numa matriz float32 normalizada, lida uma vez.
+    """
+
+    def __init__(self, vectorstore):
+        data = vectorstore.get(include=["embeddings", "documents", "metadatas"])
+        self.ids = list(data["ids"])
+        self.texts = list(data["documents"])
+        self.metadatas = [m or {} for m in data["metadatas"]]
+        self.matrix = normalize_rows(np.asarray(data["embeddings"], dtype=np.float32).reshape(len(self.ids), -1))
+        self.count = len(self.ids)
+
+    def document(self, row):
+        return Document(id=self.ids[row], page_content=self.texts[row], metadata=dict(self.metadatas[row]))
+
+    def mask(self, filter):
+        if not filter:
+            return None
+        return np.array([_matches(m, filter) for m in self.metadatas], dtype=bool)
+
+
+class MatrixMMRRetriever(VectorStoreRetriever):
+
+    allowed_search_types: ClassVar = VectorStoreRetriever.allowed_search_types + ("mmr_matrix",)
+
+    _matrix: Any = PrivateAttr(default=None)
+
+    # --- Candidatos ---
+
+    def _embedding_matrix(self):
+        # Relê a coleção só se o número de documentos mudou (o resto, via refresh())
+        collection = getattr(self.vectorstore, "_collection", None)
+        if self._matrix is None or (collection is not None and collection.count() != self._matrix.count):
+            self._matrix = EmbeddingMatrix(self.vectorstore)
+        return self._matrix
+
+    def refresh(self):
+        """
+        Descarta a matriz em memória: a próxima busca relê textos e embeddings da coleção.
+        """
+        self._matrix = None
+
+    def _document(self, row):
+        if hasattr(self.vectorstore, "mmr_candidates"):
+            return self.vectorstore._document(int(row))
+        return self._embedding_matrix().document(int(row))
+
+    def _candidates(self, vector, fetch_k, filter):
+        """
+        (linhas, matriz normalizada dos candidatos), em ordem de relevância.
+        """
+        if hasattr(self.vectorstore, "mmr_candidates"):
+            return self.vectorstore.mmr_candidates(vector, fetch_k, filter, self.search_kwargs.get("nprobe"))
+        store = self._embedding_matrix()
+        scores = store.matrix @ vector
+        mask = store.mask(filter)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            fetch_k = min(fetch_k, int(mask.sum()))
+        rows = top_k_indices(scores, fetch_k)
+        return rows, store.matrix[rows]
+
+    def _options(self):
+        kwargs = self.search_kwargs
+        return kwargs.get("k", 4), kwargs.get("fetch_k", 20), kwargs.get("lambda_mult", 0.5), kwargs.get("filter")
+
+    # --- Busca ---
+
+    def _get_relevant_documents(self, query, *, run_manager, **kwargs):
+        if self.search_type != "mmr_matrix":
+            return super()._get_relevant_documents(query, run_manager=run_manager, **kwargs)
+        k, fetch_k, lambda_mult, filter = self._options()
+        vector = normalize_rows(self.vectorstore.embeddings.embed_query(query))
+        rows, candidates = self._candidates(vector, fetch_k, filter)
+        selected = mmr_select(vector, candidates, k, lambda_mult, normalized=True)
+        return [self._document(rows[i]) for i in sorted(selected)]
+
+    async def _aget_relevant_documents(self, query, *, run_manager, **kwargs):
+        if self.search_type != "mmr_matrix":
+            return await super()._aget_relevant_documents(query, run_manager=run_manager, **kwargs)
+        # Embedding e álgebra bloqueiam: fora do event loop
+        return await asyncio.to_thread(self._get_relevant_documents, query, run_manager=run_manager, **kwargs)
+
+    def search_batch(self, queries):
+        """
+        MMR de várias consultas: um pedido de embeddings e a seleção em lote.
+        """
+        k, fetch_k, lambda_mult, filter = self._options()
+        if not queries:
+            return []
+        vectors = normalize_rows(self.vectorstore.embeddings.embed_documents(list(queries)))
+
+        if hasattr(self.vectorstore, "mmr_candidates") or filter:
+            per_query = [self._candidates(vector, fetch_k, filter) for vector in vectors]
+            size = max(len(rows) for rows, _ in per_query)
+            rows = np.zeros((len(vectors), size), dtype=np.int64)
+            candidates = np.zeros((len(vectors), size, vectors.shape[1]), dtype=np.float32)
+            valid = np.zeros((len(vectors), size), dtype=bool)
+            for i, (query_rows, matrix) in enumerate(per_query):
+                rows[i, :len(query_rows)] = query_rows
+                candidates[i, :len(query_rows)] = matrix
+                valid[i, :len(query_rows)] = True
+        else:
+            # Todas as consultas contra a matriz da coleção num único produto de matrizes
+            store = self._embedding_matrix()
+            rows, _ = top_k_rows(vectors @ store.matrix.T, fetch_k)
+            candidates = store.matrix[rows]
+            valid = None
+
+        selected = mmr_select_batch(vectors, candidates, k, lambda_mult, valid=valid, normalized=True)
+        return [[self._document(query_rows[i]) for i in sorted(picks) if i >= 0]
+                for query_rows, picks in zip(rows, selected)]
+
+
+def as_retriever(vectorstore, **kwargs):
+    """
+    vectorstore.as_retriever(...) que também aceita search_type="mmr_matrix".
+    """
+    return MatrixMMRRetriever(vectorstore=vectorstore, **kwargs)
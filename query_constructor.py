@@ -0,0 +1,530 @@
+import calendar
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+from langchain_core.runnables import Runnable
+from langchain_core.structured_query import Comparator, Comparison, Operation, Operator, StructuredQuery
+
+from answer_cache import normalize_question
+
+# Caminho rápido para o query constructor do SelfQueryRetriever.
+#
+# O SelfQueryRetriever chama o LLM em toda pergunta só para transformar "in the third
+# lecture" em {"source": ".../MachineLearning-Lecture03.pdf"}. O FastQueryConstructor
+# fica no lugar do query_constructor e tenta, nesta ordem:
+#   1. RuleQueryParser, com regras montadas a partir dos AttributeInfo:
+#        - atributo com os valores listados entre crases na descrição (ex: source):
+#          "third lecture", "lecture 3", "3rd lecture", "last lecture" -> o valor com esse número;
+#          "lecture 1 and lecture 2" -> um OU o outro
+#        - atributo inteiro (ex: page): "page 5", "pages 3 to 5"
+#        - data: "2024-03-05", "March 5, 2024" e, com type="date", "in 2024" / "in March 2024"
+#      Só responde quando tem certeza. Número fora da lista, palavra do atributo sem
+#      número ("the lecture about..."), quantidade em vez de posição ("two lectures",
+#      "first two lectures"), intervalo em atributo de valores listados ("lectures 1 to 3",
+#      "lectures 2-3") ou comparador que o vector store não aceita: passa adiante.
+#      A consulta que sobra é recortada da pergunta original, com maiúsculas e acentos.
+#      python query_constructor.py confere as regras com os exemplos de rule_examples
+#   2. cache das respostas do LLM pela pergunta normalizada (SQLite, LRU)
+#   3. o query constructor original (LLM), cuja resposta vai para o cache
+#
+#   retriever = SelfQueryRetriever.from_llm(llm, vectordb, document_content_description, metadata_field_info)
+#   retriever.query_constructor = FastQueryConstructor(
+#       retriever.query_constructor, metadata_field_info, document_content_description,
+#       translator=retriever.structured_query_translator)
+
+default_cache_file = 'vectordb/query_cache.sqlite'
+
+ordinals = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5,
+    "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10,
+    "primeira": 1, "segunda": 2, "terceira": 3, "quarta": 4, "quinta": 5,
+    "sexta": 6, "setima": 7, "oitava": 8, "nona": 9, "decima": 10,
+    "primeiro": 1, "segundo": 2, "terceiro": 3, "quarto": 4, "quinto": 5,
+    "sexto": 6, "setimo": 7, "oitavo": 8, "nono": 9, "decimo": 10,
+}
+# Sem "one"/"um"/"uma": "one of the lectures", "uma aula" não indicam qual
+cardinals = {
+    "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "dois": 2, "duas": 2, "tres": 3, "quatro": 4, "cinco": 5, "seis": 6, "sete": 7, "oito": 8, "nove": 9, "dez": 10,
+}
+last_words = ("last", "final", "ultima", "ultimo")
+months = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+months.update({"janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6, "julho": 7,
+               "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12})
+
+_words = sorted(ordinals.keys() | cardinals.keys() | set(last_words), key=len, reverse=True)
+# "3rd", "3a" (3ª sem acento), "third", "three", "last"
+_number = r"(?:\d+(?:st|nd|rd|th|o|a)?|" + "|".join(_words) + r")\b"
+_number_list = rf"{_number}(?:\s*(?:,|and|or|e|ou)\s*{_number})*"
+_month = "(?:" + "|".join(sorted(months, key=len, reverse=True)) + ")"
+_connectors = re.compile(r"(?:\b(?:in|on|from|at|of|during|the|for|between|na|no|nas|nos|da|do|das|dos|em|de|"
+                         r"entre|durante)\s*)+$", re.IGNORECASE)
+# Entre dois trechos de filtro ("lecture 1 and lecture 2"): some junto com eles
+_joiners = re.compile(r"\s*(?:,|&|and|or|e|ou|vs\.?|versus)?\s*", re.IGNORECASE)
+# Intervalo ou número colado ao trecho: "lectures 1 to 3", "lectures 2-3", "3rd to 5th lectures"
+_range_words = r"(?:-|\u2013|/|\bto\b|\bthrough\b|\bthru\b|\buntil\b|\ba\b|\bate\b)"
+_number_after = re.compile(rf"\s*(?:{_range_words}\s*{_number}|\d)")
+_number_before = re.compile(rf"\b{_number}\s*{_range_words}?\s*$")
+
+
+def fold(text):
+    # Minúsculas e sem acento, mas com a pontuação (as posições servem para recortar a pergunta)
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def fold_positions(text):
+    """
+    (fold(text), posição no texto original de cada caractere do texto dobrado).
+    """
+    folded = []
+    positions = []
+    for i, c in enumerate(text):
+        f = fold(c)
+        folded.append(f)
+        positions.extend([i] * len(f))
+    return "".join(folded), positions
+
+
+def number_of(token, last=None):
+    if token[0].isdigit():
+        return int(re.match(r"\d+", token).group())
+    if token in last_words:
+        return last
+    return ordinals.get(token) or cardinals.get(token)
+
+
+def is_ordinal(token):
+    return token in ordinals or token in last_words or re.fullmatch(r"\d+(?:st|nd|rd|th|o|a)", token) is not None
+
+
+def attribute_fields(info):
+    if isinstance(info, dict):
+        return info["name"], info.get("description", ""), info.get("type", "string")
+    return info.name, info.description, info.type
+
+
+# --- Serialização (cache) ---
+
+def filter_to_dict(node):
+    if node is None:
+        return None
+    if isinstance(node, Comparison):
+        return {"comparator": node.comparator.value, "attribute": node.attribute, "value": node.value}
+    return {"operator": node.operator.value, "arguments": [filter_to_dict(a) for a in node.arguments]}
+
+
+def filter_from_dict(data):
+    if data is None:
+        return None
+    if "comparator" in data:
+        return Comparison(comparator=Comparator(data["comparator"]), attribute=data["attribute"], value=data["value"])
+    return Operation(operator=Operator(data["operator"]), arguments=[filter_from_dict(a) for a in data["arguments"]])
+
+
+class Unsure(Exception):
+    # A regra reconheceu o atributo mas não tem uma resposta segura: vai para o LLM
+    pass
+
+
+class RuleQueryParser:
+
+    def __init__(self, metadata_field_info, aliases=None, allowed_comparators=None, allowed_operators=None):
+        """
+        aliases = {atributo: [palavras]} além das tiradas do AttributeInfo (ex: {"source": ["aula"]}).
+        """
+        aliases = aliases or {}
+        self.allowed_comparators = set(allowed_comparators or Comparator)
+        self.allowed_operators = set(allowed_operators or Operator)
+
+        self.choices = {}  # atributo -> {número: valor}
+        self.numeric = set()
+        self.dates = {}  # atributo -> type
+        self.nouns = {}  # atributo -> regex das palavras que o citam
+
+        for info in metadata_field_info:
+            name, description, kind = attribute_fields(info)
+            words = {fold(name)} | {fold(alias) for alias in aliases.get(name, ())}
+            values = re.findall(r"`([^`]+)`", description)
+
+            if values and kind == "string":
+                by_number = {}
+                for value in values:
+                    numbers = re.findall(r"\d+", value)
+                    if numbers:
+                        by_number.setdefault(int(numbers[-1]), []).append(value)
+                # Dois valores com o mesmo número: nenhum dos dois é escolhido por regra
+                self.choices[name] = {n: found[0] for n, found in by_number.items() if len(found) == 1}
+                # Palavras da descrição que também aparecem nos valores ("lecture" em ".../Lecture01.pdf")
+                folded_values = " ".join(fold(value) for value in values)
+                words |= {w for w in re.findall(r"[a-z]+", fold(description.split("`", 1)[0]))
+                          if len(w) > 3 and w in folded_values}
+            elif kind in ("integer", "int", "float", "number"):
+                self.numeric.add(name)
+            elif kind == "date" or "date" in fold(name) or re.search(r"\b(date|data)\b", fold(description)):
+                self.dates[name] = kind
+                continue
+            else:
+                continue
+            self.nouns[name] = "(?:" + "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)) + ")s?"
+
+    # --- Filtros ---
+
+    def _comparison(self, comparator, name, value):
+        if comparator not in self.allowed_comparators:
+            raise Unsure(f"{comparator.value} não é aceito pelo vector store")
+        return Comparison(comparator=comparator, attribute=name, value=value)
+
+    def _operation(self, operator, arguments):
+        if len(arguments) == 1:
+            return arguments[0]
+        if operator not in self.allowed_operators:
+            raise Unsure(f"{operator.value} não é aceito pelo vector store")
+        return Operation(operator=operator, arguments=arguments)
+
+    def _range(self, name, low, high):
+        return self._operation(Operator.AND, [self._comparison(Comparator.GTE, name, low),
+                                              self._comparison(Comparator.LTE, name, high)])
+
+    # --- Regras ---
+
+    def _mentions(self, name, text, spans):
+        noun = self.nouns[name]
+        numeric = name in self.numeric
+        found = []
+
+        if numeric:
+            pattern = rf"\b{noun}\s+(?P<low>\d+)\s*(?:-|to|through|thru|a|ate)\s*(?P<high>\d+)\b"
+            for match in re.finditer(pattern, text):
+                found.append(self._range(name, int(match["low"]), int(match["high"])))
+                spans.append(match.span())
+
+        pattern = (rf"\b(?P<before>{_number_list})\s+{noun}\b"
+                   rf"|\b{noun}\s+(?:number\s+|numero\s+|n\.?\s*)?(?P<after>{_number_list})")
+        for match in re.finditer(pattern, text):
+            if any(start <= match.start() < end for start, end in spans):
+                continue
+            tokens = re.findall(_number, match["before"] or match["after"])
+            if match["before"]:
+                # Antes do atributo, só ordinal: "two lectures", "five pages" são quantidade, não qual
+                if not all(is_ordinal(token) for token in tokens):
+                    raise Unsure(f"{name}: quantidade em vez de posição ({match['before']})")
+                # "first two lectures" (quantificadores empilhados), "3rd to 5th lectures" (intervalo)
+                if _number_before.search(text[:match.start()]):
+                    raise Unsure(f"{name}: número antes de {match['before']!r} fora da regra")
+            elif _number_after.match(text, match.end()):
+                # "lectures 1 to 3", "lectures 2-3": o intervalo ficaria de fora do filtro
+                raise Unsure(f"{name}: número depois de {match['after']!r} fora da regra")
+            if numeric:
+                values = [number_of(token) for token in tokens]
+                if None in values:
+                    raise Unsure(f"{name}: número inválido")
+            else:
+                choices = self.choices[name]
+                numbers = [number_of(token, last=max(choices, default=None)) for token in tokens]
+                if any(n not in choices for n in numbers):
+                    raise Unsure(f"{name}: {tokens} fora dos valores conhecidos")
+                values = [choices[n] for n in numbers]
+            found.append(self._operation(Operator.OR, [self._comparison(Comparator.EQ, name, v) for v in values]))
+            spans.append(match.span())
+
+        # O atributo é citado fora das regras ("the lecture about..."): melhor o LLM decidir
+        for match in re.finditer(rf"\b{noun}\b", text):
+            if not any(start <= match.start() < end for start, end in spans):
+                raise Unsure(f"{name} citado sem valor reconhecido")
+        if len(found) > 1:
+            # "lecture 1 and lecture 2": um documento só tem um valor, então é OU
+            arguments = []
+            for condition in found:
+                if isinstance(condition, Operation) and condition.operator == Operator.OR:
+                    arguments.extend(condition.arguments)
+                else:
+                    arguments.append(condition)
+            found = [self._operation(Operator.OR, arguments)]
+        return found
+
+    def _date_value(self, name, iso):
+        return {"date": iso, "type": "date"} if self.dates[name] == "date" else iso
+
+    def _dates(self, name, text, spans):
+        found = []
+        patterns = [
+            (rf"\b(?P<y>\d{{4}})-(?P<m>\d{{1,2}})-(?P<d>\d{{1,2}})\b", "day"),
+            (rf"\b(?P<month>{_month})\s+(?P<d>\d{{1,2}})(?:st|nd|rd|th)?,?\s+(?P<y>\d{{4}})\b", "day"),
+            (rf"\b(?P<d>\d{{1,2}})(?:\s+de)?\s+(?P<month>{_month})(?:\s+de)?\s+(?P<y>\d{{4}})\b", "day"),
+            (rf"\b(?P<month>{_month})(?:\s+de|,)?\s+(?P<y>\d{{4}})\b", "month"),
+            (rf"\b(?:in|em|during|durante|de)\s+(?P<y>\d{{4}})\b", "year"),
+        ]
+        for pattern, precision in patterns:
+            for match in re.finditer(pattern, text):
+                if any(start <= match.start() < end for start, end in spans):
+                    continue
+                groups = match.groupdict()
+                year = int(groups["y"])
+                month = int(groups["m"]) if groups.get("m") else months.get(groups.get("month"), 1)
+                if precision == "day":
+                    try:
+                        iso = datetime.date(year, month, int(groups["d"])).isoformat()
+                    except ValueError:
+                        raise Unsure(f"{name}: data inválida")
+                    found.append(self._comparison(Comparator.EQ, name, self._date_value(name, iso)))
+                else:
+                    # Intervalo só com datas de verdade: comparar strings com gte/lte não funciona em todo store
+                    if self.dates[name] != "date":
+                        raise Unsure(f"{name}: intervalo de datas num atributo string")
+                    first, last = (month, month) if precision == "month" else (1, 12)
+                    end_day = calendar.monthrange(year, last)[1]
+                    found.append(self._range(name, self._date_value(name, f"{year:04d}-{first:02d}-01"),
+                                             self._date_value(name, f"{year:04d}-{last:02d}-{end_day:02d}")))
+                spans.append(match.span())
+        if len(found) > 1:
+            raise Unsure(f"{name}: mais de uma data")
+        return found
+
+    def _residual(self, text, spans):
+        # Pergunta sem os trechos que viraram filtro (e sem o "in the" antes deles nem o "and" entre eles)
+        merged = []
+        for start, end in sorted(spans):
+            if merged and _joiners.fullmatch(text, merged[-1][1], start):
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        for start, end in reversed(merged):
+            text = _connectors.sub("", text[:start].rstrip()).rstrip() + " " + text[end:].lstrip()
+        text = re.sub(r"\s+([,.?!;:])", r"\1", " ".join(text.split()))
+        return text.strip(" ,;:")
+
+    def parse(self, question):
+        """
+        StructuredQuery ou None (sem filtro reconhecido ou sem certeza).
+        """
+        text, positions = fold_positions(question)
+        spans = []
+        filters = []
+        try:
+            for name in self.nouns:
+                filters.extend(self._mentions(name, text, spans))
+            for name in self.dates:
+                filters.extend(self._dates(name, text, spans))
+            if not filters:
+                return None
+            condition = self._operation(Operator.AND, filters)
+        except Unsure:
+            return None
+        # Consulta recortada da pergunta original (com maiúsculas e acentos); pergunta que era
+        # só filtro ("pages 3 to 5 in lecture 1") fica com a consulta vazia
+        spans = [(positions[start], positions[end - 1] + 1) for start, end in spans]
+        return StructuredQuery(query=self._residual(question, spans), filter=condition, limit=None)
+
+
+class FastQueryConstructor(Runnable):
+
+    def __init__(self, constructor, metadata_field_info, document_contents="", translator=None, aliases=None,
+                 cache_file=default_cache_file, max_entries=10_000):
+        """
+        constructor = o query_constructor original (LLM), usado quando as regras não bastam.
+        translator = structured_query_translator do retriever (limita os comparadores das regras).
+        """
+        self.constructor = constructor
+        self.parser = RuleQueryParser(
+            metadata_field_info, aliases,
+            allowed_comparators=getattr(translator, "allowed_comparators", None),
+            allowed_operators=getattr(translator, "allowed_operators", None),
+        )
+        self.max_entries = max_entries
+
+        # Mudou a descrição ou os atributos, as respostas antigas do LLM não valem
+        schema = json.dumps([document_contents, [attribute_fields(info) for info in metadata_field_info]],
+                            ensure_ascii=False)
+        self.schema = hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+
+        self.rule_hits = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS structured_queries ("
+            " key TEXT PRIMARY KEY,"
+            " question TEXT NOT NULL,"
+            " structured TEXT NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS structured_queries_last_used ON structured_queries(last_used)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM structured_queries").fetchone()
+        self._clock = row[0]
+
+    # --- Cache ---
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _key(self, question):
+        return hashlib.sha256(f"{self.schema}\0{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT structured FROM structured_queries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE structured_queries SET last_used = ? WHERE key = ?", (self._tick(), key))
+            self._conn.commit()
+        data = json.loads(row[0])
+        return StructuredQuery(query=data["query"], filter=filter_from_dict(data["filter"]), limit=data["limit"])
+
+    def _put(self, key, question, structured):
+        payload = json.dumps({"query": structured.query, "filter": filter_to_dict(structured.filter),
+                              "limit": structured.limit}, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO structured_queries (key, question, structured, last_used) VALUES (?, ?, ?, ?)",
+                (key, question, payload, self._tick())
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM structured_queries").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM structured_queries WHERE key IN ("
+                    " SELECT key FROM structured_queries ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    # --- Runnable ---
+
+    def _fast(self, question):
+        structured = self.parser.parse(question)
+        if structured is not None:
+            self.rule_hits += 1
+            return structured, None
+        key = self._key(question)
+        structured = self._get(key)
+        if structured is not None:
+            self.cache_hits += 1
+        return structured, key
+
+    def invoke(self, input, config=None, **kwargs):
+        question = input["query"] if isinstance(input, dict) else input
+        structured, key = self._fast(question)
+        if structured is None:
+            self.llm_calls += 1
+            structured = self.constructor.invoke(input, config, **kwargs)
+            self._put(key, question, structured)
+        return structured
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        question = input["query"] if isinstance(input, dict) else input
+        structured, key = self._fast(question)
+        if structured is None:
+            self.llm_calls += 1
+            structured = await self.constructor.ainvoke(input, config, **kwargs)
+            self._put(key, question, structured)
+        return structured
+
+    # --- Métricas ---
+
+    def stats(self):
+        total = self.rule_hits + self.cache_hits + self.llm_calls
+        return {
+            "rule_hits": self.rule_hits,
+            "cache_hits": self.cache_hits,
+            "llm_calls": self.llm_calls,
+            "without_llm": (self.rule_hits + self.cache_hits) / total if total else 0.0,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"Query constructor: {stats['rule_hits']} por regras, {stats['cache_hits']} do cache, "
+              f"{stats['llm_calls']} chamadas ao LLM ({stats['without_llm']:.1%} sem LLM)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- Verificação das regras (sem LLM) ---
+
+# (pergunta, filtro esperado como em filter_to_dict ou None = vai para o LLM, consulta esperada)
+rule_examples = [
+    ("what did they say about regression in the third lecture?",
+     {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture03.pdf"},
+     "what did they say about regression?"),
+    ("what about matlab on page 5?", {"comparator": "eq", "attribute": "page", "value": 5}, "what about matlab?"),
+    ("pages 3 to 5 in lecture 1",
+     {"operator": "and", "arguments": [
+         {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture01.pdf"},
+         {"operator": "and", "arguments": [{"comparator": "gte", "attribute": "page", "value": 3},
+                                           {"comparator": "lte", "attribute": "page", "value": 5}]}]},
+     ""),
+    ("in the first and second lectures, what about matlab?",
+     {"operator": "or", "arguments": [
+         {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture01.pdf"},
+         {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture02.pdf"}]},
+     "what about matlab?"),
+    ("regression in the 2nd lecture",
+     {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture02.pdf"},
+     "regression"),
+    # Quantidade, não posição: quem decide é o LLM
+    ("How do the two lectures compare on regression?", None, None),
+    ("Compare three lectures on gradient descent", None, None),
+    ("in the first two lectures, what about matlab?", None, None),
+    ("five pages about matlab", None, None),
+    ("what is said in 3 lectures about svm?", None, None),
+    # Mais de uma menção do mesmo atributo: OU, e o "and" entre elas sai da consulta
+    ("compare lecture 1 and lecture 2 on svm",
+     {"operator": "or", "arguments": [
+         {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture01.pdf"},
+         {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture02.pdf"}]},
+     "compare on svm"),
+    # Intervalo num atributo de valores listados: quem decide é o LLM
+    ("lectures 1 to 3 on matlab", None, None),
+    ("matlab in lectures 2-3", None, None),
+    ("matlab in the 1st to 3rd lectures", None, None),
+    # A consulta mantém maiúsculas e acentos da pergunta
+    ("What does Ng say about Régression in Lecture 3?",
+     {"comparator": "eq", "attribute": "source", "value": "docs/cs229_lectures/MachineLearning-Lecture03.pdf"},
+     "What does Ng say about Régression?"),
+]
+
+example_metadata_field_info = [
+    {"name": "source", "type": "string",
+     "description": "The lecture the chunk is from, should be one of `docs/cs229_lectures/MachineLearning-Lecture01.pdf`, "
+                    "`docs/cs229_lectures/MachineLearning-Lecture02.pdf`, or "
+                    "`docs/cs229_lectures/MachineLearning-Lecture03.pdf`"},
+    {"name": "page", "type": "integer", "description": "The page from the lecture"},
+]
+
+
+def main():
+    from langchain_community.query_constructors.chroma import ChromaTranslator
+
+    translator = ChromaTranslator()
+    parser = RuleQueryParser(example_metadata_field_info, allowed_comparators=translator.allowed_comparators,
+                             allowed_operators=translator.allowed_operators)
+    failures = 0
+    for question, expected_filter, expected_query in rule_examples:
+        structured = parser.parse(question)
+        got_filter = filter_to_dict(structured.filter) if structured else None
+        ok = got_filter == expected_filter and (structured is None or structured.query == expected_query)
+        failures += not ok
+        print(f"{'ok  ' if ok else 'ERRO'} {question!r} -> {got_filter}"
+              f"{f' / {structured.query!r}' if structured else ''}")
+    print(f"{len(rule_examples) - failures} de {len(rule_examples)} exemplos corretos")
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+import collections
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+from pydantic import PrivateAttr
+
+from context_packer import split_sentences
+from embedding_pipeline import get_token_counter
+
+# Compressão local dos documentos recuperados, no lugar do LLMChainExtractor.
+#
+# O LLMChainExtractor faz uma chamada ao LLM por documento só para recortar o texto.
+# Aqui cada documento é quebrado em frases, as frases são comparadas com a pergunta
+# por cosseno entre embeddings e ficam as mais parecidas (max_sentences por
+# documento, max_tokens no total), na ordem original do texto. Documentos sem
+# nenhuma frase acima de min_similarity saem, como o NO_OUTPUT do extractor.
+#
+# Os embeddings custam no máximo uma chamada por compressão (só as frases nunca
+# vistas, todas num lote): as frases já vistas ficam num LRU em memória e, com um
+# CachedEmbeddings, no SQLite compartilhado com a indexação. Um documento de uma
+# frase só é embedado pelo texto do chunk (doc.page_content), a mesma chave que a
+# indexação gravou no cache. As demais frases são embedadas na primeira consulta que
+# as traz e, passando o mesmo CachedEmbeddings da indexação, nunca mais pagam a API.
+# index_sentences() (store_docs(sentences=True) no 3-doc-embed.py) adianta tudo para a
+# indexação, ao custo de embedar cada frase do corpus mesmo sem compressão.
+# O resto é um produto matriz-vetor em NumPy.
+#
+#   compressor = EmbeddingSentenceCompressor(embedding=CachedEmbeddings(OpenAIEmbeddings()))
+#   ContextualCompressionRetriever(base_compressor=compressor, base_retriever=vectordb.as_retriever())
+
+
+def sentences_of(text, min_chars=20):
+    """
+    Frases do texto; pedaços menores que min_chars (ex: "Okay.") se juntam à frase anterior.
+    """
+    sentences = []
+    for sentence in split_sentences(text):
+        if sentences and len(sentence) < min_chars:
+            sentences[-1] += " " + sentence
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+def index_sentences(embedding, docs, min_chars=20, batch_size=500):
+    """
+    Embeda as frases dos documentos na indexação. Com um CachedEmbeddings, a
+    compressão depois só encontra hits.
+    """
+    unique = list(dict.fromkeys(s for doc in docs for s in sentences_of(doc.page_content, min_chars)))
+    for start in range(0, len(unique), batch_size):
+        embedding.embed_documents(unique[start:start + batch_size])
+    return len(unique)
+
+
+class EmbeddingSentenceCompressor(BaseDocumentCompressor):
+
+    embedding: Any
+    max_sentences: int = 3
+    max_tokens: Optional[int] = None
+    min_similarity: Optional[float] = None
+    min_chars: int = 20
+    model: str = "gpt-3.5-turbo"
+    cache_size: int = 50_000
+
+    _vectors: Any = PrivateAttr(default_factory=collections.OrderedDict)
+    _stats: Any = PrivateAttr(default_factory=lambda: collections.deque(maxlen=1000))
+
+    # --- Vetores ---
+
+    def _normalized(self, vectors):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _sentence_vectors(self, sentences):
+        """
+        Vetores normalizados de cada texto; os que não estão no LRU vão num único lote.
+        Retorna (matriz, quantos não estavam no LRU).
+        """
+        missing = [s for s in dict.fromkeys(sentences) if s not in self._vectors]
+        if missing:
+            for sentence, vector in zip(missing, self._normalized(self.embedding.embed_documents(missing))):
+                self._vectors[sentence] = vector
+        for sentence in sentences:
+            self._vectors.move_to_end(sentence)
+        matrix = np.stack([self._vectors[s] for s in sentences]) if sentences else np.zeros((0, 0), np.float32)
+        while len(self._vectors) > self.cache_size:
+            self._vectors.popitem(last=False)
+        return matrix, len(missing)
+
+    # --- Seleção ---
+
+    def _select(self, splits, scores):
+        """
+        [(documento, posição da frase)] mantidos: maiores notas primeiro, até
+        max_sentences por documento e max_tokens no total.
+        """
+        count_tokens = get_token_counter(self.model)
+        candidates = [(score, i, j) for i, split in enumerate(splits) for j, score in enumerate(scores[i])]
+        candidates.sort(key=lambda c: -c[0])
+
+        kept = collections.defaultdict(list)
+        used = 0
+        for score, i, j in candidates:
+            if self.min_similarity is not None and score < self.min_similarity:
+                break
+            if len(kept[i]) >= self.max_sentences:
+                continue
+            tokens = count_tokens(splits[i][j])
+            if self.max_tokens is not None and used + tokens > self.max_tokens:
+                continue
+            kept[i].append(j)
+            used += tokens
+        return kept
+
+    def compress_documents(self, documents, query, callbacks=None):
+        started = time.perf_counter()
+        splits = [sentences_of(doc.page_content, self.min_chars) for doc in documents]
+
+        sentences = [s for split in splits for s in split]
+        # Documento de uma frase: o texto do chunk, como foi embedado (e cacheado) na indexação
+        keys = [s for doc, split in zip(documents, splits)
+                for s in ([doc.page_content] if len(split) == 1 else split)]
+        matrix, embedded = self._sentence_vectors(keys)
+        query_vector = self._normalized(self.embedding.embed_query(query))
+
+        flat_scores = matrix @ query_vector if len(sentences) else np.zeros(0, np.float32)
+        scores = []
+        offset = 0
+        for split in splits:
+            scores.append(flat_scores[offset:offset + len(split)])
+            offset += len(split)
+
+        kept = self._select(splits, scores)
+        compressed = []
+        for i, doc in enumerate(documents):
+            if not kept.get(i):
+                continue
+            text = " ".join(splits[i][j] for j in sorted(kept[i]))
+            metadata = {**doc.metadata, "compression_score": float(max(scores[i][j] for j in kept[i]))}
+            compressed.append(Document(page_content=text, metadata=metadata))
+
+        self._stats.append({
+            "documents": len(documents),
+            "kept_documents": len(compressed),
+            "sentences": len(sentences),
+            "kept_sentences": sum(len(indices) for indices in kept.values()),
+            "embedded": embedded,
+            "chars_in": sum(len(doc.page_content) for doc in documents),
+            "chars_out": sum(len(doc.page_content) for doc in compressed),
+            "seconds": time.perf_counter() - started,
+        })
+        return compressed
+
+    # --- Métricas ---
+
+    def print_stats(self):
+        if not self._stats:
+            print("Compressão: nenhuma consulta ainda")
+            return
+        total = lambda name: sum(stat[name] for stat in self._stats)
+        chars_in = total("chars_in")
+        print(f"Compressão: {len(self._stats)} consultas, {total('kept_sentences')} de {total('sentences')} frases "
+              f"mantidas ({total('chars_out') / chars_in if chars_in else 0:.1%} do texto); "
+              f"{total('embedded')} frases fora da memória (embedadas ou lidas do CachedEmbeddings); "
+              f"{1000 * total('seconds') / len(self._stats):.1f} ms por consulta")
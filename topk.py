@@ -0,0 +1,31 @@
+import numpy as np
+
+# Seleção de top-k sem ordenar o vetor inteiro, usada pelas buscas.
+
+
+def top_k_indices(scores, k):
+    """
+    Índices dos k maiores scores, em ordem decrescente.
+    argpartition é O(N); só os k escolhidos são ordenados.
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.array([], dtype=np.int64)
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def top_k_rows(scores, k):
+    """
+    Top-k de cada linha de uma matriz densa (uma consulta por linha).
+    Retorna (índices, scores), ambos (linhas x k), cada linha em ordem decrescente.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.zeros((scores.shape[0], 0), dtype=np.int64)
+        return empty, empty.astype(scores.dtype)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
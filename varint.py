@@ -0,0 +1,56 @@
+import numpy as np
+
+# Codificação varint (7 bits por byte, bit 0x80 = "continua no próximo byte"),
+# vetorizada com numpy. Usada nas listas de postings dos índices invertidos:
+# números pequenos (deltas entre posições, frequências) ocupam 1 byte.
+
+
+def encode_varints(values):
+    """
+    Inteiros não negativos -> (bytes como array uint8, início de cada valor no array).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    # Quantos bytes cada valor ocupa (pelo menos 1)
+    sizes = np.ones(len(values), dtype=np.int64)
+    remaining = values >> np.uint64(7)
+    while remaining.any():
+        sizes += remaining > 0
+        remaining >>= np.uint64(7)
+
+    starts = np.zeros(len(values), dtype=np.int64)
+    if len(values):
+        starts[1:] = np.cumsum(sizes)[:-1]
+    out = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    for byte in range(int(sizes.max()) if len(sizes) else 0):
+        active = sizes > byte
+        value = (values[active] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        more = (sizes[active] > byte + 1).astype(np.uint8) << 7
+        out[starts[active] + byte] = value.astype(np.uint8) | more
+    return out, starts
+
+
+def decode_varints(data):
+    data = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    last = data < 0x80
+    group = np.zeros(len(data), dtype=np.int64)
+    group[1:] = np.cumsum(last)[:-1]
+    group_start = np.zeros(int(last.sum()), dtype=np.int64)
+    group_start[1:] = np.flatnonzero(last)[:-1] + 1
+    shift = 7 * (np.arange(len(data)) - group_start[group])
+    # float64 é exato até 2**53: sobra para posições e frequências
+    values = np.bincount(group, weights=(data & 0x7F).astype(np.float64) * (2.0 ** shift))
+    return values.astype(np.int64)
+
+
+def encode_postings(rows):
+    """
+    Lista ordenada de posições -> bytes (deltas em varint).
+    """
+    deltas = np.diff(np.asarray(rows, dtype=np.int64), prepend=0)
+    return encode_varints(deltas)[0].tobytes()
+
+
+def decode_postings(data, base=0):
+    return np.cumsum(decode_varints(data)) + base